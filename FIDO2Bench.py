@@ -0,0 +1,473 @@
+import os
+import sys
+import re
+import time
+import json
+import shutil
+import getopt
+import hashlib
+import tempfile
+import resource
+import tracemalloc
+
+"""
+Benchmarks of FIDO2Verif.py itself, without ProVerif
+A stub of ProVerif (python FIDO2Bench.py stub) prints outputs like ProVerif with the verdicts chosen by a hash,
+so the cost of FIDO2Verif.py is measured apart from the time of the solver:
+the Generator, the secure/insecure sets, rendering and writing the .pv files, running and parsing ProVerif,
+and writing the results.
+1.  run analysis() for every phase against the stub, report the cases per second and the time of each part
+2.  the cost of the checks of the secure/insecure sets as the number of alternatives grows (5 -> 12 by default)
+3.  the memory and the time of the combinations of n fields and n entities (n = 5, 10, 16 by default)
+4.  the cases run by the frontier search against the sweep, with the verdicts of the stub with --monotone
+5.  the peak memory
+the report can be saved as json and compared with a baseline to find the regressions, for example in CI
+"""
+
+
+class Stub:
+    """
+    a fake ProVerif, run by FIDO2Verif.py as "python FIDO2Bench.py stub -lib FIDO2.pvl file.pv"
+    the settings are given by environment variables
+    FIDO2BENCH_LATENCY : seconds spent on each query, 0 by default
+    FIDO2BENCH_FALSE   : the ratio of the queries found false, 0.3 by default
+    FIDO2BENCH_PROVE   : the ratio of the queries which cannot be proved, 0.05 by default
+    FIDO2BENCH_MONOTONE: if set, a query is false when the case uses the public channel cP more than a threshold
+                         of the query, so more compromised fields and entities give more attacks, as in the model
+    FIDO2BENCH_RECORDED: a directory of outputs recorded from ProVerif, true.txt, false.txt and prove.txt,
+                         the one of the verdict is printed before the RESULT line of each query
+    """
+    endings = {"true": "is true.", "false": "is false.", "prove": "cannot be proved."}
+
+    def __init__(self):
+        self.latency = float(os.environ.get("FIDO2BENCH_LATENCY", "0"))
+        self.false = float(os.environ.get("FIDO2BENCH_FALSE", "0.3"))
+        self.prove = float(os.environ.get("FIDO2BENCH_PROVE", "0.05"))
+        self.monotone = bool(os.environ.get("FIDO2BENCH_MONOTONE"))
+        self.recorded = os.environ.get("FIDO2BENCH_RECORDED")
+
+    def verdict(self, text, query):
+        if self.monotone:
+            ctap = re.search(r"let ctap_type = (\w+)", text)
+            seed = query + (ctap.group(1) if ctap else "")
+            threshold = int(hashlib.md5(seed.encode()).hexdigest(), 16) % 6 + 3
+            return "false" if text.count("cP") > threshold else "true"
+        h = int(hashlib.md5((query + text).encode()).hexdigest(), 16) % 10000 / 10000.0
+        if h < self.false:
+            return "false"
+        if h < self.false + self.prove:
+            return "prove"
+        return "true"
+
+    def replay(self, verdict):
+        if not self.recorded:
+            return ""
+        path = os.path.join(self.recorded, verdict + ".txt")
+        if not os.path.exists(path):
+            return ""
+        f = open(path, encoding="latin-1")
+        text = f.read()
+        f.close()
+        return text
+
+    def run(self, args):
+        if "-help" in args:
+            print("Proverif stub of FIDO2Bench.py")
+            return
+        f = open(args[-1])
+        text = f.read()
+        f.close()
+        queries = [" ".join(query.split()) for query in re.findall(r"^query (.*?)\.\s*$", text, re.M | re.S)]
+        if not queries and "choice[" in text:  # a model with choice[] is verified for observational equivalence
+            queries = ["Observational equivalence"]
+        out = ["Process 0 (that is, the initial process):"]
+        summary = []
+        for query in queries:
+            body = query.split(";")[-1].strip()
+            verdict = self.verdict(text, query)
+            out.append(self.replay(verdict))
+            if verdict == "false":
+                out.append("A trace has been found.")
+            out.append("RESULT " + body + " " + self.endings[verdict])
+            summary.append("Query " + body + " " + self.endings[verdict])
+            time.sleep(self.latency)
+        separator = "-" * 62
+        out += [separator, "Verification summary:", ""] + [line + "\n" for line in summary] + [separator, ""]
+        sys.stdout.write("\n".join(out) + "\n")
+
+
+class Timing:
+    """
+    the time spent in the functions of FIDO2Verif.py, each one is wrapped to add its time to a part
+    """
+    def __init__(self):
+        self.parts = {}  # part -> [seconds, calls]
+
+    def wrap(self, owner, name, part):
+        function = getattr(owner, name)
+        parts = self.parts.setdefault(part, [0.0, 0])
+
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                parts[0] += time.perf_counter() - start
+                parts[1] += 1
+        setattr(owner, name, timed)
+
+
+def peak_memory():
+    # the peak memory of this process in MB
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / 1024.0 / 1024.0 if sys.platform == "darwin" else rss / 1024.0
+
+
+def bench_analysis(phases, full):
+    """
+    run analysis() for the phases against the stub, in a temporary directory with a copy of the model
+    return the report of each phase and the time of each part
+    """
+    import FIDO2Verif
+    F = FIDO2Verif
+    F.Setting.proverif = [sys.executable, "-S", os.path.abspath(__file__), "stub"]
+    F.Setting.use_cache = False
+    F.Setting.jobs = 1
+    if not full:
+        F.Setting.analyze_flag = "simple"
+    timing = Timing()
+    timing.wrap(F.Generator, "generator_case", "generator")
+    for name in ("jump_if_its_secure", "jump_if_its_insecure", "this_case_is_secure", "this_case_is_insecure"):
+        timing.wrap(F.Generator, name, "pruning")
+    timing.wrap(F.Case, "render", "render")
+    timing.wrap(F.Case, "write_file", "write_file")
+    timing.wrap(F, "run_proverif", "proverif (spawn, stub, read)")
+    timing.wrap(F, "classify", "parse")
+    timing.wrap(F.VerdictCache, "get", "cache")
+    timing.wrap(F, "write_result", "write_result")
+    timing.wrap(F, "write_log", "write_log")
+    F.Setting.initiate()
+    reports = []
+    for phase, path in phases:
+        log = open(getattr(F.Setting, path), mode="w+", encoding="utf-8")
+        telemetry = open(F.telemetry_path(getattr(F.Setting, path)), mode="w+", encoding="utf-8")
+        start = time.perf_counter()
+        F.analysis(phase, log, telemetry)
+        seconds = time.perf_counter() - start
+        log.close()
+        telemetry.close()
+        f = open(F.telemetry_path(getattr(F.Setting, path)), encoding="utf-8")
+        records = [json.loads(line) for line in f if line.strip()]
+        f.close()
+        run = sum(1 for record in records if not record["pruned"])
+        reports.append({"phase": phase, "cases": len(records), "run": run, "seconds": round(seconds, 3),
+                        "cases_per_second": round(len(records) / seconds, 1) if seconds else 0.0})
+    parts = dict((part, {"seconds": round(value[0], 3), "calls": value[1]}) for part, value in timing.parts.items())
+    F.Setting.remove_workspace()
+    return reports, parts
+
+
+def bench_pruning(sizes, rounds):
+    """
+    the checks of the secure/insecure sets of one block with n alternatives (fields and entities)
+    the cases are checked from the full set down to the empty set, as the Generator does,
+    a case not decided by the sets gets a verdict by a threshold on its number of alternatives and is added
+    return the microseconds of a check and the size of the sets for each n
+    """
+    from FIDO2Verif import Lattice
+    reports = []
+    for n in sizes:
+        masks = sorted(range(1 << n), key=lambda mask: -bin(mask).count("1"))
+        checks = 0
+        start = time.perf_counter()
+        for r in range(rounds):
+            lattice = Lattice()
+            for mask in masks:
+                checks += 1
+                if lattice.is_secure(mask) or lattice.is_insecure(mask):
+                    continue
+                # an attack needs more than half of the alternatives, and a few fixed pairs
+                if bin(mask).count("1") > n // 2 or mask & 0b101 == 0b101 and (mask >> r) & 1:
+                    lattice.add_insecure(mask)
+                else:
+                    lattice.add_secure(mask)
+        seconds = time.perf_counter() - start
+        reports.append({"alternatives": n, "cases": len(masks), "checks": checks,
+                        "us_per_check": round(seconds / checks * 1e6, 3),
+                        "secure_sets": len(lattice.secure), "insecure_sets": len(lattice.insecure)})
+    return reports
+
+
+def bench_frontier(sizes):
+    """
+    the cases run by the frontier search (--frontier) and by the sweep over one block with n alternatives,
+    with the verdicts of the stub with --monotone: a case is false when its alternatives use cP more than a threshold,
+    each alternative a few times, for every threshold
+    return for each n the cases run by both over all the thresholds and the thresholds where the frontier runs more,
+    the frontier may lose a few runs on a threshold but must not run more cases than the sweep over all of them
+    """
+    from types import SimpleNamespace
+    from FIDO2Verif import Frontier, Lattice
+    reports = []
+    for n in sizes:
+        uses = [1 + i % 3 for i in range(n)]
+        masks = sorted(range(1 << n), key=lambda mask: -bin(mask).count("1"))
+        calls = sweep = 0
+        worse = []
+        for threshold in range(sum(uses) + 1):
+            frontier = Frontier(None, n)
+            for mask in masks:
+                frontier.add(SimpleNamespace(case=SimpleNamespace(mask=mask), state=None, ret=None))
+            frontier.complete = True
+            lattice = Lattice()
+            while not frontier.finished():
+                for task, state in frontier.decided(lattice):
+                    task.state = state
+                task = frontier.next_task(lattice)
+                if task is None:
+                    continue
+                mask = task.case.mask
+                frontier.running.discard(mask)
+                if sum(uses[i] for i in range(n) if mask >> i & 1) > threshold:
+                    task.ret = 'false'
+                    lattice.add_insecure(mask)
+                else:
+                    task.ret = 'true'
+                    lattice.add_secure(mask)
+            calls += frontier.calls
+            sweep += frontier.sweep_calls()
+            if frontier.calls > frontier.sweep_calls():
+                worse.append(threshold)
+        reports.append({"alternatives": n, "thresholds": sum(uses) + 1, "frontier_calls": calls,
+                        "sweep_calls": sweep, "worse": worse})
+    return reports
+
+
+def bench_combinations(sizes):
+    """
+    the combinations of n alternatives of fields and of entities, as a Generator makes them
+    return for each n the memory they keep, the time to make them,
+    and the time to get the code and the name of a combination, as when a case is rendered and logged
+    """
+    from FIDO2Verif import AllFields, AllEntities, Setting
+    Setting.analyze_flag = "full"
+
+    def build(n):
+        fields = AllFields()
+        fields.all_fields = ["out(cP,field" + str(i) + ");\n" for i in range(n)]
+        entities = AllEntities()
+        entities.all_entities = ["Entity" + str(i) + "(cP)|\n" for i in range(n)]
+        stdout, sys.stdout = sys.stdout, open(os.devnull, "w")
+        try:
+            fields.get_all_scenes()
+        finally:
+            sys.stdout.close()
+            sys.stdout = stdout
+        entities.get_all_scenes()
+        return fields, entities
+
+    reports = []
+    for n in sizes:
+        tracemalloc.start()  # the memory is measured apart from the time, tracemalloc slows the allocations down
+        kept = build(n)
+        size = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        del kept
+        start = time.perf_counter()
+        fields, entities = build(n)
+        seconds = time.perf_counter() - start
+        count = fields.size() + entities.size()
+        start = time.perf_counter()
+        for i in range(fields.size()):
+            combination = fields.get(i)
+            combination.write, combination.name
+        for i in range(entities.size()):
+            combination = entities.get(i)
+            combination.write, combination.name
+        render = time.perf_counter() - start
+        reports.append({"alternatives": n, "combinations": count, "kb": round(size / 1024.0, 1),
+                        "bytes_per_combination": round(size / count, 1), "build_ms": round(seconds * 1000, 1),
+                        "us_per_render": round(render / count * 1e6, 3)})
+    return reports
+
+
+def compare(report, baseline, tolerance):
+    # the regressions against the baseline, the cases per second falling, the checks slowing
+    # or the combinations taking more memory by more than tolerance
+    regressions = []
+    old = dict((item["phase"], item) for item in baseline.get("analysis", []))
+    for item in report["analysis"]:
+        if item["phase"] in old and item["cases_per_second"] < old[item["phase"]]["cases_per_second"] * (1 - tolerance):
+            regressions.append(item["phase"] + ": " + str(item["cases_per_second"]) + " cases/s, was " +
+                               str(old[item["phase"]]["cases_per_second"]))
+    old = dict((item["alternatives"], item) for item in baseline.get("pruning", []))
+    for item in report["pruning"]:
+        if item["alternatives"] in old and item["us_per_check"] > old[item["alternatives"]]["us_per_check"] * (1 + tolerance):
+            regressions.append("pruning with " + str(item["alternatives"]) + " alternatives: " +
+                               str(item["us_per_check"]) + " us/check, was " +
+                               str(old[item["alternatives"]]["us_per_check"]))
+    old = dict((item["alternatives"], item) for item in baseline.get("combinations", []))
+    for item in report["combinations"]:
+        if item["alternatives"] in old and item["kb"] > old[item["alternatives"]]["kb"] * (1 + tolerance):
+            regressions.append("combinations of " + str(item["alternatives"]) + " alternatives: " +
+                               str(item["kb"]) + " KB, was " + str(old[item["alternatives"]]["kb"]))
+    return regressions
+
+
+def print_help():
+    print("usage: python FIDO2Bench.py [-t <target_name>] [--full] [--latency <s>] [--false <ratio>] [--monotone]")
+    print("                            [--recorded <dir>] [--sizes <from-to>] [--rounds <n>] [--combinations <n,n,...>]")
+    print("                            [--json <file>]")
+    print("                            [--baseline <file>] [--tolerance <ratio>]")
+    print("-t/-target  : benchmark a specific phase, all phases by default.")
+    print("--full      : analyze the cases with leaked fields too, only the cases without by default.")
+    print("--latency   : the seconds the stub of ProVerif spends on each query, 0 by default.")
+    print("--false     : the ratio of the queries the stub finds false, 0.3 by default.")
+    print("--monotone  : the stub finds more attacks when more is compromised, so the secure/insecure sets skip cases.")
+    print("--recorded  : a directory of outputs recorded from ProVerif, true.txt, false.txt and prove.txt, replayed by the stub.")
+    print("--sizes     : the numbers of alternatives for the benchmark of the secure/insecure sets, 5-12 by default.")
+    print("--rounds    : the rounds of the benchmark of the secure/insecure sets, 3 by default.")
+    print("--combinations : the numbers of alternatives for the benchmark of the combinations, 5,10,16 by default.")
+    print("--json      : write the report to a json file.")
+    print("--baseline  : a report written by --json, exit with 1 if the cases per second or the checks are slower.")
+    print("--tolerance : the slowdown allowed against the baseline, 0.25 by default.")
+
+
+if __name__ == "__main__":
+    if sys.argv[1:2] == ["stub"]:
+        Stub().run(sys.argv[2:])
+        sys.exit()
+    targets = []
+    full = False
+    sizes = range(5, 13)
+    rounds = 3
+    combination_sizes = [5, 10, 16]
+    frontier_sizes = range(3, 9)
+    json_path = None
+    baseline_path = None
+    tolerance = 0.25
+    try:
+        options, args = getopt.getopt(sys.argv[1:], "-h-t:", ["help", "target=", "full", "latency=", "false=",
+                                                              "monotone", "recorded=", "sizes=", "rounds=", "combinations=", "json=",
+                                                              "baseline=", "tolerance="])
+    except getopt.GetoptError:
+        print("wrong option!")
+        print_help()
+        sys.exit()
+    try:
+        for option, value in options:
+            if option in ("-h", "--help"):
+                print_help()
+                sys.exit()
+            elif option in ("-t", "--target"):
+                targets.append(value)
+            elif option == "--full":
+                full = True
+            elif option == "--latency":
+                os.environ["FIDO2BENCH_LATENCY"] = str(float(value))
+            elif option == "--false":
+                os.environ["FIDO2BENCH_FALSE"] = str(float(value))
+            elif option == "--monotone":
+                os.environ["FIDO2BENCH_MONOTONE"] = "1"
+            elif option == "--recorded":
+                os.environ["FIDO2BENCH_RECORDED"] = os.path.abspath(value)
+            elif option == "--sizes":
+                low, high = value.split("-")
+                sizes = range(int(low), int(high) + 1)
+            elif option == "--rounds":
+                rounds = int(value)
+            elif option == "--combinations":
+                combination_sizes = [int(n) for n in value.split(",")]
+            elif option == "--json":
+                json_path = os.path.abspath(value)
+            elif option == "--baseline":
+                baseline_path = os.path.abspath(value)
+            elif option == "--tolerance":
+                tolerance = float(value)
+    except ValueError:
+        print("wrong argument!")
+        print_help()
+        sys.exit()
+
+    # FIDO2Verif.py works in the current directory, the benchmark runs in a copy of the model
+    source = os.path.dirname(os.path.abspath(__file__))
+    sys.path.insert(0, source)
+    workdir = tempfile.mkdtemp(prefix="FIDO2Bench-")
+    for name in ("Reg.pv", "Auth.pv", "FIDO2.pvl"):
+        shutil.copy(os.path.join(source, name), workdir)
+    os.chdir(workdir)
+    all_phases = [("reg_client", "LogPath1"), ("reg_server", "LogPath2"), ("auth_client_em", "LogPath3"),
+                  ("auth_client_sim", "LogPath4"), ("auth_client_gen", "LogPath5"), ("auth_server_em", "LogPath6"),
+                  ("auth_server_sim", "LogPath7"), ("auth_server_gen", "LogPath8")]
+    phases = [(phase, path) for phase, path in all_phases if not targets or phase in targets]
+    try:
+        start = time.perf_counter()
+        analysis_reports, parts = bench_analysis(phases, full)
+        total = time.perf_counter() - start
+        memory_analysis = peak_memory()
+        pruning_reports = bench_pruning(sizes, rounds)
+        memory_pruning = peak_memory()
+        combination_reports = bench_combinations(combination_sizes)
+        frontier_reports = bench_frontier(frontier_sizes)
+    finally:
+        os.chdir(source)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    cases = sum(item["cases"] for item in analysis_reports)
+    print("phase".ljust(18) + "cases".rjust(8) + "run".rjust(8) + "seconds".rjust(10) + "cases/s".rjust(10))
+    for item in analysis_reports:
+        print(item["phase"].ljust(18) + str(item["cases"]).rjust(8) + str(item["run"]).rjust(8) +
+              str(item["seconds"]).rjust(10) + str(item["cases_per_second"]).rjust(10))
+    print("total".ljust(18) + str(cases).rjust(8) + "".rjust(8) + str(round(total, 3)).rjust(10) +
+          str(round(cases / total, 1) if total else 0.0).rjust(10))
+    print("")
+    print("part".ljust(30) + "seconds".rjust(10) + "calls".rjust(10) + "us/call".rjust(12))
+    for part, value in sorted(parts.items(), key=lambda item: -item[1]["seconds"]):
+        per_call = value["seconds"] / value["calls"] * 1e6 if value["calls"] else 0.0
+        print(part.ljust(30) + str(value["seconds"]).rjust(10) + str(value["calls"]).rjust(10) +
+              str(round(per_call, 1)).rjust(12))
+    print("")
+    print("alternatives".ljust(14) + "cases".rjust(8) + "checks".rjust(10) + "us/check".rjust(10) +
+          "secure sets".rjust(13) + "insecure sets".rjust(15))
+    for item in pruning_reports:
+        print(str(item["alternatives"]).ljust(14) + str(item["cases"]).rjust(8) + str(item["checks"]).rjust(10) +
+              str(item["us_per_check"]).rjust(10) + str(item["secure_sets"]).rjust(13) +
+              str(item["insecure_sets"]).rjust(15))
+    print("")
+    print("alternatives".ljust(14) + "combinations".rjust(14) + "KB".rjust(10) + "bytes each".rjust(12) +
+          "build ms".rjust(10) + "us/render".rjust(11))
+    for item in combination_reports:
+        print(str(item["alternatives"]).ljust(14) + str(item["combinations"]).rjust(14) + str(item["kb"]).rjust(10) +
+              str(item["bytes_per_combination"]).rjust(12) + str(item["build_ms"]).rjust(10) +
+              str(item["us_per_render"]).rjust(11))
+    print("")
+    print("alternatives".ljust(14) + "thresholds".rjust(12) + "frontier".rjust(10) + "sweep".rjust(10) +
+          "  thresholds where the frontier runs more")
+    for item in frontier_reports:
+        print(str(item["alternatives"]).ljust(14) + str(item["thresholds"]).rjust(12) +
+              str(item["frontier_calls"]).rjust(10) + str(item["sweep_calls"]).rjust(10) +
+              "  " + ",".join(str(threshold) for threshold in item["worse"]))
+    print("")
+    print("peak memory: " + str(round(memory_analysis, 1)) + "MB after the analysis, " +
+          str(round(memory_pruning, 1)) + "MB after the secure/insecure sets")
+
+    report = {"analysis": analysis_reports, "parts": parts, "pruning": pruning_reports,
+              "combinations": combination_reports, "frontier": frontier_reports,
+              "peak_memory_mb": {"analysis": round(memory_analysis, 1), "pruning": round(memory_pruning, 1)}}
+    if json_path is not None:
+        f = open(json_path, "w", encoding="utf-8")
+        json.dump(report, f, indent=1)
+        f.close()
+    # the frontier search must not cost more runs than the sweep, with or without a baseline
+    regressions = ["frontier with " + str(item["alternatives"]) + " alternatives: " + str(item["frontier_calls"]) +
+                   " cases run, " + str(item["sweep_calls"]) + " by the sweep"
+                   for item in frontier_reports if item["frontier_calls"] > item["sweep_calls"]]
+    if baseline_path is not None:
+        f = open(baseline_path, encoding="utf-8")
+        baseline = json.load(f)
+        f.close()
+        regressions += compare(report, baseline, tolerance)
+    for regression in regressions:
+        print("regression: " + regression)
+    if regressions:
+        sys.exit(1)
@@ -1,12 +1,25 @@
 # coding=gbk
 import itertools
 import os
+import hashlib
+import json
 import sys
-import threading
 import shutil
 import getopt
-from threading import Timer
-from subprocess import Popen, PIPE
+import re
+import time
+import gzip
+import socket
+import sqlite3
+import traceback
+import heapq
+from array import array
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, Future, wait, FIRST_COMPLETED
+from concurrent.futures.process import BrokenProcessPool
+from threading import Timer, Thread, Condition, Lock
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from subprocess import Popen, PIPE, DEVNULL
 
 """
 The Auto Script to generate .pv files for each case.
@@ -19,57 +32,116 @@ class Setting:
     """
     General Setting Class
     RootPath is the directory where the .pv and .pvl files exist
-    set_type_row     is the line to insert the type definition
-    reg_fields_row   is the line to insert compromised fields for registration
-    auth_fields_row  is the line to insert compromised fields for authentication
-    reg_entities_row  is the line to insert compromised entities for registration
-    auth_entities_row is the line to insert compromised entities for authentication
+    the outputs of a run (LOG/, Result/, Output/, TEMP/) are in its own directory Runs/<date-time>/, see initiate()
+    the code of a case is inserted after the marker comments in the .pv files, see Template
     the testing cases are divided into
     reg:  (c / s) client-side / server-side storage
     auth: (c / s) * (empty / simple / generic)
     """
     RootPath = os.getcwd() + "/"
-    set_type_row = 8
-    reg_fields_row = 17
-    auth_fields_row = 23
-    reg_entities_noctap_row = 22
-    reg_entities_ctap_row_1 = 31
-    reg_entities_ctap_row = 38
-    auth_entities_noctap_row = 28
-    auth_entities_ctap_row_1 = 37
-    auth_entities_ctap_row = 44
-
-    if os.path.exists(RootPath + "LOG/"):
-        shutil.rmtree(RootPath + "LOG/")
-    if os.path.exists(RootPath + "TEMP/"):
-        shutil.rmtree(RootPath + "TEMP/")
-    if os.path.exists(RootPath + "Result/"):
-        shutil.rmtree(RootPath + "Result/")
-
-    if not os.path.exists(RootPath + "LOG/"):
-        os.makedirs(RootPath + "LOG/")
-    if not os.path.exists(RootPath + "TEMP/"):
-        os.makedirs(RootPath + "TEMP/")
-    if not os.path.exists(RootPath + "Result/"):
-        os.makedirs(RootPath + "Result/")
+
     RegPath = RootPath + "Reg.pv"
     AuthPath = RootPath + "Auth.pv"
-    LogPath1 = RootPath + "LOG\\reg_c.log"
-    LogPath2 = RootPath + "LOG\\reg_s.log"
-    LogPath3 = RootPath + "LOG\\auth_c_emp.log"
-    LogPath4 = RootPath + "LOG\\auth_c_sim.log"
-    LogPath5 = RootPath + "LOG\\auth_c_gen.log"
-    LogPath6 = RootPath + "LOG\\auth_s_emp.log"
-    LogPath7 = RootPath + "LOG\\auth_s_sim.log"
-    LogPath8 = RootPath + "LOG\\auth_s_gen.log"
+    RegUnlinkPath = RootPath + "Reg_unlink.pv"  # the models swept as they are, see GridTemplate
+    AuthUnlinkPath = RootPath + "Auth_unlink.pv"
+    AuthA3A4Path = RootPath + "Auth_A3_A4.pv"
+    LogPath1 = RootPath + "LOG/reg_c.log"
+    LogPath2 = RootPath + "LOG/reg_s.log"
+    LogPath3 = RootPath + "LOG/auth_c_emp.log"
+    LogPath4 = RootPath + "LOG/auth_c_sim.log"
+    LogPath5 = RootPath + "LOG/auth_c_gen.log"
+    LogPath6 = RootPath + "LOG/auth_s_emp.log"
+    LogPath7 = RootPath + "LOG/auth_s_sim.log"
+    LogPath8 = RootPath + "LOG/auth_s_gen.log"
+    LogPath9 = RootPath + "LOG/reg_unlink.log"
+    LogPath10 = RootPath + "LOG/auth_unlink.log"
+    LogPath11 = RootPath + "LOG/auth_a3_a4.log"
     LibPath = RootPath + "FIDO2.pvl"
     ResultPath = RootPath + "Result/"  # the path for analysis results
+    OutputPath = RootPath + "Output/"  # the long outputs of ProVerif, compressed
     ScriptPath = RootPath + "TEMP/"    # the path for current .pv files
+    RunsPath = RootPath + "Runs/"      # the directories of the runs, Runs/latest is the last one
+    RunPath = RootPath                 # the directory of the outputs of this run, set in initiate()
+    proverif = ["proverif"]  # the command to run ProVerif
     analyze_flag = "full"  # "full" to analyze all scenarios, "simple" to analyze without fields leakage.
+    jobs = os.cpu_count() or 1  # the number of ProVerif processes running at the same time
+    CachePath = RootPath + "Cache/"  # the verdicts of ProVerif kept between runs
+    use_cache = True
+    cache_size = 512  # MB, the least recently used verdicts are removed over this size
+    cache_salt = ""   # the hash of the version of ProVerif, set in initiate()
+    watch = False     # verify again when the model files are saved
+    search = "sweep"  # "sweep" to run the cases in the order of the Generator, "frontier" to run the most informative first
+    timeouts = [30, 300, 3600]  # seconds, the time limits of ProVerif, a case out of time is retried with the next one
+    min_timeout = 5             # seconds, the shortest time limit learned for the first pass
+    # the variants of the model a case is run with, from the cheapest, see Template.variant() and Case.analyze()
+    # "none" without "!", "full" as in the file, or the processes joined by "+" whose "!" is kept, e.g. "system"
+    ladder = ["none", "full"]
+    batch = False  # verify the queries of the same kind of a scenario in one run of ProVerif
+    backend = "proverif"  # "proverif", "replay" the outputs recorded in backend_path, "simulate" by the rules in backend_path
+    backend_path = ""
+    trace = True   # let ProVerif print the attack traces, kept in Output/ when they are long
+    FrontierLogPath = RootPath + "LOG/frontier.log"
+    WorkPath = ScriptPath  # the .pv files of each process are in a directory here, in memory if possible
+    resume = False  # continue the last sweep from the journals in LOG/, the outputs of the last run are kept
+    listen = None   # (host, port) where the workers of other machines connect, see RemotePool
+    order = "sweep"  # the order of the cases: "sweep", "cheapest" blocks first, "informative" cases first, see Generator
+    shard = [1, 1]   # [i, n], only verify the i-th of n shards of the blocks of each phase
+    schedule = "lpt"  # the order to run the ready cases: "lpt" the longest predicted first, "fifo" as they are ready
+    keep_runs = 5     # the number of runs kept in Runs/, the older ones are removed in the background, 0 to keep all
+    progress = False  # print the progress of the sweep on stderr, see Progress
+    metrics = None    # (host, port) where the progress is served in the text format of Prometheus, see MetricsServer
+    # the paths of the outputs of a run, moved under its directory by use_run()
+    run_outputs = ["LogPath1", "LogPath2", "LogPath3", "LogPath4", "LogPath5", "LogPath6", "LogPath7", "LogPath8",
+                   "LogPath9", "LogPath10", "LogPath11", "FrontierLogPath", "ResultPath", "OutputPath", "ScriptPath"]
 
-    # check the validity of all the paths
+    # start a run in a new directory, the outputs of the last runs are kept
+    # this is not done in the class body, importing this file does nothing on the disk
     @classmethod
     def initiate(cls):
+        ResultStore.close()
+        name = cls.last_run() if cls.resume else None
+        if name is None:  # with --resume and no run, start one
+            name = time.strftime("%Y%m%d-%H%M%S")
+            while os.path.exists(cls.RunsPath + name):  # started in the same second
+                name = name.split("_")[0] + "_" + str(int(name.partition("_")[2] or 1) + 1)
+        cls.use_run(cls.RunsPath + name + "/")
+        for path in (os.path.dirname(cls.LogPath1), cls.ScriptPath, cls.ResultPath):
+            os.makedirs(path, exist_ok=True)
+        f = open(cls.RunPath + "pid", "w")  # the run is not removed while it's running, see clean_runs()
+        f.write(str(os.getpid()))
+        f.close()
+        try:  # Runs/latest -> the directory of this run, to find it easily
+            os.symlink(name, cls.RunsPath + "latest.new")
+            os.replace(cls.RunsPath + "latest.new", cls.RunsPath + "latest")
+        except OSError:
+            pass
+        if cls.keep_runs > 0:
+            clean_runs(cls.keep_runs)
+        cls.prepare()
+
+    @classmethod
+    def use_run(cls, path):
+        # the outputs are written in the directory path of a run, ending with "/"
+        for name in cls.run_outputs:
+            setattr(cls, name, path + getattr(cls, name)[len(cls.RunPath):])
+        cls.RunPath = path
+
+    @classmethod
+    def runs(cls):
+        # the names of the runs in Runs/, from the oldest to the last one
+        if not os.path.isdir(cls.RunsPath):
+            return []
+        return sorted((name for name in os.listdir(cls.RunsPath) if re.match(r"\d{8}-\d{6}(_\d+)?$", name)),
+                      key=lambda name: (name.split("_")[0], int(name.partition("_")[2] or 1)))
+
+    @classmethod
+    def last_run(cls):
+        runs = cls.runs()
+        return runs[-1] if runs else None
+
+    @classmethod
+    def prepare(cls):
+        # check the model files and start again with them, nothing is removed
         if not os.path.exists(cls.LibPath):
             print("FIDO2.lib does not exist")
             sys.exit(1)
@@ -79,6 +151,85 @@ class Setting:
         if not os.path.exists(cls.AuthPath):
             print("Auth.pv does not exist")
             sys.exit(1)
+        if cls.use_cache:
+            cls.cache_salt = hashlib.sha256(cls.proverif_version().encode()).hexdigest()
+        ModelIndex.current = None  # the lib file may be changed since the last run
+        Template.loaded = {}
+        Backend.current = None
+        cls.WorkPath = cls.ScriptPath
+        if os.path.isdir("/dev/shm") and os.access("/dev/shm", os.W_OK):
+            cls.remove_stale_workspaces()
+            cls.WorkPath = "/dev/shm/FIDO2Verif-" + str(os.getpid()) + "/"
+
+    @classmethod
+    def set_root(cls, root):
+        # the paths of the files under another root directory, ending with "/"
+        for name, value in list(vars(cls).items()):
+            if isinstance(value, str) and value.startswith(cls.RootPath) and name != "RootPath":
+                setattr(cls, name, root + value[len(cls.RootPath):])
+        cls.RootPath = root
+
+    @classmethod
+    def proverif_version(cls):
+        # the first line of "proverif -help" gives the version of ProVerif
+        try:
+            output = Popen(cls.proverif + ['-help'], stdout=PIPE, stderr=PIPE)
+            stdout, stderr = output.communicate()
+        except OSError:
+            return ""
+        lines = (stdout + stderr).decode("latin-1").strip().splitlines()
+        return lines[0] if lines else ""
+
+    @classmethod
+    def workspace(cls):
+        # the directory of the .pv files written by this process
+        path = cls.WorkPath + str(os.getpid()) + "/"
+        if not os.path.exists(path):
+            os.makedirs(path)
+        return path
+
+    @classmethod
+    def remove_workspace(cls):
+        if cls.WorkPath != cls.ScriptPath and os.path.exists(cls.WorkPath):
+            shutil.rmtree(cls.WorkPath, ignore_errors=True)
+
+    @staticmethod
+    def remove_stale_workspaces():
+        # the workspaces in memory left by the runs which are killed
+        for name in os.listdir("/dev/shm"):
+            if not name.startswith("FIDO2Verif-"):
+                continue
+            try:
+                os.kill(int(name[len("FIDO2Verif-"):]), 0)
+            except ValueError:
+                continue
+            except OSError:
+                shutil.rmtree("/dev/shm/" + name, ignore_errors=True)
+
+    @classmethod
+    def model_paths(cls):
+        # the files of the model: the lib file, Reg.pv, Auth.pv and the models of grid_phases() which exist
+        return [cls.LibPath, cls.RegPath, cls.AuthPath] + \
+            [path for path in grid_phases().values() if os.path.exists(path)]
+
+    @classmethod
+    def model_files(cls):
+        # the files of the model and their modification time, to watch the changes
+        return dict((path, os.stat(path).st_mtime) for path in cls.model_paths())
+
+    @classmethod
+    def snapshot(cls):
+        # the settings given on the command line, passed to the worker processes
+        values = {}
+        for name, value in vars(cls).items():
+            if not name.startswith("_") and isinstance(value, (str, int, float, bool, list)):
+                values[name] = value
+        return values
+
+    @classmethod
+    def restore(cls, values):
+        for name, value in values.items():
+            setattr(cls, name, value)
 
 
 class Type:  # indicate the type of this test case
@@ -93,35 +244,92 @@ class CTAPType:
 
 
 class Query:  # indicate the query statement
-    def __init__(self, name, write):
+    def __init__(self, name, write, key=None, kind=None):
         self.name = name    # name of this query: S-cntr, the secrecy of counter
-        self.write = write  # the query sentence in .pv file
+        self.write = write  # the query sentence in .pv file, empty if the query is in the file, see GridQueries
+        # the queries of the same kind are verified together by --batch
+        if kind is None:
+            kind = "secrecy" if write.startswith("query secret") else "correspondence"
+        self.kind = kind
+        if key is None:
+            key = result_key(write.split(";")[-1].replace("query", "", 1))
+        self.key = key  # to find its result in the output
+
+
+def mask_indexes(mask):
+    # the indexes of the bits set in mask, from the lowest
+    indexes = []
+    i = 0
+    while mask:
+        if mask & 1:
+            indexes.append(i)
+        mask >>= 1
+        i += 1
+    return indexes
 
 
 class Fields:  # indicate a specific combination of compromised fields
-    def __init__(self, fields):
-        self.nums = len(fields)  # the number of leaked fields
-        self.write = ""          # the code of leaked fields in .pv file
-        self.name = "fields-" + str(self.nums)  # the name "fields-0/1/2/3/4/5......" in output
-        for item in fields:
-            self.write += item  # source code are stored in the item
-        self.fields = fields
+    """
+    a combination is the list of all the alternatives, shared by the combinations, and a bitmask
+    the code and the name are built when the case is rendered or logged, not kept
+    """
+    __slots__ = ("alternatives", "mask")
+
+    def __init__(self, alternatives, mask=0):
+        self.alternatives = alternatives
+        self.mask = mask  # bit i is set if the i-th alternative is leaked
+
+    @property
+    def fields(self):
+        return [self.alternatives[i] for i in mask_indexes(self.mask)]
+
+    @property
+    def nums(self):  # the number of leaked fields
+        return bin(self.mask).count("1")
+
+    @property
+    def write(self):  # the code of leaked fields in .pv file
+        return "".join(self.fields)
+
+    @property
+    def name(self):  # the name "fields-0/1/2/3/4/5......" in output
+        return "fields-" + str(self.nums)
+
+
+class SimpleFields(Fields):  # the combination of -s, a comment in the code and no field leaked
+    __slots__ = ()
+    fields = ["(* no fields being compromised *)\n"]
+    nums = 1
 
 
 class Entities:
-    def __init__(self, entities, row_numbers):
-        self.nums = len(entities)
-        self.write = ""
-        if self.nums == 0:
-            self.name = "mali-" + str(self.nums)
-        else:
-            self.name = "mali-" + str(self.nums) + ",,"
-            for i in row_numbers:
-                self.name += "," + str(i)
-        for item in entities:
-            self.write += item
-        self.entities = entities  # the list of 
-        self.row_numbers = row_numbers  # the list of indexes of this combination
+    __slots__ = ("alternatives", "mask")
+
+    def __init__(self, alternatives, mask=0):
+        self.alternatives = alternatives
+        self.mask = mask  # bit i is set if the i-th alternative is malicious
+
+    @property
+    def row_numbers(self):  # the list of indexes of this combination
+        return tuple(mask_indexes(self.mask))
+
+    @property
+    def entities(self):
+        return [self.alternatives[i] for i in self.row_numbers]
+
+    @property
+    def nums(self):
+        return bin(self.mask).count("1")
+
+    @property
+    def write(self):
+        return "".join(self.entities)
+
+    @property
+    def name(self):
+        if self.mask == 0:
+            return "mali-0"
+        return "mali-" + str(self.nums) + ",," + "".join("," + str(i) for i in self.row_numbers)
 
 
 class AllTypes:
@@ -198,6 +406,21 @@ class AuthServerGenTypes(AllTypes):  # The cases using server-side storage authe
         self.all_types.append(Type("auth_server_gen", "let au_type = server in\nlet tr_type = generic in\n"))
 
 
+class RegGridTypes(AllTypes):  # both storages of the authenticators, for Reg_unlink.pv
+    def __init__(self):
+        AllTypes.__init__(self)
+        for types in (RegClientTypes(), RegServerTypes()):
+            self.all_types += types.all_types
+
+
+class AuthGridTypes(AllTypes):  # both storages and the three kinds of transaction, for Auth_unlink.pv and Auth_A3_A4.pv
+    def __init__(self):
+        AllTypes.__init__(self)
+        for types in (AuthClientEmpTypes(), AuthClientSimTypes(), AuthClientGenTypes(),
+                      AuthServerEmpTypes(), AuthServerSimTypes(), AuthServerGenTypes()):
+            self.all_types += types.all_types
+
+
 class AllQueries:
     """
     A parent class for all queries
@@ -311,9 +534,37 @@ class AuthServerTrQueries(AllQueries):
                                                  "inj-event(Authnr_Finish_Tr(tr)).\n"))
 
 
+class GridQueries(AllQueries):
+    """
+    the queries written in a model swept as it is, see GridTemplate
+    they are verified together as one query named name, its result is the one of the last query in the file
+    a model without query is verified for the observational equivalence of the choice[] in it
+    """
+    def __init__(self, name, template):
+        self.all_queries = []
+        statements = re.findall(r"\bquery\b([^.]*)\.", strip_comments("".join(template.chunks)))
+        if statements:
+            self.all_queries.append(Query(name, "", result_key(statements[-1].split(";")[-1])))
+        else:
+            self.all_queries.append(Query(name, "", result_key("Observational equivalence"), "equivalence"))
+
+
 # AllEntities and AllFields are different from AllTypes and AllQueries
 # permutation and combination in AllEntities and AllFields
 # copy in AllTypes and AllQueries
+def combination_masks(n):
+    # the subsets of n alternatives as bitmasks, by their size, then in the order of itertools.combinations
+    # the masks and the pairs of Generator are arrays of "Q", 64 bits everywhere, "L" is 32 bits on Windows
+    masks = array("Q")
+    for i in range(n + 1):
+        for indexes in itertools.combinations(range(n), i):
+            mask = 0
+            for j in indexes:
+                mask |= 1 << j
+            masks.append(mask)
+    return masks
+
+
 class AllEntities:
     """
     a parent class for all possible combinations of malicious entities
@@ -323,36 +574,26 @@ class AllEntities:
     """
 
     def __init__(self):
-        self.all_entities = []  # all alternatives
-        self.entities = []      # all combinations of the alternatives
+        self.all_entities = []     # all alternatives
+        self.masks = array("Q")    # all combinations of the alternatives, as bitmasks, see Entities
 
     # get all the combinations of the malicious entities
     # range(5) = [0,1,2,3,4]
     def get_all_scenes(self):
-        # i = 0,1,2,3,4,...,len(all_entities)
-        for i in range(len(self.all_entities) + 1):
-            # get the subset of [0,1,...,len(self.all_entities)] with i members
-            # row_num is the a single subset
-            for row_num in itertools.combinations(range(len(self.all_entities)), i):
-                temp = []  # all the combinations
-                for j in row_num:  # j is the member in row_num, the index in [0,1...,len(self.all_entities)]
-                    temp.append(self.all_entities[j])
-                self.entities.append(Entities(temp, row_num))
+        self.masks = combination_masks(len(self.all_entities))
 
     # if all_entities = [A,B,C,D]
     # the result is [[],[A],[A,B],[A,B,C],[A,B,C,D]]
     def get_all_scenes_version2(self):
         for i in range(len(self.all_entities) + 1):
-            temp_combination = []
-            for j in range(i):
-                temp_combination.append(self.all_entities[j])
-            self.entities.append(Entities(temp_combination, range(i)))
+            self.masks.append((1 << i) - 1)
 
     def size(self):
-        return len(self.entities)
+        return len(self.masks)
 
     def get(self, i):
-        return self.entities[i]
+        # the combination is made when it's used, only the masks are kept
+        return Entities(self.all_entities, self.masks[i])
 
 
 class RegEntities(AllEntities):
@@ -403,6 +644,12 @@ class AuthEntitiesV2(AllEntities):
         self.get_all_scenes()
 
 
+class NoEntities(AllEntities):  # the models swept as they are, no entity is made malicious
+    def __init__(self):
+        AllEntities.__init__(self)
+        self.masks.append(0)
+
+
 class AllFields:
     """
     A parent class for all possible combinations of the compromised fields
@@ -413,7 +660,8 @@ class AllFields:
 
     def __init__(self):
         self.all_fields = []  # all possibly leaked fields
-        self.fields = []  # all combinations of the possibly leaked fields
+        self.masks = array("Q")  # all combinations of the possibly leaked fields, as bitmasks, see Fields
+        self.simple = False   # the only combination is the one of -s, see SimpleFields
         self.all_fields.append("out(cP,wk);\n")
 
     # get all the combinations of leaked fields
@@ -421,21 +669,20 @@ class AllFields:
         if Setting.analyze_flag == "simple":
             # a simplified version with no leaked fields
             print("analyzing the scenarios where no fields are comprimised.")
-            self.fields = [Fields(["(* no fields being compromised *)\n"])]
+            self.masks = array("Q", [0])
+            self.simple = True
         else:
             print("analyzing the full scenarios.")
-            self.fields = []
-            for i in range(len(self.all_fields) + 1):
-                # get the subsets with i(0,1,2,3,4) items
-                # pre a single subset
-                for subset in itertools.combinations(self.all_fields, i):
-                    self.fields.append(Fields(subset))
+            self.masks = combination_masks(len(self.all_fields))
 
     def size(self):
-        return len(self.fields)
+        return len(self.masks)
 
     def get(self, i):
-        return self.fields[i]
+        # the combination is made when it's used, only the masks are kept
+        if self.simple:
+            return SimpleFields(self.all_fields, self.masks[i])
+        return Fields(self.all_fields, self.masks[i])
 
 
 class RegFields(AllFields):
@@ -454,6 +701,129 @@ class AuthFields(AllFields):
         self.get_all_scenes()
 
 
+class NoFields(AllFields):  # the models swept as they are, no field is leaked
+    def __init__(self):
+        AllFields.__init__(self)
+        self.all_fields = []
+        self.masks.append(0)
+
+
+class Template:
+    """
+    a .pv file compiled into constant chunks and the slots between them, parsed once in each process
+    a slot is opened by a marker comment, the code of a case is inserted right after the marker line
+    the marker is one of the comments in markers, or "(* @slot name *)" to give the name of the slot
+    a comment used twice in a file opens the slots of its list in order
+    chunks: the text around the slots
+    slots : the names of the slots, slots[i] is between chunks[i] and chunks[i + 1]
+    variants: the step of the ladder -> the chunks with the "!" of the step, see variant()
+    equivalence: the model has choice[], it is only verified with its replications,
+                 the equivalence without them says nothing
+    """
+    markers = {"(* set CTAPType *)": ["type"],
+               "(* leaked fields *)": ["fields"],
+               "(* malicious entities in Registration *)": ["entities_noctap", "entities_ctap"],
+               "(* malicious entities in noCTAP Authentication *)": ["entities_noctap"],
+               "(* malicious entities in CTAP Process *)": ["ctap_process"],
+               "(* malicious entities in CTAP Authentication *)": ["entities_ctap"]}
+    names = ["type", "fields", "entities_noctap", "ctap_process", "entities_ctap"]
+    loaded = {}  # path -> Template
+
+    def __init__(self, path):
+        self.path = path
+        lines = self.read_lines()
+        self.chunks = []
+        self.slots = []
+        seen = {}  # marker -> the times it is found
+        chunk = []
+        for line in lines:
+            chunk.append(line)
+            marker = line.strip()
+            explicit = re.match(r"\(\*\s*@slot\s+(\w+)\s*\*\)$", marker)
+            if explicit:
+                name = explicit.group(1)
+            elif marker in self.markers and seen.get(marker, 0) < len(self.markers[marker]):
+                name = self.markers[marker][seen.get(marker, 0)]
+                seen[marker] = seen.get(marker, 0) + 1
+            else:
+                continue
+            self.chunks.append("".join(chunk))
+            self.slots.append(name)
+            chunk = []
+        self.chunks.append("".join(chunk))
+        for name in self.names:
+            if name not in self.slots:
+                print("the slot " + name + " is not found in " + path)
+                sys.exit(1)
+        self.variants = {"full": self.chunks, "none": [chunk.replace('!', '') for chunk in self.chunks]}
+        self.equivalence = "choice[" in strip_comments("".join(self.chunks))
+
+    def read_lines(self):
+        pv_file = open(self.path)
+        lines = pv_file.readlines()
+        pv_file.close()
+        return lines
+
+    @staticmethod
+    def get(path):
+        if path not in Template.loaded:
+            Template.loaded[path] = GridTemplate(path) if path in grid_phases().values() else Template(path)
+        return Template.loaded[path]
+
+    def variant(self, step):
+        # the chunks of a step of the ladder: the "!" before the processes named in the step are kept
+        if step not in self.variants:
+            kept = step.split("+")
+            self.variants[step] = [re.sub(r"!(\s*\(?\s*)(\w+)",
+                                          lambda m: ("!" if m.group(2) in kept else "") + m.group(1) + m.group(2), chunk)
+                                   for chunk in self.chunks]
+        return self.variants[step]
+
+    def steps(self):
+        """
+        the steps of Setting.ladder a case of this template climbs, the last one is "full"
+        a step giving the same file as an earlier one or as "full" is dropped, it would only run the same file twice
+        """
+        if self.equivalence:
+            return ["full"]
+        steps = []
+        for step in Setting.ladder:
+            if all(self.variant(step) != self.variant(other) for other in steps + ["full"]) or step == "full":
+                steps.append(step)
+        return steps
+
+    def render(self, head, values, step):
+        # the text of a case: head, then the chunks of the step with the values of the slots between them
+        chunks = self.variant(step)
+        text = [head, chunks[0]]
+        for i in range(len(self.slots)):
+            text.append(values[self.slots[i]])
+            text.append(chunks[i + 1])
+        return "".join(text)
+
+
+class GridTemplate(Template):
+    """
+    a model swept as it is over ctap_type, au_type and tr_type: Reg_unlink.pv, Auth_unlink.pv, Auth_A3_A4.pv
+    the lines "let ctap_type = ... in" (and au_type, tr_type) which are not in a comment are removed,
+    the values of the case are inserted after the marker "(* set CTAPType *)" instead,
+    so the file is not changed and can still be run by hand with the values written in it
+    """
+    markers = {"(* set CTAPType *)": ["type"]}
+    names = ["type"]
+
+    def read_lines(self):
+        lines = []
+        commented = False  # the line starts in a comment, the comments of ProVerif do not nest
+        for line in Template.read_lines(self):
+            if commented or not re.match(r"\s*let (ctap_type|au_type|tr_type) = \w+ in\s*$", line):
+                lines.append(line)
+            opened, closed = line.rfind("(*"), line.rfind("*)")
+            if opened != closed:
+                commented = opened > closed
+        return lines
+
+
 class Case:
     """
     this class define a specific case with
@@ -462,129 +832,952 @@ class Case:
     query   : queries of this case
     fields  : compromised fields of this case
     entities: malicious entities of this case
-    lines   : the already read lines
+    template: the compiled Reg.pv or Auth.pv
+    index   : the indexes (type, ctap, query, fields, entities) of this case in its Generator
+    seq     : the order of this case in its Generator
     """
-    def __init__(self, p, types, ctap, q, f, e, lines, t_row, f_row, e_c_row, e_c_row_1 ,e_noc_row):
+    def __init__(self, p, types, ctap, q, f, e, template, index=None, seq=0):
         self.phase = p                 # reg_(client/server),auth_(client/server)_(em/simple/generic)
         self.type = types
         self.ctap = ctap
         self.query = q
         self.fields = f
         self.entities = e
-        self.lines = lines             # initial lines in Reg.pv or Auth.pv
-        self.type_set_row = t_row      # the row inserting the definition of type
-        self.fields_set_row = f_row    # the row inserting the definition of compromised fields
-        self.entities_ctap_set_row = e_c_row  # the row inserting the definition of compromised entities
-        self.entities_ctap_set_row_1 = e_c_row_1
-        self.entities_noctap_set_row = e_noc_row  # the row inserting the definition of compromised entities
-        self.query_path = Setting.ScriptPath + "TEMP-" + p + "-" + q.name + "-" + f.name + "-" + e.name + ".pv"
+        self.template = template       # Reg.pv or Auth.pv with the slots for the code of this case
+        # unique for each case, the cases run at the same time
+        # the type is only in the name of the phases with several types, see RegGridTypes
+        self.query_name = "TEMP-" + p + "-" + ("" if types.name == p else types.name + "-") + ctap.name + "-" + \
+            q.name + "-" + f.name + "," + str(f.mask) + "-" + e.name + ".pv"
+        self.query_path = ""  # set when the file is written in the workspace of the process
+        self.texts = {}       # step -> the text of the .pv file, rendered once
+        self.text = ""
+        self.step = ""        # the step of the ladder of the text, see Setting.ladder
+        self.steps = []       # [step, verdict, from the cache] of the steps run by the last analyze()
+        self.passed = []      # the steps passed by the runs out of time before, the next run starts after them
         self.state = ""
         self.result = ""
+        self.index = index
+        self.seq = seq
+        self.from_cache = False  # if the verdict is served from the cache
+        self.timed_out = False   # if the last run of ProVerif is killed for the time limit without a verdict
+        self.usage = new_usage() # the time and memory used by ProVerif on this case
+        self.mask = 0  # the compromised fields and malicious entities, set by Generator
+
+    def __getstate__(self):
+        # a case sent to a worker process carries the path of its template, not the text
+        state = dict(self.__dict__)
+        state["template"] = self.template.path
+        state["texts"] = {}
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.template = Template.get(state["template"])
+
+    def render(self, step):
+        """
+        render the text of the query file in memory, each variant is rendered once
+        step is a step of the ladder, "none" simplifies the verification by removing "!" in the code
+        return the text of the file
+        """
+        self.step = step
+        if step in self.texts:
+            self.text = self.texts[step]
+            return self.text
+        self.text = self.template.render(self.query.write, self.slot_values(), step)
+        self.texts[step] = self.text
+        return self.text
 
-    def write_file(self, if_delete_parallel):
+    def slot_values(self):
+        # the code inserted in the slots of the template
+        ctap = self.ctap.name != 'noCTAP'
+        ctap_process = ""
+        if ctap and self.entities.mask & 1:
+            ctap_process += 'CTAP_Authnr(G, PIN, cP, ctap_type)|\n'
+        if ctap and self.entities.mask & 2:
+            ctap_process += 'CTAP_Client(G, PIN, cP, ctap_type)|\n'
+        return {"type": self.ctap.write + self.type.write,   # set ctap_type, au_type and tr_type
+                "fields": self.fields.write,                  # set compromised fields
+                "entities_noctap": "" if ctap else self.entities.write,
+                "ctap_process": ctap_process,
+                "entities_ctap": self.entities.write if ctap else ""}
+
+    def canonical(self, step):
         """
-        write the query file for proverif to verify
-        'if_delete_parallel = true' simplifies the verification by removing "!" in the code
+        the text of the case without what does not change the verdict of ProVerif:
+        the comments and the spaces, the order of the leaked fields and of the processes put in parallel,
+        and a field leaked twice
+        a process in parallel with itself is kept twice: the system creates fresh names (new PIN, new PinToken)
+        under its "!", so P | P is not the same model as P, for the inj-event queries above all
+        the cases with the same canonical text share their verdict, see VerdictCache and Scheduler
         """
+        values = self.slot_values()
+        for name, separator in (("fields", ";"), ("entities_noctap", "|"), ("ctap_process", "|"), ("entities_ctap", "|")):
+            parts = [squeeze(part) for part in strip_comments(values[name]).split(separator)]
+            parts = [part for part in parts if part]
+            if separator == ";":
+                parts = set(parts)
+            values[name] = "".join(part + separator + "\n" for part in sorted(parts))
+        return squeeze(strip_comments(self.template.render(self.query.write, values, step)))
+
+    def input_hash(self):
+        # the hash of the canonical texts of the steps of the ladder, the cases with the same hash get the same verdict
+        texts = [self.canonical(step) for step in self.template.steps()]
+        return hashlib.sha256("\n".join(texts).encode()).hexdigest()
+
+    def spill_path(self, prefix=""):
+        # the gzip file of the whole output of ProVerif when it is long, next to the analysis files
+        return Setting.OutputPath + self.phase + "/" + self.ctap.name + "/" + self.type.name + "/" + \
+            self.query.name + "/" + prefix + self.query_name[:-len(".pv")] + ".out.gz"
+
+    def write_file(self):
+        # write the rendered text in the workspace for ProVerif to read, return the path
+        self.query_path = Setting.workspace() + self.query_name
         f2 = open(self.query_path, "w")
-        analyze_lines = []
-        if if_delete_parallel:  # if true, then remove ! to speed up analyzing
-            for i in range(len(self.lines)):
-                analyze_lines.append(self.lines[i].replace('!', ''))
-        else:
-            analyze_lines = self.lines
-        f2.writelines(self.query.write)
-        for i in range(len(analyze_lines)):
-            if i == self.type_set_row:      # set au_type and tr_type
-                f2.writelines(self.ctap.write)
-                f2.writelines(self.type.write)
-            if i == self.fields_set_row:    # set compromised fields
-                f2.writelines(self.fields.write)
-            if i == self.entities_noctap_set_row:  # set compromised entities
-                if self.ctap.name == 'noCTAP':
-                    f2.writelines(self.entities.write)
-            if i == self.entities_ctap_set_row_1:
-                if self.ctap.name != 'noCTAP':
-                    if 0 in self.entities.row_numbers:
-                        f2.writelines('CTAP_Authnr(G, PIN, cP, ctap_type)|\n')
-                    if 1 in self.entities.row_numbers:
-                        f2.writelines('CTAP_Client(G, PIN, cP, ctap_type)|\n')
-            if i == self.entities_ctap_set_row:
-                if self.ctap.name != 'noCTAP':
-                    f2.writelines(self.entities.write)
-            f2.writelines(analyze_lines[i])
+        f2.write(proverif_settings() + self.text)
         f2.close()
+        return self.query_path
 
-    def analyze(self):
-        # carry out analysis and get result by proverif
-        self.write_file(True)
-        ret, result = self.proverif()
-        if ret == 'false':
-            self.state = ret
-            f = open(self.query_path)
-            content = f.readlines()
-            f.close()
-            os.remove(self.query_path)
-            return ret, result, content
-        else:
-            self.write_file(False)
-            ret, result = self.proverif()
-            self.state = ret
-            f = open(self.query_path)
-            content = f.readlines()
-            f.close()
-            os.remove(self.query_path)
-            return ret, result, content
+    def analyze(self, budget=None):
+        """
+        carry out analysis and get result by proverif, each run of ProVerif has budget seconds
+        the case climbs the steps of the ladder, see Template.steps(): an attack found with fewer replications
+        is an attack on the full model, so it stops at the first false, only the last step can tell true
+        a step out of time stops the climb, the costlier steps would not finish either,
+        the case is retried from this step with the next time limit, see self.passed
+        the text of the file is returned as the content of the analysis file
+        """
+        if budget is None:
+            budget = Setting.timeouts[0]
+        self.usage = new_usage()
+        steps = self.template.steps()
+        passed = [step for step, verdict, cached in self.passed]
+        start = len(passed) if passed == steps[:len(passed)] and len(passed) < len(steps) else 0
+        self.steps = []
+        for step in steps[start:]:
+            self.render(step)
+            ret, result = self.proverif(budget)
+            self.steps.append([step, ret, self.from_cache])
+            if ret == 'false' or self.timed_out:
+                break
+        self.state = ret
+        return ret, result, self.text
 
     # call proverif for verification
-    def proverif(self):
-        # cmd command for verification
-        output = Popen('proverif -lib ' + Setting.LibPath + ' ' + self.query_path, stdout=PIPE, stderr=PIPE)
-        timer = Timer(30, lambda process: process.kill(), [output])
+    def proverif(self, budget=None):
+        self.timed_out = False
+        self.from_cache = False
+        if Setting.use_cache:
+            cached = VerdictCache.get(self.canonical(self.step))
+            if cached is not None:
+                self.state, self.result = cached
+                self.from_cache = True
+                return cached
+        if budget is None:
+            budget = Setting.timeouts[0]
+        self.write_file()  # the file is only written when ProVerif reads it
+        reader, killed, usage = Backend.get().run([self], self.query_path, budget, self.spill_path(),
+                                                  [self.query.key])
+        add_usage(self.usage, usage, 1)
+        ret, result = classify(reader, killed)
+        self.timed_out = killed and ret != 'false'  # a trace found before the kill is an attack all the same
+        self.state = ret
+        self.result = result
+        if Setting.use_cache and not self.timed_out:  # a killed run depends on the time limit, not cached
+            VerdictCache.put(self.canonical(self.step), ret, result)
+        return ret, result
+
+
+def strip_comments(text):
+    # the comments of ProVerif (* ... *) do not nest
+    return re.sub(r"\(\*.*?\*\)", " ", text, flags=re.S)
+
+
+def squeeze(text):
+    # the spaces between two words are kept as one, the others are removed
+    return re.sub(r"\s*([^\w\s'])\s*", r"\1", " ".join(text.split())).strip()
+
+
+def proverif_settings():
+    # the settings of ProVerif added to the files it reads, not a part of the text of a case for the cache
+    if not Setting.trace:
+        return "set traceDisplay = none.\n"
+    return ""
+
+
+def new_usage():
+    """
+    the resources used by ProVerif
+    wall: seconds, user/sys: seconds of CPU, maxrss: the peak memory in KB,
+    batch: the number of cases verified in the same run of ProVerif,
+    walls: the seconds of each run of ProVerif, one for each step of the ladder, shared by the cases of a batch
+    """
+    return {"wall": 0.0, "user": 0.0, "sys": 0.0, "maxrss": 0, "batch": 1, "walls": []}
+
+
+def add_usage(total, usage, share):
+    # add a run of ProVerif verifying share cases to the usage of one of them, the CPU time is shared
+    total["wall"] += usage["wall"]
+    total["walls"].append(usage["wall"] / share)
+    total["user"] += usage["user"] / share
+    total["sys"] += usage["sys"] / share
+    total["maxrss"] = max(total["maxrss"], usage["maxrss"])
+    total["batch"] = max(total["batch"], share)
+
+
+def run_proverif(path, budget, spill=None, needed=()):
+    # run ProVerif on a file for at most budget seconds, the file is removed after
+    # the output is read line by line while ProVerif runs, see OutputReader,
+    # ProVerif is stopped as soon as the needed queries have their results
+    # return the OutputReader, if it is killed for the time limit and the usage, see new_usage()
+    start = time.time()
+    usage = new_usage()
+    reader = OutputReader(spill, needed)
+    try:
+        output = Popen(Setting.proverif + ['-lib', Setting.LibPath, path], stdout=PIPE, stderr=DEVNULL)
+        killed = []  # not empty if the time is up
+        timer = Timer(budget, lambda process: killed.append(process.kill()), [output])
         try:
             timer.start()
-            stdout, stderr = output.communicate()
+            while True:
+                line = output.stdout.readline(OutputReader.tail_size)
+                if not line:
+                    break
+                reader.feed(line)
+                if reader.concluded():
+                    output.kill()
+                    break
+            output.stdout.close()
+            # the CPU time and memory of ProVerif, not available on Windows,
+            # nor when kill() has already reaped ProVerif which had just exited
+            if hasattr(os, "wait4") and output.returncode is None:
+                pid, status, rusage = os.wait4(output.pid, 0)
+                output.returncode = status
+                usage["user"] = rusage.ru_utime
+                usage["sys"] = rusage.ru_stime
+                usage["maxrss"] = rusage.ru_maxrss // 1024 if sys.platform == "darwin" else rusage.ru_maxrss
+            else:
+                output.wait()
         finally:
             timer.cancel()
-        i = stdout[0:-10].rfind(b'--------------------------------------------------------------')
-        result = stdout[i:-1]
-        if result == b"" or len(result) == 0:
-            result = stdout[-1000:-1]
-            if result.find(b'a trace has been found.'):
-                ret = 'false'
-            elif result.find(b'trace'):
-                ret = 'mayfalse'
+            reader.close()
+    finally:
+        os.remove(path)
+    usage["wall"] = time.time() - start
+    return reader, bool(killed), usage
+
+
+class OutputReader:
+    """
+    the output of a run of ProVerif, read line by line while it runs
+    the memory used does not grow with the output, a long attack trace is not kept in memory
+    tail   : the last lines of the output, at most tail_size bytes
+    results: the RESULT lines, in the order they are printed
+    summary: the lines of the verification summary, in the order of the queries in the file
+    error  : if ProVerif reports an error
+    found  : the key of a query -> its RESULT line, see Query.key
+    needed : the keys of the queries, the rest of the output is not needed once they are all found
+    the whole output is written to the gzip file spill when it is longer than tail_size
+    """
+    tail_size = 64 * 1024
+
+    def __init__(self, spill=None, needed=()):
+        self.tail = deque()
+        self.size = 0    # the bytes in tail
+        self.length = 0  # the bytes of the whole output
+        self.results = []
+        self.found = {}
+        self.summary = []
+        self.in_summary = False
+        self.error = False
+        self.needed = needed
+        self.spill = spill
+        self.spilled = None  # the gzip file, opened when the output is longer than tail_size
+
+    def feed(self, line):
+        stripped = line.strip()
+        if stripped.startswith(b'RESULT '):
+            self.results.append(stripped)
+            text = stripped.decode("latin-1")[len("RESULT "):]
+            self.found.setdefault(result_key(re.sub(r" (is true|is false|cannot be proved)\.$", "", text)), stripped)
+        elif stripped.startswith(b'Verification summary:'):
+            self.in_summary = True
+            self.summary = []
+        elif self.in_summary and stripped.startswith(b'Query '):
+            self.summary.append(stripped)
+        elif stripped.startswith(b'Error'):
+            self.error = True
+        self.tail.append(line)
+        self.size += len(line)
+        self.length += len(line)
+        if self.spilled is not None:
+            self.spilled.write(line)
+        elif self.spill is not None and self.length > self.tail_size:
+            # nothing is dropped from the tail yet, it holds the whole output
+            os.makedirs(os.path.dirname(self.spill), exist_ok=True)
+            self.spilled = gzip.open(self.spill, "wb")
+            self.spilled.writelines(self.tail)
+        while self.size > self.tail_size and len(self.tail) > 1:
+            self.size -= len(self.tail.popleft())
+
+    def text(self):
+        return b"".join(self.tail)
+
+    def concluded(self):
+        # all the needed queries have their results, the summary only repeats them
+        return len(self.needed) > 0 and all(key in self.found for key in self.needed)
+
+    def summary_of(self, lines):
+        # the verification summary of the RESULT lines, as ProVerif prints it
+        separator = b'--------------------------------------------------------------'
+        lines = [b'Query ' + line[len(b'RESULT '):] if line.startswith(b'RESULT ') else line for line in lines]
+        return separator + b'\nVerification summary:\n\n' + b'\n\n'.join(lines) + b'\n\n' + separator + b'\n'
+
+    def close(self):
+        if self.spilled is not None:
+            self.spilled.close()
+
+
+class Backend:
+    """
+    the verifier of the cases, ProVerif by default, see Setting.backend
+    run(cases, path, budget, spill, needed) verifies the file path of the cases (several ones with --batch),
+    it removes the file and returns the OutputReader of the output, if it is killed for the time limit and the usage
+    a backend is created once in each process
+    """
+    current = None  # the backend of this process
+
+    @staticmethod
+    def get():
+        if Backend.current is None:
+            if Setting.backend == "replay":
+                Backend.current = ReplayBackend(Setting.backend_path)
+            elif Setting.backend == "simulate":
+                Backend.current = SimulatedBackend(Setting.backend_path)
             else:
-                ret = 'tout'
-        elif result.find(b'error') != -1:
-            ret = 'error'
-        elif result.find(b'false') != -1:
+                Backend.current = Backend()
+        return Backend.current
+
+    def run(self, cases, path, budget, spill=None, needed=()):
+        return run_proverif(path, budget, spill, needed)
+
+
+class ReplayBackend(Backend):
+    """
+    the outputs of ProVerif recorded in a directory and served again
+    an output is found by the hash of the file and the lib file, <dir>/<2 chars>/<key>.out.gz,
+    with its usage in <key>.json, a file not recorded yet is run by ProVerif and recorded
+    a recorded run longer than the time limit is replayed as killed, without output
+    """
+    def __init__(self, path):
+        self.path = path
+        f = open(Setting.LibPath, "rb")
+        self.lib = hashlib.sha256(f.read()).hexdigest()
+        f.close()
+
+    def run(self, cases, path, budget, spill=None, needed=()):
+        f = open(path, "rb")
+        key = hashlib.sha256(self.lib.encode() + f.read()).hexdigest()
+        f.close()
+        record = self.path + "/" + key[:2] + "/" + key
+        if os.path.exists(record + ".json"):
+            os.remove(path)
+            f = open(record + ".json", encoding="utf-8")
+            usage = json.load(f)
+            f.close()
+            reader = OutputReader(spill, needed)
+            if usage["wall"] > budget:
+                return reader, True, usage
+            f = gzip.open(record + ".out.gz", "rb")
+            for line in f:
+                reader.feed(line)
+                if reader.concluded():
+                    break
+            f.close()
+            reader.close()
+            return reader, False, usage
+        os.makedirs(self.path + "/" + key[:2], exist_ok=True)
+        reader, killed, usage = run_proverif(path, budget, record + ".out.gz", needed)
+        if killed:  # the output depends on the time limit, not recorded
+            if reader.spilled is not None:
+                os.remove(record + ".out.gz")
+            return reader, killed, usage
+        if reader.spilled is None:  # a short output is only in the tail
+            f = gzip.open(record + ".out.gz", "wb")
+            f.write(reader.text())
+            f.close()
+        elif spill is not None:
+            os.makedirs(os.path.dirname(spill), exist_ok=True)
+            shutil.copy(record + ".out.gz", spill)
+        f = open(record + ".json", "w", encoding="utf-8")
+        json.dump(usage, f)
+        f.close()
+        return reader, killed, usage
+
+
+class SimulatedBackend(Backend):
+    """
+    the verdicts given by a table of rules instead of ProVerif, to dry-run a new set of queries or entities
+    the table is a json file:
+    {"default": {"verdict": "true", "seconds": 10},
+     "rules": [{"query": "S-pintok", "ctap": ["setPIN", "chgPIN"], "entities": [1], "verdict": "false", "seconds": 60}]}
+    a rule applies to a case if its phase, type, ctap and query (a name or a list of names) are the given ones,
+    and all the fields and entities given (their indexes in all_fields / all_entities) are compromised,
+    the first rule applying gives the verdict ("true", "false" or "prove") and the seconds of ProVerif,
+    or a list of the seconds of each step of the ladder, the last one for the steps after it, see Setting.ladder
+    the output of ProVerif is written as if it took these seconds, a case over the time limit is killed
+    """
+    endings = {"true": "is true.", "false": "is false.", "prove": "cannot be proved."}
+
+    def __init__(self, path):
+        f = open(path, encoding="utf-8")
+        table = json.load(f)
+        f.close()
+        self.default = table.get("default", {"verdict": "true", "seconds": 1})
+        self.rules = table.get("rules", [])
+
+    def rule(self, case):
+        names = {"phase": case.phase, "type": case.type.name, "ctap": case.ctap.name, "query": case.query.name}
+        for rule in self.rules:
+            matched = True
+            for key, name in names.items():
+                if key in rule and name not in (rule[key] if isinstance(rule[key], list) else [rule[key]]):
+                    matched = False
+            for i in rule.get("fields", []):
+                if not case.fields.mask >> i & 1:
+                    matched = False
+            for i in rule.get("entities", []):
+                if not case.entities.mask >> i & 1:
+                    matched = False
+            if matched:
+                return rule
+        return self.default
+
+    def run(self, cases, path, budget, spill=None, needed=()):
+        os.remove(path)
+        reader = OutputReader(spill, needed)
+        usage = new_usage()
+        lines = []
+        killed = False
+        for case in cases:
+            rule = self.rule(case)
+            seconds = rule.get("seconds", self.default.get("seconds", 1))
+            if isinstance(seconds, list):
+                seconds = seconds[min(case.template.steps().index(case.step), len(seconds) - 1)]
+            if usage["wall"] + seconds > budget:
+                usage["wall"] = budget
+                killed = True
+                break
+            usage["wall"] += seconds
+            verdict = rule.get("verdict", "true")
+            if verdict == "false":
+                reader.feed(b"A trace has been found.\n")
+            line = case.query.write.split(";")[-1].replace("query", "", 1).strip().rstrip(".")
+            line += " " + self.endings[verdict]
+            reader.feed(b"RESULT " + line.encode() + b"\n")
+            lines.append(b"Query " + line.encode() + b"\n")
+        if not killed:
+            separator = b'--------------------------------------------------------------'
+            for line in [separator + b"\n", b"Verification summary:\n", b"\n"] + lines + [b"\n", separator + b"\n"]:
+                reader.feed(line)
+        reader.close()
+        usage["user"] = usage["wall"]
+        return reader, killed, usage
+
+
+def classify(reader, killed=False):
+    # the verdict of a run with one query and the end of its output
+    # a run killed after "a trace has been found" is 'false', the attack does not depend on the time limit
+    stdout = reader.text()
+    i = stdout[0:-10].rfind(b'--------------------------------------------------------------')
+    result = stdout[i:-1]
+    if not reader.summary and reader.concluded():  # stopped once the result is printed
+        result = reader.summary_of([reader.found[key] for key in reader.needed])
+        i = 0
+    if i == -1 or len(result) == 0:  # no summary, ProVerif stopped before the end
+        result = stdout[-1000:-1]
+        if result.lower().find(b'a trace has been found.') != -1:
             ret = 'false'
-        elif result.find(b'hypothesis:') != -1:
-            ret = 'trace'
-        elif result.find(b'prove') != -1:
-            ret = 'prove'
-        elif result.find(b'true') != -1:
-            ret = 'true'
+        elif killed:
+            ret = 'tout'
+        elif result.find(b'trace') != -1:
+            ret = 'mayfalse'
+        elif reader.error:
+            ret = 'error'
         else:
             ret = 'tout'
-        self.state = ret
-        self.result = result
-        return ret, result
+    elif result.find(b'error') != -1:
+        ret = 'error'
+    elif result.find(b'false') != -1:
+        ret = 'false'
+    elif result.find(b'hypothesis:') != -1:
+        ret = 'trace'
+    elif result.find(b'prove') != -1:
+        ret = 'prove'
+    elif result.find(b'true') != -1:
+        ret = 'true'
+    else:
+        ret = 'tout'
+    return ret, result
+
+
+def result_key(text):
+    # a query or a result line of ProVerif without the spaces and the numbers ProVerif adds to the variables
+    return re.sub(r"_\d+\b", "", re.sub(r"\s+", "", text)).rstrip(".")
+
+
+def split_results(reader, queries):
+    """
+    the verdicts of a run with several queries, in the order of queries
+    the lines of the verification summary are in the order of the queries in the file,
+    a run stopped once the results are printed, or killed for the time limit, has no summary,
+    then the RESULT lines are matched to the queries
+    a query without result gets None
+    """
+    lines = reader.summary
+    if len(lines) != len(queries):
+        lines = [reader.found.get(query.key) for query in queries]
+    results = []
+    for line in lines:
+        if line is None:
+            results.append(None)
+            continue
+        result = reader.summary_of([line])
+        if line.endswith(b'is false.'):
+            results.append(('false', result))
+        elif line.endswith(b'cannot be proved.'):
+            results.append(('prove', result))
+        elif line.endswith(b'is true.'):
+            results.append(('true', result))
+        else:
+            results.append(('tout', result))
+    return results
+
+
+def analyze_batch(cases, budget):
+    """
+    verify the cases of one scenario with different queries in one run of ProVerif
+    the cases climb the steps of the ladder together, the ones not found false and in time go on, as Case.analyze()
+    each case gets its own verdict, kept in the cache with the text of the case alone
+    return ret, result, content for each case
+    """
+    for case in cases:
+        case.usage = new_usage()
+        case.steps = []
+    pending = list(cases)
+    for step in cases[0].template.steps():
+        running = []
+        for case in pending:
+            case.timed_out = False
+            case.render(step)
+            cached = VerdictCache.get(case.canonical(step)) if Setting.use_cache else None
+            case.from_cache = cached is not None
+            if cached is not None:
+                case.state, case.result = cached
+            else:
+                running.append(case)
+        if running:
+            head = proverif_settings() + "".join(case.query.write for case in running)
+            text = running[0].template.render(head, running[0].slot_values(), step)
+            path = Setting.workspace() + "BATCH-" + running[0].query_name
+            f = open(path, "w")
+            f.write(text)
+            f.close()
+            reader, killed, usage = Backend.get().run(running, path, budget, running[0].spill_path("BATCH-"),
+                                                   [case.query.key for case in running])
+            if len(running) == 1:
+                results = [classify(reader, killed)]
+            else:
+                results = split_results(reader, [case.query for case in running])
+            for case, verdict in zip(running, results):
+                add_usage(case.usage, usage, len(running))
+                if verdict is None:  # ProVerif stopped before this query
+                    verdict = ('tout' if killed else 'error', reader.text()[-1000:-1])
+                case.state, case.result = verdict
+                # only the queries without their RESULT line when ProVerif is killed are out of time,
+                # a trace found before the kill is an attack, see classify()
+                case.timed_out = killed and case.query.key not in reader.found and case.state != 'false'
+                if Setting.use_cache and not case.timed_out:
+                    VerdictCache.put(case.canonical(step), case.state, case.result)
+        for case in pending:
+            case.steps.append([step, case.state, case.from_cache])
+        pending = [case for case in pending if case.state != 'false' and not case.timed_out]
+    return [(case.state, case.result, case.text) for case in cases]
+
+
+class VerdictCache:
+    """
+    the verdicts of ProVerif kept on disk between runs
+    the key is the hash of the canonical text of the .pv file (see Case.canonical()), the declarations of the lib file
+    it uses and the version of ProVerif,
+    so a case is served from the cache until one of them changes
+    an entry is a json file Cache/<2 chars>/<key>.json with the verdict and the end of the output
+    the modification time of an entry is its last use,
+    the least recently used entries are removed when the cache is larger than Setting.cache_size MB
+    """
+    version = 2  # the version of Case.canonical(), the entries of an older one are not used
+
+    @staticmethod
+    def path(text):
+        # the part of the lib file used by this case, instead of the whole lib file
+        # so the cases not using the changed declarations are still served from the cache
+        key = hashlib.sha256((Setting.cache_salt + "\n" + str(VerdictCache.version) + "\n" + ModelIndex.load().digest(text) +
+                              "\n" + text).encode()).hexdigest()
+        return Setting.CachePath + key[:2] + "/" + key + ".json"
+
+    @staticmethod
+    def get(text):
+        path = VerdictCache.path(text)
+        try:
+            f = open(path, encoding="utf-8")
+            entry = json.load(f)
+            f.close()
+            os.utime(path)  # mark as recently used
+        except (OSError, ValueError):
+            return None
+        return entry["ret"], entry["result"].encode("latin-1")
+
+    @staticmethod
+    def put(text, ret, result):
+        # write to a temporary file first, other workers may read the same entry
+        path = VerdictCache.path(text)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp = path + "." + str(os.getpid())
+        f = open(temp, "w", encoding="utf-8")
+        json.dump({"ret": ret, "result": result[-1000:].decode("latin-1")}, f)
+        f.close()
+        os.replace(temp, path)
+
+    @staticmethod
+    def evict():
+        # remove the least recently used entries until the cache fits in Setting.cache_size
+        entries = []
+        total = 0
+        if not os.path.exists(Setting.CachePath):
+            return
+        for folder in os.listdir(Setting.CachePath):
+            folder = Setting.CachePath + folder + "/"
+            if not os.path.isdir(folder):
+                continue
+            for name in os.listdir(folder):
+                stat = os.stat(folder + name)
+                entries.append((stat.st_mtime, stat.st_size, folder + name))
+                total += stat.st_size
+        entries.sort()
+        for mtime, size, path in entries:
+            if total <= Setting.cache_size * 1024 * 1024:
+                break
+            os.remove(path)
+            total -= size
+
+
+class ModelIndex:
+    """
+    the declarations of the lib file: processes, functions, events, tables, types, constants...
+    a case depends on the declarations used by its .pv file, and the declarations used by them
+    the branch of "if ctap_type = noCTAP" not taken by the case is not counted,
+    so the noCTAP cases do not depend on CTAP_Authnr and CTAP_Client
+    a declaration without a name (equation, set ...) belongs to the names it uses,
+    or to all the cases if it uses none
+    the declarations are cut at the "." which ends them, see declarations()
+    """
+    current = None  # the index of Setting.LibPath loaded by this process
+    keywords = ("type", "fun", "reduc", "equation", "const", "free", "table", "event", "pred", "let", "letfun",
+                "query", "not", "noninterf", "weaksecret", "nounif", "lemma", "axiom", "restriction", "set", "def",
+                "expand", "param", "proba", "proof", "channel", "elimtrue", "clauses", "process")
+
+    def __init__(self, text):
+        self.decls = []    # [(names, references, digest)]
+        self.names = {}    # name -> the index of its declaration
+        self.slices = {}   # frozenset of identifiers -> digest, a cache for digest()
+        for decl in self.declarations(text):
+            words = decl.split()
+            if not words:
+                continue
+            names = self.declared_names(words[0], decl)
+            references = set(re.findall(r"[A-Za-z_][A-Za-z0-9_']*", decl)) - names
+            digest = hashlib.sha256(" ".join(words).encode()).hexdigest()
+            for name in names:
+                self.names[name] = len(self.decls)
+            self.decls.append((names, references, digest))
+
+    @classmethod
+    def load(cls):
+        if cls.current is None:
+            f = open(Setting.LibPath)
+            cls.current = ModelIndex(f.read())
+            f.close()
+        return cls.current
+
+    @staticmethod
+    def strip(text):
+        # remove the comments
+        return re.sub(r"\(\*.*?\*\)", " ", text, flags=re.S)
+
+    @classmethod
+    def declarations(cls, text):
+        """
+        the declarations of the lib file without the comments
+        a declaration ends with a "." out of the parentheses and the strings followed by the keyword of the next one,
+        so a "." inside a term, a string or a comment, or a declaration on several lines, is not cut
+        """
+        text = cls.strip(text)
+        boundary = re.compile(r'"[^"]*"|[()\[\]]|\.(?=\s*$|\s+(?:' + "|".join(cls.keywords) + r')\b)')
+        decls = []
+        start = 0
+        depth = 0
+        for match in boundary.finditer(text):
+            token = match.group()
+            if token in "([":
+                depth += 1
+            elif token in ")]":
+                depth = max(depth - 1, 0)
+            elif token == "." and depth == 0:
+                decls.append(text[start:match.start()])
+                start = match.end()
+        decls.append(text[start:])
+        return decls
+
+    @staticmethod
+    def declared_names(keyword, decl):
+        if keyword in ("type", "fun", "table", "event", "pred", "let", "letfun"):
+            return set(re.findall(r"^\s*" + keyword + r"\s+([A-Za-z_][A-Za-z0-9_']*)", decl))
+        if keyword in ("const", "free"):
+            return set(re.findall(r"[A-Za-z_][A-Za-z0-9_']*", decl.split(":")[0])[1:])
+        if keyword == "reduc":
+            return set(re.findall(r";\s*([A-Za-z_][A-Za-z0-9_']*)\s*\(", decl))
+        return set()
+
+    @staticmethod
+    def live(text):
+        # remove the branch of "if ctap_type = noCTAP" which is not taken
+        text = ModelIndex.strip(text)
+        ctap = re.search(r"let\s+ctap_type\s*=\s*(\w+)\s+in", text)
+        branch = re.search(r"if\s+ctap_type\s*=\s*noCTAP\s+then\s*\(", text)
+        if ctap is None or branch is None:
+            return text
+        then_end = ModelIndex.closing(text, branch.end() - 1)
+        other = re.match(r"\s*else\s*\(", text[then_end + 1:])
+        if then_end < 0 or other is None:
+            return text
+        else_start = then_end + 1 + other.end() - 1
+        else_end = ModelIndex.closing(text, else_start)
+        if else_end < 0:
+            return text
+        if ctap.group(1) == "noCTAP":
+            return text[:branch.start()] + text[branch.end() - 1:then_end + 1] + text[else_end + 1:]
+        return text[:branch.start()] + text[else_start:else_end + 1] + text[else_end + 1:]
+
+    @staticmethod
+    def closing(text, start):
+        # the index of the parenthesis closing the one at start
+        depth = 0
+        for i in range(start, len(text)):
+            if text[i] == "(":
+                depth += 1
+            elif text[i] == ")":
+                depth -= 1
+                if depth == 0:
+                    return i
+        return -1
+
+    def identifiers(self, text):
+        return frozenset(re.findall(r"[A-Za-z_][A-Za-z0-9_']*", self.live(text)))
+
+    def dependencies(self, identifiers):
+        # the indexes of the declarations used by a .pv file with these identifiers
+        todo = [self.names[name] for name in identifiers if name in self.names]
+        used = set()
+        while True:
+            while todo:
+                i = todo.pop()
+                if i in used:
+                    continue
+                used.add(i)
+                todo.extend(self.names[name] for name in self.decls[i][1] if name in self.names)
+            for i, (names, references, digest) in enumerate(self.decls):
+                if names or i in used:
+                    continue
+                linked = [self.names[name] for name in references if name in self.names]
+                if not linked or any(j in used for j in linked):
+                    todo.append(i)
+            if not todo:
+                return used
+
+    def digest(self, text):
+        # the hash of the declarations used by the .pv file
+        key = self.identifiers(text)
+        if key not in self.slices:
+            digests = sorted(self.decls[i][2] for i in self.dependencies(key))
+            self.slices[key] = hashlib.sha256("".join(digests).encode()).hexdigest()
+        return self.slices[key]
+
+    def used_names(self, text):
+        names = set()
+        for i in self.dependencies(self.identifiers(text)):
+            names |= self.decls[i][0]
+        return sorted(names)
+
+    def changed_names(self, other):
+        # the names declared differently in the other index
+        changed = set()
+        digests = dict((digest, names) for names, references, digest in other.decls)
+        for names, references, digest in self.decls:
+            if digest not in digests:
+                changed |= names or {"(" + " ".join(sorted(references))[:40] + ")"}
+        for digest, names in digests.items():
+            if names and not any(names <= decl[0] for decl in self.decls):
+                changed |= names
+        return sorted(changed)
+
+
+class Lattice:
+    """
+    the known secure and insecure cases of a block (type, ctap, query)
+    a case is a bitmask of its compromised fields and malicious entities
+    the less is compromised, the more secure:
+    a case is secure if it is a subset of a secure case,
+    and insecure (an attack is found) if it is a superset of an insecure case
+    only the maximal secure cases and the minimal insecure cases are kept (antichains)
+    """
+
+    def __init__(self):
+        self.secure = []    # the maximal secure masks
+        self.insecure = []  # the minimal insecure masks
+
+    def is_secure(self, mask):
+        for secure in self.secure:
+            if mask & ~secure == 0:
+                return True
+        return False
+
+    def is_insecure(self, mask):
+        for insecure in self.insecure:
+            if insecure & ~mask == 0:
+                return True
+        return False
+
+    def add_secure(self, mask):
+        if not self.is_secure(mask):
+            self.secure = [secure for secure in self.secure if secure & ~mask] + [mask]
+
+    def add_insecure(self, mask):
+        if not self.is_insecure(mask):
+            self.insecure = [insecure for insecure in self.insecure if mask & ~insecure] + [mask]
+
+    @staticmethod
+    def comparable(a, b):
+        return a & ~b == 0 or b & ~a == 0
+
+
+class Frontier:
+    """
+    the frontier search over the cases of a block (type, ctap, query)
+    the cases are not run in the order of the Generator:
+    if a case is secure, all the cases below it are secure, if it's insecure, all the cases above it are insecure
+    1.  go down from the full set of compromised fields and entities, each time to a case with one less,
+        until a case is not insecure, most blocks are secure there and need only this run
+    2.  the size of this case is the boundary: run the unknown cases one larger first,
+        an insecure one decides all the cases above it, then the ones of the boundary,
+        a secure one decides all the cases below it, then the others from the largest, as the sweep
+    so a block costs as many runs as the sweep when the boundary is near the top, and much less when it's low
+    the other verdicts (tout, cannot be proved, ...) decide nothing
+    the cases running at the same time are not comparable, the result of one does not decide another
+    at most width cases of a block run at the same time, every other verdict would decide them,
+    the jobs are kept busy with the blocks of the other queries and phases
+    """
+    width = 1  # the cases of a block running at the same time
+
+    def __init__(self, block, bits):
+        self.block = block
+        self.bits = bits          # the width of the masks
+        self.tasks = []           # all the tasks of the block, in the order of the Generator
+        self.unknown = {}         # mask -> task, not decided and not running
+        self.running = set()      # the masks of the running tasks
+        self.complete = False     # all the cases of the block are pulled from the Generator
+        self.calls = 0            # the number of cases run
+        self.last = None          # the last case of the way down from the top
+        self.boundary = None      # the size of the case ending the way down
+
+    def add(self, task):
+        self.tasks.append(task)
+        self.unknown[task.case.mask] = task
+
+    @staticmethod
+    def size(mask):
+        return bin(mask).count("1")
+
+    def next_task(self, lattice):
+        candidates = [mask for mask in self.unknown
+                      if not any(Lattice.comparable(mask, running) for running in self.running)]
+        if not candidates:
+            return None
+        best = None
+        if self.boundary is None:
+            if self.last in self.running:  # the way down waits for its last case
+                return None
+            if self.last is None:
+                best = max(candidates, key=self.size)
+            elif lattice.is_secure(self.last):
+                self.boundary = self.size(self.last)
+            else:  # insecure or no verdict, one step down
+                below = [mask for mask in candidates if mask & ~self.last == 0]
+                if below:
+                    best = max(below, key=self.size)
+                else:
+                    self.boundary = self.size(self.last) - 1
+            self.last = best if best is not None else self.last
+        if best is None:
+            boundary = self.boundary
+            best = min(candidates, key=lambda mask: (0 if self.size(mask) == boundary + 1 else
+                                                     1 if self.size(mask) == boundary else 2, -self.size(mask)))
+        self.running.add(best)
+        self.calls += 1
+        return self.unknown.pop(best)
+
+    def decided(self, lattice):
+        # the unknown tasks decided by the secure/insecure sets
+        tasks = []
+        for mask in list(self.unknown):
+            if lattice.is_secure(mask):
+                tasks.append((self.unknown.pop(mask), "secure"))
+            elif lattice.is_insecure(mask):
+                tasks.append((self.unknown.pop(mask), "insecure"))
+        return tasks
+
+    def finished(self):
+        return self.complete and not self.unknown and not self.running
+
+    def sweep_calls(self):
+        # the number of cases the sweep in the order of the Generator would run, with the same verdicts
+        lattice = Lattice()
+        calls = 0
+        for task in self.tasks:
+            mask = task.case.mask
+            if lattice.is_secure(mask) or lattice.is_insecure(mask):
+                continue
+            calls += 1
+            if task.state == "secure" or task.ret == 'true':
+                lattice.add_secure(mask)
+            elif task.state == "insecure" or task.ret == 'false':
+                lattice.add_insecure(mask)
+        return calls
 
 
 class Generator:
     """
-    p, t, q, f, e, lines, t_row, i_row
-    set the phase, types, queries, fields, entities, lines, type/insert rows for a specific case.
+    p, t, q, f, e, template
+    set the phase, types, queries, fields, entities, template for a specific case.
     besides, this class maintain a secure sets to speed up the case which is subset
     find a secure set: with compromised: A, B, C, D
     then the set with compromised subset of (A, B, C, D) is also secure
+    and an insecure set: the set with compromised superset of it is also insecure
+    the sets are kept in a Lattice for each block (type, ctap, query),
+    over both the compromised fields and the malicious entities
     """
 
-    def __init__(self, phase):
-        self.secure_sets = []
-        self.insecure_sets = []
+    def __init__(self, phase, blocks=None, informative=None):
+        self.lattices = {}  # block -> Lattice
         if phase == "reg_client":
             self.phase = "reg_client"
             self.types = RegClientTypes()
@@ -592,12 +1785,7 @@ class Generator:
             self.queries = RegClientQueries()
             self.fields = RegFields()
             self.entities = RegEntities()
-            self.lines = self.read_file()
-            self.type_set_row = Setting.set_type_row                        # indicate type
-            self.fields_set_row = Setting.reg_fields_row                    # insert compromised fields
-            self.entities_noctap_set_row = Setting.reg_entities_noctap_row  # insert compromised entities in no ctap case
-            self.entities_ctap_set_row = Setting.reg_entities_ctap_row      # insert compromised entities in ctap case
-            self.entities_ctap_set_row_1 = Setting.reg_entities_ctap_row_1
+            self.template = self.read_file()
         elif phase == "reg_server":
             self.phase = "reg_server"
             self.types = RegServerTypes()
@@ -605,12 +1793,7 @@ class Generator:
             self.queries = RegServerQueries()
             self.fields = RegFields()
             self.entities = RegEntities()
-            self.lines = self.read_file()
-            self.type_set_row = Setting.set_type_row      # indicate type
-            self.fields_set_row = Setting.reg_fields_row      # insert compromised fields
-            self.entities_noctap_set_row = Setting.reg_entities_noctap_row  # insert compromised entities in no ctap case
-            self.entities_ctap_set_row = Setting.reg_entities_ctap_row      # insert compromised entities in ctap case
-            self.entities_ctap_set_row_1 = Setting.reg_entities_ctap_row_1
+            self.template = self.read_file()
         elif phase == "auth_client_em":
             self.phase = "auth_client_em"
             self.types = AuthClientEmpTypes()
@@ -618,12 +1801,7 @@ class Generator:
             self.queries = AuthClientQueries()
             self.fields = AuthFields()
             self.entities = AuthEntities()
-            self.lines = self.read_file()
-            self.type_set_row = Setting.set_type_row                         # indicate type
-            self.fields_set_row = Setting.auth_fields_row                    # insert compromised fields
-            self.entities_noctap_set_row = Setting.auth_entities_noctap_row  # insert compromised entities in no ctap case
-            self.entities_ctap_set_row = Setting.auth_entities_ctap_row      # insert compromised entities in ctap case
-            self.entities_ctap_set_row_1 = Setting.auth_entities_ctap_row_1 
+            self.template = self.read_file()
         elif phase == "auth_client_sim":
             self.phase = "auth_client_sim"
             self.types = AuthClientSimTypes()
@@ -631,12 +1809,7 @@ class Generator:
             self.queries = AuthClientTrQueries()
             self.fields = AuthFields()
             self.entities = AuthEntities()
-            self.lines = self.read_file()
-            self.type_set_row = Setting.set_type_row      # indicate type
-            self.fields_set_row = Setting.auth_fields_row      # insert compromised fields
-            self.entities_noctap_set_row = Setting.auth_entities_noctap_row  # insert compromised entities in no ctap case
-            self.entities_ctap_set_row = Setting.auth_entities_ctap_row      # insert compromised entities in ctap case
-            self.entities_ctap_set_row_1 = Setting.auth_entities_ctap_row_1
+            self.template = self.read_file()
         elif phase == "auth_client_gen":
             self.phase = "auth_client_gen"
             self.types = AuthClientGenTypes()
@@ -644,12 +1817,7 @@ class Generator:
             self.queries = AuthClientTrQueries()
             self.fields = AuthFields()
             self.entities = AuthEntities()
-            self.lines = self.read_file()
-            self.type_set_row = Setting.set_type_row      # indicate type
-            self.fields_set_row = Setting.auth_fields_row      # insert compromised fields
-            self.entities_noctap_set_row = Setting.auth_entities_noctap_row  # insert compromised entities in no ctap case
-            self.entities_ctap_set_row = Setting.auth_entities_ctap_row      # insert compromised entities in ctap case
-            self.entities_ctap_set_row_1 = Setting.auth_entities_ctap_row_1
+            self.template = self.read_file()
         elif phase == "auth_server_em":
             self.phase = "auth_server_em"
             self.types = AuthServerEmpTypes()
@@ -657,12 +1825,7 @@ class Generator:
             self.queries = AuthServerQueries()
             self.fields = AuthFields()
             self.entities = AuthEntities()
-            self.lines = self.read_file()
-            self.type_set_row = Setting.set_type_row      # indicate type
-            self.fields_set_row = Setting.auth_fields_row      # insert compromised fields
-            self.entities_noctap_set_row = Setting.auth_entities_noctap_row  # insert compromised entities in no ctap case
-            self.entities_ctap_set_row = Setting.auth_entities_ctap_row      # insert compromised entities in ctap case
-            self.entities_ctap_set_row_1 = Setting.auth_entities_ctap_row_1
+            self.template = self.read_file()
         elif phase == "auth_server_sim":
             self.phase = "auth_server_sim"
             self.types = AuthServerSimTypes()
@@ -670,12 +1833,7 @@ class Generator:
             self.queries = AuthServerTrQueries()
             self.fields = AuthFields()
             self.entities = AuthEntities()
-            self.lines = self.read_file()
-            self.type_set_row = Setting.set_type_row  # indicate type
-            self.fields_set_row = Setting.auth_fields_row      # insert compromised fields
-            self.entities_noctap_set_row = Setting.auth_entities_noctap_row  # insert compromised entities in no ctap case
-            self.entities_ctap_set_row = Setting.auth_entities_ctap_row      # insert compromised entities in ctap case
-            self.entities_ctap_set_row_1 = Setting.auth_entities_ctap_row_1
+            self.template = self.read_file()
         elif phase == "auth_server_gen":
             self.phase = "auth_server_gen"
             self.types = AuthServerGenTypes()
@@ -683,179 +1841,1908 @@ class Generator:
             self.queries = AuthServerTrQueries()
             self.fields = AuthFields()
             self.entities = AuthEntities()
-            self.lines = self.read_file()
-            self.type_set_row = Setting.set_type_row      # indicate type
-            self.fields_set_row = Setting.auth_fields_row      # insert compromised fields
-            self.entities_noctap_set_row = Setting.auth_entities_noctap_row  # insert compromised entities in no ctap case
-            self.entities_ctap_set_row = Setting.auth_entities_ctap_row      # insert compromised entities in ctap case
-            self.entities_ctap_set_row_1 = Setting.auth_entities_ctap_row_1
+            self.template = self.read_file()
+        elif phase == "reg_unlink":
+            self.phase = "reg_unlink"
+            self.types = RegGridTypes()
+            self.ctap = AllCTAPType()
+            self.template = self.read_file()
+            self.queries = GridQueries("unlink", self.template)
+            self.fields = NoFields()
+            self.entities = NoEntities()
+        elif phase == "auth_unlink":
+            self.phase = "auth_unlink"
+            self.types = AuthGridTypes()
+            self.ctap = AllCTAPType()
+            self.template = self.read_file()
+            self.queries = GridQueries("unlink", self.template)
+            self.fields = NoFields()
+            self.entities = NoEntities()
+        elif phase == "auth_a3_a4":
+            self.phase = "auth_a3_a4"
+            self.types = AuthGridTypes()
+            self.ctap = AllCTAPType()
+            self.template = self.read_file()
+            self.queries = GridQueries("A3-A4", self.template)
+            self.fields = NoFields()
+            self.entities = NoEntities()
         self.reverse_f_e()  # reverse the combinations
         self.t_nums = self.types.size()
         self.q_nums = self.queries.size()
         self.c_nums = self.ctap.size()
         self.f_nums = self.fields.size()    # the num of compromises fields
         self.e_nums = self.entities.size()  # the num of compromises entities
-        self.c_cur = 0
-        self.t_cur = 0
-        self.q_cur = 0
-        self.f_cur = 0
-        self.e_cur = -1
+        self.entity_bits = len(self.entities.all_entities)  # the mask of a case is fields << entity_bits | entities
+        self.mask_bits = len(self.fields.all_fields) + self.entity_bits
+        # the (fields, entities) of a block, from the full set of compromised fields and entities down to its subsets,
+        # a pair is f * e_nums + e
+        self.pairs = range(self.f_nums * self.e_nums)
+        self.blocks = self.order_blocks() if blocks is None else [tuple(block) for block in blocks]
+        self.informative = False  # the pairs are in the informative order, kept in the journal for --resume
+        if Setting.order == "informative":
+            # the cases in the middle of the lattice first, each of them decides the most cases above or below it
+            field_sizes = [self.fields.get(f).nums for f in range(self.f_nums)]
+            entity_sizes = [self.entities.get(e).nums for e in range(self.e_nums)]
+            middle = (max(field_sizes) + max(entity_sizes)) / 2
+            pairs = array("Q", sorted(self.pairs, key=lambda pair: abs(field_sizes[pair // self.e_nums] +
+                                                                       entity_sizes[pair % self.e_nums] - middle)))
+            self.informative = self.informative_saves(pairs) if informative is None else informative
+            if self.informative:
+                self.pairs = pairs
+        self.stream = self.indexes()
+        self.seq = 0  # the number of cases generated
+        self.positions = None  # block -> its position in self.blocks, see pending()
 
     def read_file(self):
-        if self.phase == "reg_server":
-            pv_file = open(Setting.RegPath)
-            lines = pv_file.readlines()
+        if self.phase in grid_phases():
+            path = grid_phases()[self.phase]
+            if not os.path.exists(path):
+                print(os.path.basename(path) + " does not exist")
+                sys.exit(1)
+            return Template.get(path)
+        elif self.phase == "reg_server":
+            return Template.get(Setting.RegPath)
         elif self.phase == "reg_client":
-            pv_file = open(Setting.RegPath)
-            lines = pv_file.readlines()
+            return Template.get(Setting.RegPath)
         else:
-            pv_file = open(Setting.AuthPath)
-            lines = pv_file.readlines()
-        pv_file.close()
-        return lines
+            return Template.get(Setting.AuthPath)
 
-    def generator_case(self):
-        if self.increase() is False:
-            return False, 0
-        else:
-            p = self.phase
-            cur_type = self.types.get(self.t_cur)
-            q = self.queries.get(self.q_cur)
-            f = self.fields.get(self.f_cur)
-            e = self.entities.get(self.e_cur)
-            c = self.ctap.get(self.c_cur)
-            case = Case(p, cur_type, c, q, f, e, self.lines,
-                        self.type_set_row, self.fields_set_row, self.entities_ctap_set_row,self.entities_ctap_set_row_1,self.entities_noctap_set_row)
-            return True, case
-
-    def increase(self):
-
-        if self.e_cur >= self.e_nums - 1:
-            self.e_cur = 0
-            self.secure_sets.clear()
-            if self.f_cur >= self.f_nums - 1:
-                self.f_cur = 0
-                if self.q_cur >= self.q_nums - 1:
-                    self.q_cur = 0
-                    if self.c_cur >= self.c_nums - 1:
-                        self.c_cur = 0
-                        if self.t_cur >= self.t_nums - 1:
-                            return False
-                        else:
-                            self.t_cur = self.t_cur + 1
-                    else:
-                        self.c_cur = self.c_cur + 1
-                else:
-                    self.q_cur = self.q_cur + 1
-            else:
-                self.f_cur = self.f_cur + 1
-        else:
-            # the first call of increase, e_cur from -1 to 0
-            # other cur nums are 0
-            self.e_cur = self.e_cur + 1
-        return True
+    def order_blocks(self):
+        """
+        the blocks (type, ctap, query) to verify, in the order of Setting.order
+        with --shard i/n, only the blocks i, i+n, i+2n, ... of the phase, so the shards share no secure/insecure sets
+        with the cheapest order, the blocks whose query is the fastest to verify first, from Cache/timings.json
+        """
+        blocks = [(t, c, q) for t in range(self.t_nums) for c in range(self.c_nums) for q in range(self.q_nums)]
+        index, count = Setting.shard
+        blocks = [block for i, block in enumerate(blocks) if i % count == index - 1]
+        if Setting.order == "cheapest":
+            times = TimeoutPolicy().times
+            costs = {}
+            for t, c, q in blocks:
+                runs = sorted(times.get(self.phase + "/" + self.queries.get(q).name, []))
+                costs[(t, c, q)] = runs[len(runs) // 2] if runs else float("inf")  # the unknown ones last
+            blocks.sort(key=lambda block: costs[block])
+        return blocks
 
-    def reverse_f_e(self):
+    def informative_saves(self, pairs):
+        """
+        whether the informative order of the pairs runs fewer cases than the default order,
+        counted with the verdicts of the last run which verified this phase, see ResultStore.last_verdicts()
+        without them, or if it does not save runs, the default order is used
+        the middle cases are not comparable, they do not decide each other,
+        it only saves runs when the boundary between the secure and insecure cases is low in most blocks
+        """
+        verdicts = ResultStore.last_verdicts(self.phase)
+        masks = [self.fields.get(pair // self.e_nums).mask << self.entity_bits | self.entities.get(pair % self.e_nums).mask
+                 for pair in self.pairs]
+        default = informative = 0
+        for block in self.blocks:
+            if block in verdicts:
+                default += self.runs(verdicts[block], masks, self.pairs)
+                informative += self.runs(verdicts[block], masks, pairs)
+        if not verdicts:
+            print(self.phase + ": --order informative needs the verdicts of a last run, the default order is used.")
+        elif informative >= default:
+            print(self.phase + ": --order informative would run " + str(informative) + " cases, " + str(default) +
+                  " in the default order with the verdicts of the last run, the default order is used.")
+        return bool(verdicts) and informative < default
+
+    @staticmethod
+    def runs(known, masks, pairs):
+        # the cases run in the order of the pairs, with the verdicts of the secure/insecure sets known
+        lattice = Lattice()
+        calls = 0
+        for pair in pairs:
+            mask = masks[pair]
+            if lattice.is_secure(mask) or lattice.is_insecure(mask):
+                continue
+            calls += 1
+            if known.is_secure(mask):
+                lattice.add_secure(mask)
+            elif known.is_insecure(mask):
+                lattice.add_insecure(mask)
+        return calls
+
+    def indexes(self):
+        # the indexes (type, ctap, query, fields, entities) of the cases, generated when they are pulled
+        for t, c, q in self.blocks:
+            for pair in self.pairs:
+                f, e = divmod(pair, self.e_nums)
+                yield t, c, q, f, e
+
+    def generator_case(self):
+        index = next(self.stream, None)
+        if index is None:
+            return False, 0
+        self.seq = self.seq + 1
+        return True, self.case_at(index)
+
+    def case_at(self, index):
+        # the case of the indexes (type, ctap, query, fields, entities), the Generator does not move
+        t, c, q, f, e = index
+        seq = (((t * self.c_nums + c) * self.q_nums + q) * self.f_nums + f) * self.e_nums + e
+        fields = self.fields.get(f)
+        entities = self.entities.get(e)
+        case = Case(self.phase, self.types.get(t), self.ctap.get(c), self.queries.get(q), fields, entities,
+                    self.template, index, seq)
+        case.mask = fields.mask << self.entity_bits | entities.mask
+        return case
+
+    def pending(self, index):
+        """
+        whether the case of the indexes is in a block of this Generator, so of the shard, and not generated yet,
+        the cases of the journal continued by --resume are generated by skip()
+        """
+        if self.positions is None:
+            self.positions = dict((block, i) for i, block in enumerate(self.blocks))
+            if not isinstance(self.pairs, range):  # pair -> its position in self.pairs
+                self.pair_positions = array("Q", bytes(self.pairs.itemsize * len(self.pairs)))
+                for i, pair in enumerate(self.pairs):
+                    self.pair_positions[pair] = i
+        t, c, q, f, e = index
+        block = self.positions.get((t, c, q))
+        if block is None:
+            return False
+        pair = f * self.e_nums + e
+        if not isinstance(self.pairs, range):
+            pair = self.pair_positions[pair]
+        return block * len(self.pairs) + pair >= self.seq
+
+    def undecided_before(self, index):
+        """
+        whether a case of the block of the indexes, before it and not generated yet, may decide it,
+        it's not known to be skipped by the secure/insecure sets, see may_decide()
+        the case of the indexes is pending, see pending()
+        """
+        t, c, q, f, e = index
+        position = f * self.e_nums + e
+        if not isinstance(self.pairs, range):
+            position = self.pair_positions[position]
+        lattice = self.lattices.get((t, c, q))
+        mask = self.fields.get(f).mask << self.entity_bits | self.entities.get(e).mask
+        for i in range(max(self.seq - self.positions[(t, c, q)] * len(self.pairs), 0), position):
+            f, e = divmod(self.pairs[i], self.e_nums)
+            earlier = self.fields.get(f).mask << self.entity_bits | self.entities.get(e).mask
+            if not Lattice.comparable(earlier, mask):
+                continue
+            if lattice is None or not (lattice.is_secure(earlier) or lattice.is_insecure(earlier)):
+                return True
+        return False
+
+    def skip(self, count):
+        # continue after the first count cases
+        for index in itertools.islice(self.stream, count):
+            self.seq = self.seq + 1
+
+    def total(self):
+        # the number of cases, t_nums * c_nums * q_nums * f_nums * e_nums, or the ones of the blocks of --shard
+        return len(self.blocks) * len(self.pairs)
+
+    def reverse_f_e(self):
         """
         to find out the minimum assumptions
         we start from the full set of compromised fields and entities
         then iterate over its subset
         """
-        self.fields.fields.reverse()
-        self.entities.entities.reverse()
+        self.fields.masks.reverse()
+        self.entities.masks.reverse()
 
-    def this_case_is_secure(self):  # add a secure sets
-        self.secure_sets.append(self.entities.get(self.e_cur).row_numbers)
+    @staticmethod
+    def block(case):
+        # the secure/insecure sets are shared by the cases with the same type, ctap and query
+        return case.index[:3]
 
-    def jump_if_its_secure(self):
-        for secure_case in self.secure_sets:
-            cur_case = self.entities.get(self.e_cur).row_numbers
-            if set(cur_case).issubset(set(secure_case)):
-                return True
-        return False
+    def lattice(self, case):
+        block = self.block(case)
+        if block not in self.lattices:
+            self.lattices[block] = Lattice()
+        return self.lattices[block]
 
-    def this_case_is_insecure(self):
-        self.insecure_sets.append(self.entities.get(self.e_cur).row_numbers)
+    def this_case_is_secure(self, case):  # add a secure sets
+        self.lattice(case).add_secure(case.mask)
 
-    def jump_if_its_insecure(self):
-        for insecure_case in self.insecure_sets:
-            cur_case = self.entities.get(self.e_cur).row_numbers
-            if set(cur_case).issubset(set(insecure_case)):
-                return True
-        return False
+    def jump_if_its_secure(self, case):
+        return self.lattice(case).is_secure(case.mask)
+
+    def this_case_is_insecure(self, case):  # add an insecure sets
+        self.lattice(case).add_insecure(case.mask)
+
+    def jump_if_its_insecure(self, case):
+        return self.lattice(case).is_insecure(case.mask)
 
+    def describe(self, mask):
+        # the indexes of the compromised fields and malicious entities in a mask, with -s the name of SimpleFields
+        fields = [str(i) for i in range(self.mask_bits - self.entity_bits) if mask >> self.entity_bits & 1 << i]
+        entities = [str(i) for i in range(self.entity_bits) if mask & 1 << i]
+        if self.fields.simple:
+            return self.fields.get(0).name + " mali-" + str(len(entities)) + ",,," + ",".join(entities)
+        return "fields-" + str(len(fields)) + ",,," + ",".join(fields) + " mali-" + str(len(entities)) + ",,," + ",".join(entities)
+
+    def may_decide(self, earlier, case):
+        """
+        whether the result of an earlier case can make this case skipped
+        a case has to wait for all these cases before it's run
+        then a case running later can not change the decision, it's the same as running the cases one by one
+        """
+        return self.block(earlier) == self.block(case) and Lattice.comparable(earlier.mask, case.mask)
 
-def analysis(phase, log):
+
+def analysis(phase, log, telemetry=None):
     """
     giving the phase and a log file name, then start analysis
     1.  initialize a Generator: set the phase, types, queries, fields, entities, lines, type/insert rows
         of a certain authenticator and a certain phase
         a. fields and entities contain all possible compromised alternatives[all_] and combinations[fields/entities]
-        b. self.t_cur = 0 record the current type under analyzing
-        c. self.q_cur = 0 record the current query under analyzing
-        d. self.f_cur = 0  record the current number of compromised fields under analyzing
-        e. self.e_cur = -1 record the current number of compromised entities under analyzing
+        b. the blocks (type, ctap, query) are ordered by Setting.order, and only the ones of Setting.shard are kept
     2.  call function in Class Generator: generator_case() to constitute a certain case
-        in generator_case(), it calls increase() to update the cur numbers
-        cur numbers are indexes of the list, so compared with num-1
-        the logic is: entities, fields, queries, types
+        the indexes of the cases are generated block by block when they are pulled,
+        in a block: fields, then entities, from the full sets down to the empty sets
         after going through all the cases, the return: r = False
     3.  review the current case to determine if it is safe/unsafe
         if the initial check cannot be confirmed, call case.analyze()
     """
     gen = Generator(phase)
     count = 0
+    steps = {}  # the runs of the steps of the ladder, see count_steps()
     while True:
         r, case = gen.generator_case()
         if r is False:
             break
-        if gen.jump_if_its_secure():
-            # ljust(n)Returns the left justified string
-            # and fills in the new string with spaces of the specified length
-            msg = str(count).ljust(5) + phase.ljust(4) + "skipping for secure sets"
-        elif gen.jump_if_its_insecure():
-            msg = str(count).ljust(5) + phase.ljust(4) + "skipping for noprove sets"
+        if gen.jump_if_its_secure(case):
+            msg = case_message(count, phase, "secure", case)
+            write_result(count, case, "secure", msg)
+            write_telemetry(telemetry, count, case, "secure")
+        elif gen.jump_if_its_insecure(case):
+            msg = case_message(count, phase, "insecure", case)
+            write_result(count, case, "insecure", msg)
+            write_telemetry(telemetry, count, case, "insecure")
         else:
-            msg = str(count).ljust(5) + phase.ljust(4)
             ret, result, content = case.analyze()
-            if ret == 'true':
-                gen.this_case_is_secure()
-                msg += "  true"
-            else:
-                msg += "  " + ret
-
-            msg += " type "
-            msg += case.type.name.ljust(4)
-            msg += " query "
-            msg += case.query.name.ljust(4)
-            msg += " ctap "
-            msg += case.ctap.name.ljust(5)
-            msg += str(case.fields.name).ljust(9)
-            msg += " "
-            msg += str(case.entities.name).ljust(8)
-            if ret != 'false':  # only write the analysis file for true cases
-                if not os.path.exists(Setting.ResultPath + case.phase + "/" + case.ctap.name + "/"+ case.type.name + "/" + case.query.name):
-                    os.makedirs(Setting.ResultPath + case.phase + "/" + case.ctap.name + "/" + case.type.name + "/" + case.query.name)
-                f = open(Setting.ResultPath + case.phase + "/" + case.ctap.name + "/" + case.type.name + "/" + case.query.name + "/" + msg,
-                         "w")
-                f.writelines(content)
-                f.writelines(str(result[-1000:-1]))
-                f.close()
+            if ret == 'true' and not case.timed_out:
+                gen.this_case_is_secure(case)
+            elif ret == 'false' and not case.timed_out:
+                gen.this_case_is_insecure(case)
+            msg = case_message(count, phase, ret, case)
+            info = case_info(case, Setting.timeouts[0])
+            write_result(count, case, ret, msg, info, result)
+            write_telemetry(telemetry, count, case, ret, info)
+            count_steps(steps, case.steps)
         count = count + 1
         write_log(msg, log)
         log.flush()
+    write_log(ladder_message(phase, steps), log)
+    ResultStore.commit()
+
+
+def write_telemetry(telemetry, count, case, ret, info=None):
+    """
+    the json line of a case in LOG/xxx.jsonl, next to its line in LOG/xxx.log
+    ret is the result of ProVerif, or "secure"/"insecure" if the case is skipped
+    info is how the case is verified, see case_info(), None if it is skipped
+    """
+    if telemetry is None:
+        return
+    record = {"count": count, "phase": case.phase, "type": case.type.name, "ctap": case.ctap.name,
+              "query": case.query.name, "fields": case.fields.nums, "entities": case.entities.nums,
+              "mask": case.mask, "verdict": ret, "pruned": ret in ("secure", "insecure")}
+    if info is None:
+        info = {"cached": False, "timed_out": False, "budget": None}
+        info.update(new_usage())
+        info["batch"] = 0
+    record.update(info)
+    print(json.dumps(record), file=telemetry)
+
+
+def case_message(count, phase, ret, case):
+    """
+    the line in the log file for a case
+    ret is the result of ProVerif, or "secure"/"insecure" if the case is skipped
+    """
+    # ljust(n)Returns the left justified string
+    # and fills in the new string with spaces of the specified length
+    if ret == "secure":
+        return str(count).ljust(5) + phase.ljust(4) + "skipping for secure sets"
+    if ret == "insecure":
+        return str(count).ljust(5) + phase.ljust(4) + "skipping for noprove sets"
+    msg = str(count).ljust(5) + phase.ljust(4)
+    msg += "  " + ret
+    msg += case_name(case)
+    return msg
+
+
+def case_name(case):
+    # the type, query, ctap, fields and entities of a case in the log
+    msg = " type "
+    msg += case.type.name.ljust(4)
+    msg += " query "
+    msg += case.query.name.ljust(4)
+    msg += " ctap "
+    msg += case.ctap.name.ljust(5)
+    msg += str(case.fields.name).ljust(9)
+    msg += " "
+    msg += str(case.entities.name).ljust(8)
+    return msg
+
+
+def write_result(count, case, ret, msg, info=None, result=None):
+    # the row of a case in Result/results.db, see ResultStore
+    ResultStore.get().add(count, case, ret, msg, info, result)
+
+
+class ResultStore:
+    """
+    the results of the cases in Result/results.db, a row for each line of the logs:
+    the phase and the line number, the type, ctap and query, the indexes of the case in the Generator,
+    the numbers, the code and the masks of the compromised fields and malicious entities, the verdict (or secure/insecure if skipped),
+    the time limit, the step of the ladder giving the verdict, the resources used by ProVerif, the log message and the end of the output of ProVerif
+    the .pv file of a case is not kept, it's rendered again from the template, see render()
+    the model files of each phase are kept by their hash, to know if they are changed since
+    export() writes the old Result/<phase>/<ctap>/<type>/<query>/<log message> files
+    """
+    current = None  # the store of this process
+    columns = ["phase", "count", "type", "ctap", "query", "t", "c", "q", "f", "e", "fields", "entities",
+               "field_names", "entity_names", "mask", "field_mask", "entity_mask", "verdict", "pruned",
+               "cached", "timed_out", "budget", "wall", "user", "sys", "maxrss", "batch", "replicated",
+               "message", "tail", "step"]
+
+    def __init__(self, path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.db = sqlite3.connect(path)
+        self.db.execute("CREATE TABLE IF NOT EXISTS cases (phase TEXT, count INTEGER, type TEXT, ctap TEXT, query TEXT, "
+                        "t INTEGER, c INTEGER, q INTEGER, f INTEGER, e INTEGER, fields INTEGER, entities INTEGER, "
+                        "field_names TEXT, entity_names TEXT, mask INTEGER, field_mask INTEGER, entity_mask INTEGER, "
+                        "verdict TEXT, pruned INTEGER, cached INTEGER, timed_out INTEGER, budget INTEGER, "
+                        "wall REAL, user REAL, sys REAL, maxrss INTEGER, batch INTEGER, replicated INTEGER, "
+                        "message TEXT, tail BLOB, step TEXT, PRIMARY KEY (phase, count))")
+        try:  # the results.db of the runs before the ladder
+            self.db.execute("ALTER TABLE cases ADD COLUMN step TEXT")
+        except sqlite3.OperationalError:
+            pass
+        # the secure/insecure cases of a block, for the frontier and the minimal assumptions
+        self.db.execute("CREATE INDEX IF NOT EXISTS block_verdict ON cases (phase, ctap, type, query, verdict, mask)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS case_index ON cases (phase, t, c, q, f, e)")
+        self.db.execute("CREATE TABLE IF NOT EXISTS models (phase TEXT PRIMARY KEY, scenarios TEXT, model TEXT)")
+        self.db.commit()
+
+    @staticmethod
+    def get():
+        if ResultStore.current is None:
+            ResultStore.current = ResultStore(Setting.ResultPath + "results.db")
+        return ResultStore.current
+
+    @staticmethod
+    def commit():
+        if ResultStore.current is not None:
+            ResultStore.current.db.commit()
+
+    @staticmethod
+    def close():
+        if ResultStore.current is not None:
+            ResultStore.current.db.commit()
+            ResultStore.current.db.close()
+            ResultStore.current = None
+
+    def add(self, count, case, ret, msg, info=None, result=None):
+        if info is None:
+            info = {"cached": False, "timed_out": False, "budget": None, "replicated": False}
+            info.update(new_usage())
+            info["batch"] = 0
+        tail = None
+        if result is not None and ret != 'false':  # only keep the output for true cases, as the analysis files
+            tail = result[-1000:-1]
+        t, c, q, f, e = case.index
+        row = [case.phase, count, case.type.name, case.ctap.name, case.query.name, t, c, q, f, e,
+               case.fields.nums, case.entities.nums, " ".join(item.strip() for item in case.fields.fields),
+               str(case.entities.name),
+               case.mask, case.fields.mask, case.entities.mask, ret, ret in ("secure", "insecure"),
+               info["cached"], info["timed_out"], info["budget"], info["wall"], info["user"], info["sys"],
+               info["maxrss"], info["batch"], info.get("replicated", False), msg, tail, info.get("step")]
+        self.db.execute("INSERT OR REPLACE INTO cases VALUES (" + ",".join("?" * len(row)) + ")", row)
+
+    def start(self, phase):
+        # the phase is verified from the start with the model files of now
+        self.db.execute("DELETE FROM cases WHERE phase = ?", (phase,))
+        self.db.execute("INSERT OR REPLACE INTO models VALUES (?, ?, ?)",
+                        (phase, Setting.analyze_flag, Journal.model_hash()))
+        self.db.commit()
+
+    def truncate(self, phase, count):
+        # the phase continues after its first count lines, see Journal
+        self.db.execute("DELETE FROM cases WHERE phase = ? AND count >= ?", (phase, count))
+        self.db.commit()
+
+    def changed(self, phase):
+        # if the model files are changed since the phase is verified
+        row = self.db.execute("SELECT model FROM models WHERE phase = ?", (phase,)).fetchone()
+        return row is None or row[0] != Journal.model_hash()
+
+    @staticmethod
+    def last_verdicts(phase):
+        # the secure/insecure sets of each block (t, c, q) of the phase in the last run before this one which verified it
+        relative = Setting.ResultPath[len(Setting.RunPath):] + "results.db"
+        for name in reversed(Setting.runs()):
+            path = Setting.RunsPath + name + "/" + relative
+            if Setting.RunsPath + name + "/" == Setting.RunPath or not os.path.exists(path):
+                continue
+            store = ResultStore(path)
+            blocks = {}
+            for row in store.rows("WHERE phase = ? AND timed_out = 0 AND verdict IN ('true', 'false')", [phase]):
+                lattice = blocks.setdefault((row["t"], row["c"], row["q"]), Lattice())
+                if row["verdict"] == 'true':
+                    lattice.add_secure(row["mask"])
+                else:
+                    lattice.add_insecure(row["mask"])
+            store.db.close()
+            if blocks:
+                return blocks
+        return {}
+
+    def rows(self, where="", args=()):
+        cursor = self.db.execute("SELECT " + ", ".join(self.columns) + " FROM cases " + where, args)
+        for row in cursor:
+            yield dict(zip(self.columns, row))
+
+    def render(self, row, generators):
+        # the .pv file verified for a row, the one of the step of the ladder giving its verdict
+        if row["phase"] not in generators:
+            generators[row["phase"]] = Generator(row["phase"])
+        case = generators[row["phase"]].case_at((row["t"], row["c"], row["q"], row["f"], row["e"]))
+        return case.render(row["step"] or ("full" if row["replicated"] else "none"))
+
+    def export(self, path, phases):
+        # the analysis files of the cases which are not false, as they were written in Result/
+        count = 0
+        generators = {}
+        for phase in phases:
+            row = self.db.execute("SELECT scenarios FROM models WHERE phase = ?", (phase,)).fetchone()
+            if row is None:
+                continue
+            if self.changed(phase):
+                print(phase + ": the model files are changed since it was verified, the .pv files may differ.")
+            Setting.analyze_flag = row[0]
+            for row in self.rows("WHERE phase = ? AND tail IS NOT NULL ORDER BY count", (phase,)):
+                directory = path + row["phase"] + "/" + row["ctap"] + "/" + row["type"] + "/" + row["query"]
+                os.makedirs(directory, exist_ok=True)
+                f = open(directory + "/" + row["message"], "w")
+                f.write(self.render(row, generators))
+                f.writelines(str(row["tail"]))
+                f.close()
+                count += 1
+        return count
+
+    def assumptions(self, phase, query=None, ctap=None, types=None):
+        """
+        the minimal assumptions of each block (type, ctap, query) of a phase:
+        the maximal sets of compromised fields and malicious entities with which the query is still true,
+        and the minimal ones with which an attack is found
+        """
+        where = "WHERE phase = ? AND timed_out = 0 AND verdict IN ('true', 'false')"
+        args = [phase]
+        for column, value in (("query", query), ("ctap", ctap), ("type", types)):
+            if value is not None:
+                where += " AND " + column + " = ?"
+                args.append(value)
+        blocks = {}  # (type, ctap, query) -> Lattice
+        names = {}   # (type, ctap, query, mask) -> the fields and entities
+        for row in self.rows(where + " ORDER BY t, c, q, count", args):
+            block = (row["type"], row["ctap"], row["query"])
+            lattice = blocks.setdefault(block, Lattice())
+            if row["verdict"] == 'true':
+                lattice.add_secure(row["mask"])
+            else:
+                lattice.add_insecure(row["mask"])
+            names[block + (row["mask"],)] = row["entity_names"] + " " + (row["field_names"] or "no fields")
+        return [(block, [names[block + (mask,)] for mask in lattice.secure],
+                 [names[block + (mask,)] for mask in lattice.insecure]) for block, lattice in blocks.items()]
+
+
+def init_worker(settings):
+    # a worker process in the pool starts with the settings of the main process
+    Setting.restore(settings)
+
+
+def run_case(case, budget):
+    # the job of a worker process in the pool
+    ret, result, content = case.analyze(budget)
+    return ret, result, content, case_info(case, budget)
+
+
+def case_info(case, budget):
+    # how a case is verified, for the Scheduler and the telemetry
+    info = {"cached": case.from_cache, "timed_out": case.timed_out, "budget": budget, "replicated": case.step == "full",
+            "step": case.step, "steps": case.steps}
+    info.update(case.usage)
+    return info
+
+
+def run_batch(cases, budget):
+    # the job of a worker process in the pool with --batch
+    returns = []
+    for (ret, result, content), case in zip(analyze_batch(cases, budget), cases):
+        returns.append((ret, result, content, case_info(case, budget)))
+    return returns
+
+
+class RemotePool:
+    """
+    the cases run by the workers of other machines instead of the local processes, see --listen
+    a worker connects with "python FIDO2Verif.py worker <host:port>", one connection for each ProVerif it runs,
+    the messages are json lines:
+    1.  the worker says hello, the pool sends the model files and the settings of the sweep
+    2.  the pool sends a case {"job": "case", "cases": [[phase, index]], "budget": s, "steps": n, "passed": [...]},
+        or the cases of a batch {"job": "batch", ...}, the worker answers the returns of run_case / run_batch,
+        steps is the number of steps of the ladder left, each of them may run ProVerif for budget seconds,
+        passed are the steps passed by the runs out of time of a retried case, see Case.passed
+    the Scheduler keeps the secure/insecure sets and writes the logs as with the local processes,
+    a case sent to a worker whose connection is lost, or which does not answer in time, is sent to another one
+    the pool stays open with --watch, the workers get the new model files before their next case
+    """
+    current = None  # the pool of this process
+    settings = ["analyze_flag", "trace", "use_cache", "ladder"]  # the settings of the sweep used by the workers
+    margin = 60     # seconds, the time a worker may take more than the time limits of ProVerif
+
+    def __init__(self, address):
+        self.server = socket.create_server(address)
+        self.lock = Condition()
+        self.jobs = deque()   # (future, request) not sent yet
+        self.setup = None     # the model files and the settings sent to the workers
+        self.version = 0      # the version of setup, increased for each sweep
+        self.workers = 0      # the number of connections
+        Thread(target=self.accept, daemon=True).start()
+        print("waiting for the workers on " + address[0] + ":" + str(address[1]) + ".")
+
+    @staticmethod
+    def get():
+        if RemotePool.current is None:
+            RemotePool.current = RemotePool(Setting.listen)
+        RemotePool.current.prepare()
+        return RemotePool.current
+
+    def prepare(self):
+        # the model files and the settings of this sweep
+        files = {}
+        for path in Setting.model_paths():
+            f = open(path, encoding="utf-8")
+            files[os.path.basename(path)] = f.read()
+            f.close()
+        with self.lock:
+            self.version += 1
+            self.setup = {"job": "setup", "version": self.version, "files": files,
+                          "settings": dict((name, getattr(Setting, name)) for name in self.settings)}
+
+    def slots(self):
+        return self.workers
+
+    def submit(self, fn, cases, budget):
+        # run_case(case, budget) or run_batch(cases, budget) on a worker, as ProcessPoolExecutor.submit
+        if fn is run_case:
+            request = {"job": "case", "cases": [[cases.phase, list(cases.index)]], "budget": budget,
+                       "steps": len(cases.template.steps()) - len(cases.passed), "passed": cases.passed}
+        else:  # the cases of a batch climb the ladder together, one run of ProVerif for each step
+            request = {"job": "batch", "cases": [[case.phase, list(case.index)] for case in cases], "budget": budget,
+                       "steps": len(cases[0].template.steps())}
+        future = Future()
+        with self.lock:
+            self.jobs.append((future, request))
+            self.lock.notify()
+        return future
+
+    def accept(self):
+        while True:
+            try:
+                connection, address = self.server.accept()
+            except OSError:
+                return
+            Thread(target=self.serve, args=(connection, address[0] + ":" + str(address[1])), daemon=True).start()
+
+    def serve(self, connection, name):
+        # send the cases to a worker until its connection is lost
+        stream = connection.makefile("rwb")
+        version = 0
+        job = None
+        with self.lock:
+            self.workers += 1
+        try:
+            connection.settimeout(self.margin)
+            hello = json.loads(stream.readline())
+            name = hello.get("worker", "") + "(" + name + ")"
+            while True:
+                with self.lock:
+                    while not self.jobs:
+                        self.lock.wait()
+                    job = self.jobs.popleft()
+                    setup = self.setup
+                future, request = job
+                if version != setup["version"]:
+                    connection.settimeout(self.margin)
+                    send_message(stream, setup)
+                    json.loads(stream.readline())
+                    version = setup["version"]
+                # ProVerif may run once for each step of the ladder
+                connection.settimeout(request["budget"] * request["steps"] + self.margin)
+                send_message(stream, request)
+                reply = json.loads(stream.readline())
+                job = None
+                if "error" in reply:
+                    future.set_exception(RuntimeError("worker " + name + ": " + reply["error"]))
+                elif request["job"] == "case":
+                    future.set_result(decode_returns(reply["returns"])[0])
+                else:
+                    future.set_result(decode_returns(reply["returns"]))
+        except (OSError, ValueError):  # lost, or no answer in time
+            pass
+        finally:
+            with self.lock:
+                self.workers -= 1
+                if job is not None:  # sent to another worker
+                    self.jobs.appendleft(job)
+                    self.lock.notify()
+            connection.close()
+            print("worker " + name + " is disconnected" + (", its case is sent again." if job is not None else "."))
+
+
+def send_message(stream, message):
+    stream.write(json.dumps(message).encode("utf-8") + b"\n")
+    stream.flush()
+
+
+def encode_returns(returns):
+    # the returns of run_case / run_batch in json, the output of ProVerif is bytes
+    return [[ret, result.decode("latin-1"), content, info] for ret, result, content, info in returns]
+
+
+def decode_returns(returns):
+    return [(ret, result.encode("latin-1"), content, info) for ret, result, content, info in returns]
+
+
+class RemoteWorker:
+    """
+    a worker of RemotePool, "python FIDO2Verif.py worker <host:port> [-j n] [--dir path]"
+    it runs n cases at the same time, one for each connection, with the model files of the pool written in path
+    it waits for the pool to start, a connection lost is opened again, waiting 1, 2, 4, ... up to backoff seconds
+    between the tries, and it stops when the pool can not be reached for patience seconds after a connection
+    """
+    backoff = 30    # seconds, the longest wait between two tries to connect again
+    patience = 600  # seconds, the pool is closed if a lost connection can not be opened again in this time
+
+    def __init__(self, address, slots, root):
+        self.address = address
+        self.slots = slots
+        self.lock = Lock()
+        self.version = 0       # the version of the setup of the pool in use
+        self.generators = {}   # phase -> the Generator giving the cases
+        os.makedirs(root, exist_ok=True)
+        Setting.set_root(os.path.abspath(root) + "/")
+        os.makedirs(Setting.ScriptPath, exist_ok=True)
+
+    def run(self):
+        threads = [Thread(target=self.connect) for i in range(self.slots)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        Setting.remove_workspace()
+
+    def connect(self):
+        # the cases of one connection, opened again when it's lost
+        lost = None  # the time the last connection is lost, None before the first one
+        while True:
+            delay = 1
+            while True:
+                if lost is not None:
+                    if time.time() - lost > self.patience:  # the pool is closed
+                        return
+                    time.sleep(delay)
+                    delay = min(2 * delay, self.backoff)
+                try:
+                    connection = socket.create_connection(self.address)
+                    break
+                except OSError:
+                    if lost is None:
+                        time.sleep(2)  # the pool is not started yet
+            self.serve(connection)
+            lost = time.time()
+            print("the connection to the pool is lost, connecting again.")
+
+    def serve(self, connection):
+        # run the cases sent on a connection until it's lost
+        stream = connection.makefile("rwb")
+        try:
+            send_message(stream, {"worker": socket.gethostname() + "/" + str(os.getpid())})
+            for line in stream:
+                request = json.loads(line)
+                if request["job"] == "setup":
+                    self.set_up(request)
+                    send_message(stream, {"ready": True})
+                    continue
+                try:
+                    cases = [self.case(phase, index) for phase, index in request["cases"]]
+                    cases[0].passed = request.get("passed", [])  # a retried case starts at the step out of time
+                    if request["job"] == "case":
+                        returns = [run_case(cases[0], request["budget"])]
+                    else:
+                        returns = run_batch(cases, request["budget"])
+                    send_message(stream, {"returns": encode_returns(returns)})
+                except Exception:
+                    send_message(stream, {"error": traceback.format_exc()})
+        except (OSError, ValueError):  # lost, or a line cut
+            pass
+        connection.close()
+
+    def set_up(self, setup):
+        # the model files and the settings of a sweep of the pool
+        with self.lock:
+            if setup["version"] == self.version:
+                return
+            for name, text in setup["files"].items():
+                f = open(Setting.RootPath + os.path.basename(name), "w", encoding="utf-8")
+                f.write(text)
+                f.close()
+            Setting.restore(setup["settings"])
+            Setting.prepare()
+            self.generators = {}
+            self.version = setup["version"]
+
+    def case(self, phase, index):
+        with self.lock:
+            if phase not in self.generators:
+                self.generators[phase] = Generator(phase)
+            return self.generators[phase].case_at(tuple(index))
+
+
+class TimeoutPolicy:
+    """
+    the time limits of ProVerif for the cases
+    the first pass of a case gets a limit learned from the run times of the cases of the same phase and query:
+    twice the slowest of the recent runs finished in time, at least Setting.min_timeout and at most Setting.timeouts[0]
+    so the cheap queries do not wait long for a case which will not finish
+    a case out of time is retried at the end of the sweep with the next limits of Setting.timeouts
+    the run times are kept in Cache/timings.json for the next runs
+    """
+    samples = 20   # the number of run times needed to learn a limit
+    keep = 200     # the number of recent run times kept for a phase and query
+
+    def __init__(self):
+        self.path = Setting.CachePath + "timings.json"
+        self.times = {}  # "phase/query" -> the run times finished in time
+        try:
+            f = open(self.path, encoding="utf-8")
+            self.times = json.load(f)
+            f.close()
+        except (OSError, ValueError):
+            pass
+
+    @staticmethod
+    def key(case):
+        return case.phase + "/" + case.query.name
+
+    def first_budget(self, case):
+        times = self.times.get(self.key(case), [])
+        if len(times) < self.samples:
+            return Setting.timeouts[0]
+        budget = max(Setting.min_timeout, 2 * max(times))
+        return min(Setting.timeouts[0], int(budget + 1))
+
+    def next_budget(self, budget):
+        # the next limit of the ladder, None if there is no more
+        for timeout in Setting.timeouts:
+            if timeout > budget:
+                return timeout
+        return None
+
+    def record(self, case, info):
+        # the limit is for each run of ProVerif, so each step of the ladder is a run time,
+        # the last one is not finished in time if the case is out of time
+        walls = info["walls"][:-1] if info["timed_out"] else info["walls"]
+        if info["cached"] or not walls:
+            return
+        times = self.times.setdefault(self.key(case), [])
+        times.extend(round(wall, 3) for wall in walls)
+        del times[:-self.keep]
+
+    def save(self):
+        os.makedirs(Setting.CachePath, exist_ok=True)
+        f = open(self.path, "w", encoding="utf-8")
+        json.dump(self.times, f)
+        f.close()
+
+
+class CostModel:
+    """
+    the cost of a case predicted from the runs of ProVerif of the last sweeps, kept in Cache/costs.json
+    it learns from the same values as the telemetry of the cases, see case_info()
+    a case is described by its phase, ctap, query, kind of query and the numbers of compromised fields and entities,
+    its cost is the mean of the runs with the same description, or a wider one if there are too few runs:
+        phase/ctap/query/fields-n/mali-n -> phase/ctap/query -> CTAP or not/kind of query -> all the runs
+    the runs resolved by the first pass without the replications are counted apart from the ones run twice
+    for each phase and query, and for all of them, it also counts the cases run by ProVerif and the ones skipped
+    by the secure/insecure sets
+    the old runs weigh less and less, so it follows the changes of the model files
+    """
+    samples = 3       # the runs needed to use a description
+    keep = 200        # the runs counted for a description, the older ones fade out
+    default = 10.0    # seconds of a case with no runs at all
+
+    def __init__(self):
+        self.path = Setting.CachePath + "costs.json"
+        self.stats = {}  # description -> [runs, wall, cpu, runs resolved without the replications]
+        self.runs = {}   # "phase/query" -> [cases, cases run by ProVerif]
+        try:
+            f = open(self.path, encoding="utf-8")
+            data = json.load(f)
+            f.close()
+            self.stats, self.runs = data["stats"], data["runs"]
+        except (OSError, ValueError, KeyError):
+            pass
+
+    @staticmethod
+    def keys(case):
+        # the descriptions of a case, from the narrowest to the widest
+        kind = "injective" if "inj-event" in case.query.write else case.query.kind
+        block = case.phase + "/" + case.ctap.name + "/" + case.query.name
+        return [block + "/" + case.fields.name + "/mali-" + str(case.entities.nums), block,
+                ("noCTAP" if case.ctap.name == "noCTAP" else "CTAP") + "/" + kind, ""]
+
+    def predict(self, case):
+        # the seconds of wall and CPU time of a run of the case
+        for key in self.keys(case):
+            stat = self.stats.get(key)
+            if stat is not None and stat[0] >= self.samples:
+                return stat[1] / stat[0], stat[2] / stat[0]
+        return self.default, self.default
+
+    def run_share(self, case):
+        # the part of the cases of its phase and query run by ProVerif, the others are skipped
+        for key in (case.phase + "/" + case.query.name, ""):
+            runs = self.runs.get(key)
+            if runs is not None and runs[0] > 0:
+                return runs[1] / runs[0]
+        return 1.0
+
+    def first_share(self):
+        # the part of the runs resolved without the replications
+        stat = self.stats.get("")
+        return stat[3] / stat[0] if stat and stat[0] else None
+
+    def record(self, case, info):
+        if info["cached"]:
+            return
+        wall = sum(info["walls"])
+        cpu = info["user"] + info["sys"]
+        for key in self.keys(case):
+            stat = self.stats.setdefault(key, [0, 0.0, 0.0, 0])
+            if stat[0] >= self.keep:
+                stat[:] = [value * (self.keep - 1) / self.keep for value in stat]
+            stat[0] += 1
+            stat[1] += wall
+            stat[2] += cpu
+            stat[3] += 0 if info.get("replicated") else 1
+
+    def count(self, case, pruned):
+        for key in (case.phase + "/" + case.query.name, ""):
+            runs = self.runs.setdefault(key, [0, 0])
+            if runs[0] >= 50 * self.keep:
+                runs[:] = [value * (50 * self.keep - 1) / (50 * self.keep) for value in runs]
+            runs[0] += 1
+            runs[1] += 0 if pruned else 1
+
+    def save(self):
+        os.makedirs(Setting.CachePath, exist_ok=True)
+        f = open(self.path, "w", encoding="utf-8")
+        json.dump({"stats": self.stats, "runs": self.runs}, f)
+        f.close()
+
+
+class ReadyQueue:
+    """
+    the ready cases of Scheduler
+    in the order they are ready while the Generators give new cases, so the logs are written as the cases finish,
+    then at the end of the sweep and for the retries, the longest predicted by the CostModel first (LPT),
+    so a slow case does not start last and keep one worker busy while the others wait
+    the cases of the same cost run in the order they are ready, and with --schedule fifo all of them
+    the order of the logs does not change, they are written in the order of the Generator
+    """
+    def __init__(self, costs):
+        self.costs = costs
+        self.fifo = deque()
+        self.heap = []
+        self.count = 0
+        self.longest_first = False
+
+    def sort(self):
+        # the longest first from now on
+        if Setting.schedule == "lpt" and not self.longest_first:
+            self.longest_first = True
+            while self.fifo:
+                self.append(self.fifo.popleft())
+
+    def append(self, task):
+        if not self.longest_first:
+            self.fifo.append(task)
+            return
+        heapq.heappush(self.heap, (-self.costs.predict(task.case)[0], self.count, task))
+        self.count += 1
+
+    def popleft(self):
+        if self.heap:
+            return heapq.heappop(self.heap)[2]
+        return self.fifo.popleft()
+
+    def __len__(self):
+        return len(self.fifo) + len(self.heap)
+
+    def tasks(self):
+        return list(self.fifo) + [item[2] for item in self.heap]
+
+
+class Journal:
+    """
+    the cases of a phase already logged, LOG/xxx.journal, to continue a sweep stopped by a crash with --resume
+    the first line tells the sweep: the phase, the scenarios (-s), the hash of the model files, the order and the shard,
+    with the blocks in the order they are verified,
+    then a json line for each line of the log: the indexes of the case, its verdict or secure/insecure if skipped,
+    if it is out of time, its time limit and the steps of the ladder passed, the steps run for it,
+    if it's the run of a retried case
+    and the sizes of the log files
+    the lines are written to the disk after the log, a line cut by a crash is dropped,
+    and the lines of the log files written after the last line of the journal are removed when it continues
+    """
+    def __init__(self, path, phase):
+        self.path = path
+        self.header = {"phase": phase, "scenarios": Setting.analyze_flag, "model": self.model_hash(),
+                       "order": Setting.order, "shard": Setting.shard}
+        self.entries = []   # the cases logged by the last sweep, see open()
+        self.blocks = None  # the blocks of the last sweep, in order
+        self.informative = None  # if the last sweep runs the cases in the informative order, see Generator
+        self.file = None
+        self.dirty = False  # lines not written to the disk yet
+
+    @staticmethod
+    def model_hash():
+        digest = hashlib.sha256()
+        for path in Setting.model_paths():
+            f = open(path, "rb")
+            digest.update(f.read())
+            f.close()
+        return digest.hexdigest()
+
+    def load(self):
+        # the entries of the last sweep and the size of the journal up to them, nothing if it's another sweep
+        try:
+            f = open(self.path, "rb")
+            data = f.read()
+            f.close()
+        except OSError:
+            return [], 0
+        entries = []
+        size = 0
+        header = None
+        for line in data.split(b"\n")[:-1]:  # the last line is not complete
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                break
+            if header is None:
+                header = entry
+            else:
+                entries.append(entry)
+            size += len(line) + 1
+        if header is None or dict((key, header.get(key)) for key in self.header) != self.header:
+            return [], 0
+        self.blocks = header.get("blocks")
+        self.informative = header.get("informative", Setting.order == "informative")
+        return entries, size
+
+    def open(self, resume, paths):
+        """
+        continue the journal of the last sweep if resume, the log files of paths are cut to the last case in it
+        return if it continues, or the journal is started again
+        """
+        self.entries, size = self.load() if resume else ([], 0)
+        if size > 0:
+            os.truncate(self.path, size)
+            sizes = self.entries[-1]["sizes"] if self.entries else [0] * len(paths)
+            for path, length in zip(paths, sizes):
+                if os.path.exists(path):
+                    os.truncate(path, length)
+            self.file = open(self.path, "a", encoding="utf-8")
+            return True
+        self.blocks = None
+        self.informative = None
+        self.file = open(self.path, "w", encoding="utf-8")
+        return False
+
+    def begin(self, blocks, informative):
+        # the first line of a new journal, with the blocks of the Generator and their order
+        if self.blocks is None:
+            self.blocks = blocks
+            header = dict(self.header)
+            header["blocks"] = [list(block) for block in blocks]
+            header["informative"] = informative
+            self.file.write(json.dumps(header) + "\n")
+            self.dirty = True
+
+    def write(self, case, verdict, files, info=None, retry=False):
+        # the case is logged in files, the log files of the phase
+        sizes = []
+        for f in files:
+            f.flush()
+            sizes.append(f.tell())
+        entry = {"index": list(case.index), "verdict": verdict,
+                 "timed_out": bool(info and info["timed_out"]), "budget": info["budget"] if info else None,
+                 "passed": case.passed, "steps": info["steps"] if info else [], "retry": retry, "sizes": sizes}
+        self.file.write(json.dumps(entry) + "\n")
+        self.dirty = True
+
+    def sync(self):
+        if self.dirty:
+            self.file.flush()
+            os.fsync(self.file.fileno())
+            self.dirty = False
+
+    def close(self):
+        self.sync()
+        self.file.close()
+
+
+class Task:
+    """
+    a case in the work queue of Scheduler
+    state: wait     some cases before it may make it skipped, wait for their results
+           ready    in the queue to run
+           run      running in a worker process
+           done     analyzed by ProVerif
+           secure / insecure  skipped
+    """
+    def __init__(self, case):
+        self.case = case
+        self.state = "wait"
+        self.ret = ""
+        self.result = b""
+        self.content = []
+        self.blockers = 0     # the number of unfinished cases before it which may make it skipped
+        self.dependents = []  # the cases after it waiting for its result
+        self.budget = None    # the time limit of the last run
+        self.retrying = False # run again with a longer time limit
+        self.info = None      # how it is verified, see case_info()
+        self.batch = False    # running in the batch of another case
+        self.prefetched = None  # the verdict found by the batch of another case, before this case is ready
+        self.digest = None    # the hash of the input it runs for the cases with the same input, see Scheduler.follow()
+        self.failed = False   # its run raised an error, it's run again once alone, see Scheduler.lost()
+
+    def resolved(self):
+        return self.state in ("done", "secure", "insecure")
+
+
+class PhaseRun:
+    """
+    the Generator of a phase, its log file and the window of the cases not logged yet
+    the log is written in the order of the Generator, so it's the same as running the cases one by one
+    """
+    def __init__(self, phase, log, telemetry=None, journal=None):
+        self.phase = phase
+        self.log = log
+        self.telemetry = telemetry  # the json lines of the cases, see write_telemetry()
+        self.journal = journal      # the cases logged, see Journal
+        self.gen = Generator(phase, journal.blocks if journal is not None else None,
+                             journal.informative if journal is not None else None)
+        if journal is not None:
+            journal.begin(self.gen.blocks, self.gen.informative)
+        self.count = 0
+        self.window = deque()  # the tasks in the order of the Generator
+        self.tasks = {}        # index -> the task not logged yet, also the ones run by a batch before they are pulled
+        self.blocks = {}       # block -> the unfinished tasks of this block, in order
+        self.exhausted = False
+        self.frontier = None   # the Frontier of the block being pulled
+        self.frontiers = {}    # block -> the Frontier not finished
+        self.calls = 0         # the number of cases run by the frontier search
+        self.sweep_calls = 0   # the number of cases the sweep would run
+        self.cases = 0
+        self.steps = {}        # the runs of the steps of the ladder of the cases logged, see count_steps()
+        self.total = self.gen.total()  # the cases of the phase, for the progress
+        self.done = 0          # the cases logged, a retried case is counted once
+        self.pruned = 0        # the cases logged which are skipped by the secure/insecure sets
+        self.verdicts = {}     # the verdict of ProVerif -> the cases logged with it, the last one of a retried case
+
+    def tally(self, verdict, previous=None):
+        # a case is logged with verdict, or a retried case changes from previous to verdict
+        if previous is None:
+            self.done += 1
+        elif previous in ("secure", "insecure"):
+            self.pruned -= 1
+        else:
+            self.verdicts[previous] -= 1
+        if verdict in ("secure", "insecure"):
+            self.pruned += 1
+        else:
+            self.verdicts[verdict] = self.verdicts.get(verdict, 0) + 1
+
+    def files(self):
+        # the log files, in the order of the sizes in the journal
+        return [self.log] + ([self.telemetry] if self.telemetry is not None else [])
+
+
+class Progress:
+    """
+    the live status of a sweep, updated by the Scheduler
+    for each phase: the cases of its Generator, the cases logged, skipped by the secure/insecure sets and remaining,
+    and the verdicts, then the runs of ProVerif in flight, the cases out of time waiting for a retry,
+    the cases logged per second over the last window and the time left at this rate
+    --progress prints it on stderr, rewritten in place on a terminal or every minute in a file,
+    --metrics serves it in the text format of Prometheus, see MetricsServer
+    """
+    window = 600     # seconds, the cases per second are measured over this window
+    interval = 1     # seconds between two updates
+    file_interval = 60  # seconds between two prints when stderr is not a terminal
+
+    def __init__(self, scheduler):
+        self.scheduler = scheduler
+        self.start = time.time()
+        self.samples = deque()  # (time, cases logged) in the window
+        self.updated = 0.0
+        self.printed = 0.0
+        self.lines = 0          # the lines printed last time on a terminal
+        self.terminal = sys.stderr.isatty()
+
+    @staticmethod
+    def enabled():
+        return Setting.progress or Setting.metrics is not None
+
+    def update(self, final=False):
+        now = time.time()
+        if not self.enabled() or not final and now - self.updated < self.interval:
+            return
+        self.updated = now
+        status = self.status(now)
+        if Setting.metrics is not None:
+            MetricsServer.get().publish(self.metrics(status))
+        if Setting.progress and (final or self.terminal or now - self.printed >= self.file_interval):
+            self.printed = now
+            self.show(status, final)
+
+    def status(self, now):
+        scheduler = self.scheduler
+        done = sum(run.done for run in scheduler.runs)
+        self.samples.append((now, done))
+        while now - self.samples[0][0] > self.window:
+            self.samples.popleft()
+        seconds = now - self.samples[0][0]
+        rate = (done - self.samples[0][1]) / seconds if seconds > 0 else 0.0
+        remaining = sum(run.total - run.done for run in scheduler.runs)
+        return {"phases": [(run.phase, run.total, run.done, run.pruned, dict(run.verdicts)) for run in scheduler.runs],
+                "done": done, "total": sum(run.total for run in scheduler.runs), "remaining": remaining,
+                "running": sum(len(tasks) for tasks in scheduler.futures.values()), "runs": len(scheduler.futures),
+                "retries": len(scheduler.retries) + sum(1 for task in scheduler.ready.tasks() if task.retrying),
+                "verified": scheduler.verified, "cached": scheduler.cached, "rate": rate,
+                "eta": remaining / rate if rate > 0 else (0.0 if remaining == 0 else None),
+                "elapsed": now - self.start}
+
+    def show(self, status, final):
+        lines = []
+        for phase, total, done, pruned, verdicts in status["phases"]:
+            lines.append(phase.ljust(16) + (str(done) + "/" + str(total)).rjust(15) + " done" +
+                         str(pruned).rjust(8) + " skipped" + str(total - done).rjust(8) + " left  " +
+                         "  ".join(verdict + " " + str(n) for verdict, n in sorted(verdicts.items()) if n))
+        msg = "total".ljust(16) + (str(status["done"]) + "/" + str(status["total"])).rjust(15) + " done (" + \
+            str(round(100.0 * status["done"] / max(status["total"], 1), 1)) + "%), " + str(status["running"]) + \
+            " running, " + str(status["retries"]) + " to retry, " + str(round(status["rate"], 2)) + " cases/s, " + \
+            format_seconds(status["elapsed"]) + " elapsed"
+        if status["eta"] is not None and status["remaining"] > 0:
+            msg += ", ETA " + format_seconds(status["eta"]) + " at " + \
+                time.strftime("%Y-%m-%d %H:%M", time.localtime(time.time() + status["eta"]))
+        lines.append(msg)
+        if self.terminal:  # over the lines printed last time
+            sys.stderr.write("\033[F" * self.lines + "".join("\033[K" + line + "\n" for line in lines))
+            self.lines = 0 if final else len(lines)
+        else:
+            sys.stderr.write("".join(line + "\n" for line in lines))
+        sys.stderr.flush()
+
+    @staticmethod
+    def metrics(status):
+        # the text format of Prometheus
+        out = []
+
+        def metric(name, kind, description, samples):
+            out.append("# HELP fido2verif_" + name + " " + description)
+            out.append("# TYPE fido2verif_" + name + " " + kind)
+            for labels, value in samples:
+                label = ",".join(key + '="' + text + '"' for key, text in labels)
+                out.append("fido2verif_" + name + ("{" + label + "}" if label else "") + " " + repr(float(value)))
+
+        phases = status["phases"]
+        metric("cases", "gauge", "The cases of the phase.", [([("phase", p[0])], p[1]) for p in phases])
+        metric("cases_done", "gauge", "The cases logged.", [([("phase", p[0])], p[2]) for p in phases])
+        metric("cases_pruned", "gauge", "The cases skipped by the secure/insecure sets.",
+               [([("phase", p[0])], p[3]) for p in phases])
+        metric("cases_remaining", "gauge", "The cases not logged yet.", [([("phase", p[0])], p[1] - p[2]) for p in phases])
+        metric("verdicts", "gauge", "The cases logged with each verdict of ProVerif.",
+               [([("phase", p[0]), ("verdict", verdict)], n) for p in phases for verdict, n in sorted(p[4].items())])
+        metric("cases_running", "gauge", "The cases run by ProVerif now.", [([], status["running"])])
+        metric("proverif_running", "gauge", "The runs of ProVerif now.", [([], status["runs"])])
+        metric("cases_to_retry", "gauge", "The cases out of time waiting for a longer time limit.",
+               [([], status["retries"])])
+        metric("proverif_runs_total", "counter", "The cases verified by ProVerif.", [([], status["verified"])])
+        metric("cache_hits_total", "counter", "The cases served from the cache.", [([], status["cached"])])
+        metric("cases_per_second", "gauge", "The cases logged per second over the last minutes.", [([], status["rate"])])
+        if status["eta"] is not None:
+            metric("eta_seconds", "gauge", "The time left at this rate.", [([], status["eta"])])
+        metric("elapsed_seconds", "gauge", "The time since the sweep started.", [([], status["elapsed"])])
+        return "\n".join(out) + "\n"
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] not in ("/", "/metrics"):
+            self.send_error(404)
+            return
+        body = self.server.text.encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):  # the requests are not printed
+        pass
+
+
+class MetricsServer:
+    """
+    the progress of the sweep in the text format of Prometheus at http://host:port/metrics, see --metrics
+    served by a thread with the text of the last update of Progress, it stays open with --watch
+    """
+    current = None  # the server of this process
+
+    def __init__(self, address):
+        self.server = ThreadingHTTPServer(address, MetricsHandler)
+        self.server.daemon_threads = True
+        self.server.text = ""
+        Thread(target=self.server.serve_forever, daemon=True).start()
+        print("the progress is served on http://" + address[0] + ":" + str(self.server.server_address[1]) + "/metrics.")
+
+    @staticmethod
+    def get():
+        if MetricsServer.current is None:
+            MetricsServer.current = MetricsServer(Setting.metrics)
+        return MetricsServer.current
+
+    def publish(self, text):
+        self.server.text = text  # replaced at once, a request reads the old or the new text
+
+
+class Scheduler:
+    """
+    one work queue holding the cases of all the phases, run by a pool of worker processes
+    1.  pull cases from the Generators of all phases in turn
+    2.  a case is ready when all the cases before it which may make it skipped are finished,
+        then check the secure/insecure sets, skip it or put it into the queue
+    3.  when a case finishes, update the sets and check the cases waiting for it
+    4.  write the log in the order of the Generator
+    with the frontier search, the cases of a block are pulled all together, then the Frontier
+    picks the cases to run and the others are decided by the secure/insecure sets
+    with --batch, a case runs together with the unfinished cases of the same scenario and kind of query,
+    the verdicts of the cases not ready yet are kept until they are ready, or dropped if they are skipped
+    a case whose run raises an error is run again once, alone, then it gets the verdict error, see lost()
+    """
+    window_size = 4096  # the maximum number of cases not logged yet in a phase
+
+    def __init__(self, phases, jobs):
+        self.runs = [PhaseRun(phase, log, telemetry, journal) for phase, log, telemetry, journal in phases]
+        self.phase_runs = dict((run.phase, run) for run in self.runs)
+        self.jobs = jobs
+        self.costs = CostModel()
+        self.ready = ReadyQueue(self.costs)
+        self.futures = {}
+        self.pool = None
+        self.policy = TimeoutPolicy()
+        self.retries = []  # the tasks out of time, run again at the end
+        self.suspects = []  # the tasks whose run raised an error, run again alone, see lost()
+        self.frontier_log = None
+        if Setting.search == "frontier":
+            self.frontier_log = open(Setting.FrontierLogPath, mode='a' if Setting.resume else 'w+', encoding='utf-8')
+        self.verified = 0  # the number of cases verified by ProVerif
+        self.cached = 0    # the number of cases served from the cache
+        self.skipped = 0   # the number of cases decided by the secure/insecure sets
+        self.retried = 0   # the number of lines of the retried cases in the logs
+        self.seconds = 0.0  # the wall time of ProVerif, the time of a batch counted once
+        self.shared = 0     # the number of cases given the verdict of another case with the same input
+        self.inputs = {}    # Case.input_hash() -> [the task running it, the tasks waiting for it] or its returns
+        self.progress = Progress(self)
+        for run in self.runs:
+            if run.journal is not None:
+                self.restore(run, run.journal.entries)
+
+    def restore(self, run, entries):
+        """
+        continue after the cases in the journal of the last sweep
+        their verdicts are put into the secure/insecure sets, and the cases still out of time are retried at the end
+        the cases finished but not logged when it stopped are run again, their verdicts are in the cache
+        """
+        pending = {}  # index -> the task out of time and not finished by a retry
+        first = 0     # the number of cases of the first pass
+        verdicts = {}  # index -> the last verdict of the case
+        for entry in entries:
+            index = tuple(entry["index"])
+            case = run.gen.case_at(index)
+            verdict = entry["verdict"]
+            run.tally(verdict, verdicts.get(index) if entry["retry"] else None)
+            count_steps(run.steps, entry.get("steps", []))
+            verdicts[index] = verdict
+            if verdict == 'true' and not entry["timed_out"]:
+                run.gen.this_case_is_secure(case)
+            elif verdict == 'false' and not entry["timed_out"]:
+                run.gen.this_case_is_insecure(case)
+            elif verdict in ("secure", "insecure"):
+                self.skipped += 1
+            if entry["retry"]:
+                self.retried += 1
+            else:
+                first += 1
+            if entry["timed_out"]:
+                task = Task(case)
+                task.state = "done"
+                task.ret = verdict
+                task.budget = entry["budget"]
+                case.passed = entry.get("passed", [])
+                pending[index] = task
+            else:
+                pending.pop(index, None)
+        run.count = len(entries)
+        if entries:
+            run.gen.skip(first)
+            print(run.phase + ": " + str(run.count) + " cases in the journal, continue after " + str(first) + " cases.")
+        self.retries.extend(pending.values())
+
+    def run(self):
+        if Setting.listen is not None:  # the workers of other machines, the pool stays open with --watch
+            self.pool = RemotePool.get()
+            self.loop()
+        else:
+            self.pool = self.new_pool()
+            try:
+                self.loop()
+            finally:
+                self.pool.shutdown()
+        self.progress.update(final=True)
+        self.policy.save()
+        self.costs.save()
+        for run in self.runs:  # after the last case in the journal, a sweep continued by --resume writes it again
+            write_log(ladder_message(run.phase, run.steps), run.log)
+        if self.frontier_log is not None:
+            self.frontier_log.close()
+            for run in self.runs:
+                print(run.phase + ": " + str(run.calls) + " cases run by the frontier search, " + str(run.sweep_calls) +
+                      " by the sweep, " + str(run.cases) + " cases in total.")
+
+    def new_pool(self):
+        return ProcessPoolExecutor(max_workers=self.jobs, initializer=init_worker, initargs=(Setting.snapshot(),))
+
+    def submit(self, function, *args):
+        # a worker process killed (out of memory, ...) breaks the whole pool, a new one runs the next cases
+        try:
+            return self.pool.submit(function, *args)
+        except BrokenProcessPool:
+            self.pool.shutdown(wait=False)
+            self.pool = self.new_pool()
+            return self.pool.submit(function, *args)
+
+    def loop(self):
+        while True:
+            if Setting.listen is not None:  # as many cases as the workers connected can run, at least -j
+                self.jobs = max(Setting.jobs, self.pool.slots())
+            self.fill()
+            self.dispatch()
+            if not self.futures:
+                break
+            self.collect()
+            self.progress.update()
+        self.retry()
+
+    def dispatch(self):
+        if self.suspects:  # alone, so a worker process dying again does not fail the other cases
+            if not self.futures:
+                task = self.suspects.pop(0)
+                self.futures[self.submit(run_case, task.case, task.budget)] = [task]
+            return
+        while self.ready and len(self.futures) < self.jobs:
+            task = self.ready.popleft()
+            if task.state != "ready" and not task.retrying:  # taken by the batch of another case
+                continue
+            if task.retrying and self.skip_retry(task):
+                continue
+            if self.follow(task):
+                continue
+            task.state = "run"
+            if task.budget is None:
+                task.budget = self.policy.first_budget(task.case)
+            if Setting.batch and not task.retrying:
+                tasks = [task]
+                for sibling in self.siblings(task):  # the ones with the input of another case are left to follow it
+                    digest = sibling.case.input_hash()
+                    if digest not in self.inputs:
+                        sibling.digest = digest
+                        self.inputs[digest] = [sibling]
+                        tasks.append(sibling)
+                budget = max(self.policy.first_budget(sibling.case) for sibling in tasks)
+                for sibling in tasks:
+                    sibling.batch = True
+                    sibling.budget = budget
+                    if sibling.state == "ready":
+                        sibling.state = "run"
+                self.futures[self.submit(run_batch, [sibling.case for sibling in tasks], budget)] = tasks
+            else:
+                self.futures[self.submit(run_case, task.case, task.budget)] = [task]
+
+    def siblings(self, task):
+        # the cases of the same scenario and kind of query, not finished and not known to be skipped,
+        # the ones which a case before them may still decide are left to the sweep, a batch would run them for nothing
+        run = self.phase_runs[task.case.phase]
+        t, c, q, f, e = task.case.index
+        siblings = []
+        for other in range(run.gen.q_nums):
+            if other == q or run.gen.queries.get(other).kind != task.case.query.kind:
+                continue
+            index = (t, c, other, f, e)
+            sibling = run.tasks.get(index)
+            if sibling is None:  # not pulled yet, or logged, or not in the shard
+                if not run.gen.pending(index) or run.gen.undecided_before(index):
+                    continue
+                sibling = Task(run.gen.case_at(index))
+                if any(run.gen.may_decide(earlier.case, sibling.case)
+                       for earlier in run.blocks.get(run.gen.block(sibling.case), ())):
+                    continue
+                run.tasks[index] = sibling
+            if sibling.state not in ("wait", "ready") or sibling.blockers or sibling.batch or \
+                    sibling.prefetched is not None:
+                continue
+            if run.gen.jump_if_its_secure(sibling.case) or run.gen.jump_if_its_insecure(sibling.case):
+                continue
+            siblings.append(sibling)
+        return siblings
+
+    def collect(self):
+        # the progress is updated while the cases run
+        done, _ = wait(self.futures, timeout=Progress.interval if Progress.enabled() else None,
+                       return_when=FIRST_COMPLETED)
+        for future in done:
+            tasks = self.futures.pop(future)
+            try:
+                returns = future.result()
+            except Exception as error:  # a worker process died, a remote worker is lost, ...
+                self.lost(tasks, error)
+                continue
+            if not Setting.batch or tasks[0].retrying or tasks[0].failed:
+                returns = [returns]
+            for task, (ret, result, content, info) in zip(tasks, returns):
+                task.batch = False
+                if info["cached"]:
+                    self.cached += 1
+                else:
+                    self.verified += 1
+                    self.seconds += sum(info["walls"])
+                self.policy.record(task.case, info)
+                self.costs.record(task.case, info)
+                if task.state == "run":
+                    self.complete(task, ret, result, content, info)
+                elif task.state == "wait":  # not ready yet, used when it is ready
+                    task.prefetched = (ret, result, content, info)
+                self.share(task, ret, result, info)
+
+    def lost(self, tasks, error):
+        """
+        the run of the tasks raised an error instead of returning their verdicts,
+        each task is run again once, alone, if it fails again it gets the verdict error, and the sweep goes on
+        the cases of a batch which are not ready yet are run when they are ready
+        """
+        for task in tasks:
+            task.batch = False
+            if task.state == "wait":
+                continue
+            if not task.failed:
+                task.failed = True
+                self.suspects.append(task)
+                continue
+            message = "the run of ProVerif failed: " + type(error).__name__ + ": " + str(error)
+            print(task.case.phase + ": " + case_name(task.case) + ", " + message)
+            step = task.case.template.steps()[-1]
+            info = {"cached": False, "timed_out": False, "budget": task.budget, "replicated": step == "full",
+                    "step": step, "steps": []}
+            info.update(new_usage())
+            info["batch"] = 0
+            digest = task.digest
+            self.complete(task, 'error', message, [], info)
+            self.share(task, 'error', message, info)
+            self.inputs.pop(digest, None)  # not kept for the cases with the same input, they run it again
+
+    def follow(self, task):
+        """
+        a case with the same canonical input as a case running or verified in this sweep is not run again,
+        it gets the verdict of that case, see Case.canonical()
+        return if the task follows another case, or it is registered to run its input
+        """
+        if task.digest is not None:  # it runs its input again, see lost()
+            return False
+        digest = task.case.input_hash()
+        entry = self.inputs.get(digest)
+        if entry is None:
+            task.digest = digest
+            self.inputs[digest] = [task]
+            return False
+        task.state = "run"
+        if isinstance(entry, list):
+            entry.append(task)
+        else:
+            self.give(task, *entry)
+        return True
+
+    def share(self, task, ret, result, info):
+        # the run of the input of task is finished, give its verdict to the tasks waiting for it
+        if task.digest is None:
+            return
+        entry = self.inputs.pop(task.digest)
+        if not info["timed_out"]:  # a run out of time is not kept, the followers are retried as it
+            self.inputs[task.digest] = (ret, result, info)
+        task.digest = None
+        for follower in entry[1:]:
+            self.give(follower, ret, result, info)
+
+    def give(self, task, ret, result, info):
+        # the verdict of another case with the same input, counted as served from the cache
+        self.shared += 1
+        shared = dict(info, cached=True, shared=True, wall=0.0, user=0.0, sys=0.0, maxrss=0,
+                      steps=[[step, verdict, True] for step, verdict, cached in info["steps"]])
+        self.complete(task, ret, result, task.case.render(info["step"]), shared)
+
+    def complete(self, task, ret, result, content, info):
+        task.info = info
+        if info["timed_out"]:  # the retry starts at the step out of time
+            task.case.passed = task.case.passed + info["steps"][:-1]
+            self.retries.append(task)
+        if task.retrying:
+            self.finish_retry(task, ret, result, content, info)
+        else:
+            self.finish(task, ret, result, content, not info["timed_out"])
+
+    def retry(self):
+        # run the cases out of time again with the next time limit, until they finish or no limit is left
+        self.ready.sort()
+        while self.retries:
+            for task in self.retries:
+                task.budget = self.policy.next_budget(task.budget)
+                if task.budget is not None:
+                    task.retrying = True
+                    self.ready.append(task)
+            self.retries = []
+            while self.ready or self.futures or self.suspects:
+                self.dispatch()
+                if self.futures:
+                    self.collect()
+                self.progress.update()
+
+    def skip_retry(self, task):
+        # the retried cases finished before may decide this case
+        run = self.phase_runs[task.case.phase]
+        if run.gen.jump_if_its_secure(task.case):
+            state = "secure"
+        elif run.gen.jump_if_its_insecure(task.case):
+            state = "insecure"
+        else:
+            return False
+        msg = case_message(run.count, run.phase, state, task.case) + case_name(task.case)
+        write_result(run.count, task.case, state, msg)
+        write_telemetry(run.telemetry, run.count, task.case, state)
+        run.tally(state, task.ret)
+        task.ret = state
+        self.retried += 1
+        self.skipped += 1
+        run.count = run.count + 1
+        write_log(msg, run.log)
+        run.log.flush()
+        if run.journal is not None:
+            run.journal.write(task.case, state, run.files(), retry=True)
+            run.journal.sync()
+        ResultStore.commit()
+        return True
+
+    def finish_retry(self, task, ret, result, content, info):
+        # the log of a retried case is written when it finishes, with the time limit
+        run = self.phase_runs[task.case.phase]
+        if not info["timed_out"]:
+            if ret == 'true':
+                run.gen.this_case_is_secure(task.case)
+            elif ret == 'false':
+                run.gen.this_case_is_insecure(task.case)
+        msg = case_message(run.count, run.phase, ret, task.case) + " budget " + str(task.budget) + "s"
+        self.retried += 1
+        write_result(run.count, task.case, ret, msg, info, result)
+        write_telemetry(run.telemetry, run.count, task.case, ret, info)
+        run.tally(ret, task.ret)
+        count_steps(run.steps, info["steps"])
+        task.ret = ret
+        run.count = run.count + 1
+        write_log(msg, run.log)
+        run.log.flush()
+        if run.journal is not None:
+            run.journal.write(task.case, ret, run.files(), info, retry=True)
+            run.journal.sync()
+        ResultStore.commit()
+
+    def fill(self):
+        # pull cases until there are enough ready cases for the pool
+        pulling = True
+        while pulling and len(self.ready) < 2 * self.jobs:
+            pulling = False
+            for run in self.runs:
+                if run.exhausted or len(run.window) >= self.window_size and run.frontier is None:
+                    continue
+                r, case = run.gen.generator_case()
+                if r is False:
+                    run.exhausted = True
+                    if run.frontier is not None:
+                        self.close_frontier(run)
+                    continue
+                task = run.tasks.get(case.index)
+                if task is None:
+                    task = Task(case)
+                    run.tasks[case.index] = task
+                run.window.append(task)
+                pulling = True
+                if Setting.search == "frontier":
+                    self.add_to_frontier(run, task)
+                    continue
+                unfinished = run.blocks.setdefault(run.gen.block(case), {})
+                for earlier in unfinished:
+                    if run.gen.may_decide(earlier.case, case):
+                        task.blockers += 1
+                        earlier.dependents.append(task)
+                unfinished[task] = None
+                if task.blockers == 0:
+                    self.settle(run, task)
+        for run in self.runs:
+            self.emit(run)
+        if all(run.exhausted for run in self.runs):  # the end of the sweep
+            self.ready.sort()
+
+    def add_to_frontier(self, run, task):
+        block = run.gen.block(task.case)
+        if run.frontier is not None and run.frontier.block != block:
+            self.close_frontier(run)
+        if run.frontier is None:
+            run.frontier = Frontier(block, run.gen.mask_bits)
+            run.frontiers[block] = run.frontier
+        run.frontier.add(task)
+
+    def close_frontier(self, run):
+        # all the cases of the block are pulled, start the search
+        run.frontier.complete = True
+        self.pick(run, run.frontier)
+        run.frontier = None
+
+    def pick(self, run, frontier):
+        # skip the decided cases and queue the most informative ones
+        for task, state in frontier.decided(run.gen.lattice(frontier.tasks[0].case)):
+            self.resolve(run, task, state)
+        while len(frontier.running) < Frontier.width:
+            task = frontier.next_task(run.gen.lattice(frontier.tasks[0].case))
+            if task is None:
+                break
+            task.state = "ready"
+            self.ready.append(task)
+        if frontier.finished():
+            self.report(run, frontier)
+            del run.frontiers[frontier.block]
+
+    def report(self, run, frontier):
+        # the calls of the search and the boundary found for a block
+        case = frontier.tasks[0].case
+        sweep_calls = frontier.sweep_calls()
+        run.calls += frontier.calls
+        run.sweep_calls += sweep_calls
+        run.cases += len(frontier.tasks)
+        lattice = run.gen.lattice(case)
+        msg = run.phase + " type " + case.type.name + " ctap " + case.ctap.name + " query " + case.query.name
+        msg += "  calls " + str(frontier.calls) + "  sweep " + str(sweep_calls) + "  cases " + str(len(frontier.tasks))
+        msg += "  secure: " + "; ".join(run.gen.describe(mask) for mask in sorted(lattice.secure))
+        msg += "  insecure: " + "; ".join(run.gen.describe(mask) for mask in sorted(lattice.insecure))
+        write_log(msg, self.frontier_log)
+        self.frontier_log.flush()
+
+    def settle(self, run, task):
+        # all the cases which may make this task skipped are finished, skip it or run it
+        if run.gen.jump_if_its_secure(task.case):
+            self.resolve(run, task, "secure")
+        elif run.gen.jump_if_its_insecure(task.case):
+            self.resolve(run, task, "insecure")
+        elif task.prefetched is not None:
+            ret, result, content, info = task.prefetched
+            task.prefetched = None
+            task.state = "run"
+            self.complete(task, ret, result, content, info)
+        elif task.batch:
+            task.state = "run"  # finished when its batch returns
+        else:
+            task.state = "ready"
+            self.ready.append(task)
+
+    def resolve(self, run, task, state):
+        # the task is finished or skipped, settle the tasks waiting only for it
+        task.state = state
+        unfinished = run.blocks.get(run.gen.block(task.case))
+        if unfinished is not None:
+            del unfinished[task]
+        for waiting in task.dependents:
+            waiting.blockers -= 1
+            if waiting.blockers == 0:
+                self.settle(run, waiting)
+        task.dependents = []
+
+    def finish(self, task, ret, result, content, trusted=True):
+        # the verdict of a run killed for the time limit is not used to skip other cases
+        run = self.phase_runs[task.case.phase]
+        task.ret, task.result, task.content = ret, result, content
+        if trusted and ret == 'true':
+            run.gen.this_case_is_secure(task.case)
+        elif trusted and ret == 'false':
+            run.gen.this_case_is_insecure(task.case)
+        self.resolve(run, task, "done")
+        frontier = run.frontiers.get(run.gen.block(task.case))
+        if frontier is not None:
+            frontier.running.discard(task.case.mask)
+            self.pick(run, frontier)
+        self.emit(run)
+
+    def emit(self, run):
+        # log the finished cases at the head of the window
+        while run.window and run.window[0].resolved():
+            task = run.window.popleft()
+            del run.tasks[task.case.index]
+            case = task.case
+            if task.state == "done":
+                msg = case_message(run.count, run.phase, task.ret, case)
+                write_result(run.count, case, task.ret, msg, task.info, task.result)
+                write_telemetry(run.telemetry, run.count, case, task.ret, task.info)
+                run.tally(task.ret)
+                count_steps(run.steps, task.info["steps"])
+            else:
+                msg = case_message(run.count, run.phase, task.state, case)
+                write_result(run.count, case, task.state, msg)
+                write_telemetry(run.telemetry, run.count, case, task.state)
+                run.tally(task.state)
+                self.skipped += 1
+            self.costs.count(case, task.state != "done")
+            run.count = run.count + 1
+            write_log(msg, run.log)
+            run.log.flush()
+            if run.journal is not None:
+                run.journal.write(case, task.ret if task.state == "done" else task.state, run.files(), task.info)
+        if run.journal is not None:
+            run.journal.sync()
+        ResultStore.commit()
 
 
 def write_log(msg, log):
     print(msg, file = log)
 
 
+def count_steps(stats, steps):
+    """
+    add the steps of the ladder run for a case, see Case.steps, to stats:
+    step -> [runs, cases decided by the step, runs out of time, runs served from the cache]
+    a case is decided by its last step, unless it is out of time
+    """
+    for i, (step, verdict, cached) in enumerate(steps):
+        stat = stats.setdefault(step, [0, 0, 0, 0])
+        stat[0] += 1
+        stat[1] += 1 if i == len(steps) - 1 and verdict != 'tout' else 0
+        stat[2] += 1 if verdict == 'tout' else 0
+        stat[3] += 1 if cached else 0
+
+
+def step_order(stats):
+    # the steps of stats in the order of the ladder, the steps of another ladder after them
+    return [step for step in Setting.ladder if step in stats] + [step for step in stats if step not in Setting.ladder]
+
+
+def ladder_message(phase, stats):
+    # the line of the steps of the ladder at the end of the log of a phase
+    msg = phase + " ladder"
+    for step in step_order(stats):
+        runs, decided, timeouts, cached = stats[step]
+        msg += "  " + step + ": " + str(runs) + " runs, " + str(decided) + " decided, " + str(timeouts) + \
+            " out of time, " + str(cached) + " from the cache"
+    return msg
+
+
 def print_help():
-    print("usage: [-help] [-h] [-target <target_name>] [-t <target_name>]")
+    print("usage: [-help] [-h] [-target <target_name>] [-t <target_name>] [-jobs <n>] [-j <n>]")
+    print("       [--no-cache] [--cache-size <MB>] [--watch] [--deps] [--frontier] [--timeouts <s,s,...>]")
+    print("       [--ladder <step,step,...>] [--render] [--batch] [--no-trace] [--backend <backend>] [--resume]")
+    print("       [--listen <host:port>] [--order <order>] [--shard <i/n>] [--schedule <schedule>] [--plan]")
+    print("       [--keep <n>] [--progress] [--metrics <host:port>]")
+    print("       python FIDO2Verif.py profile [--top <n>] [--run <run>]")
+    print("       python FIDO2Verif.py worker <host:port> [-j <n>] [--dir <path>]")
+    print("       python FIDO2Verif.py export [-t <target_name>] [--dir <path>] [--run <run>]")
+    print("       python FIDO2Verif.py assumptions [-t <target_name>] [--query <q>] [--ctap <c>] [--type <t>] [--run <run>]")
+    print("       python FIDO2Verif.py clean [--keep <n>]")
     print("Options and arguments:")
     print("-h/-help  : show help informations.")
     print("-s/-simple :  analyze cases where no fields are leaked, this argument will reduce the analyzing time but give incomplete results. If don't specify, then analyze all cases by default.")
-    print("-t/-target  : verify a specific phase, if don't specify, then verify all phases. ")
+    print("-j/--jobs  : the number of ProVerif processes running at the same time, all the cores by default.")
+    print("--no-cache : run ProVerif for every case, do not use the verdicts kept in Cache/ by the last runs.")
+    print("--cache-size <MB> : the maximum size of Cache/, the least recently used verdicts are removed, 512 by default.")
+    print("--watch    : after the analysis, watch the model files and verify again when they are saved,")
+    print("             only the cases using the changed declarations are verified by ProVerif again.")
+    print("--deps     : write the declarations of the lib file used by each case to LOG/deps.log.")
+    print("--frontier : search the boundary between the secure and insecure cases, run the most informative cases first,")
+    print("             the calls and the boundary of each query are written to LOG/frontier.log.")
+    print("--timeouts <s,s,...> : the time limits of ProVerif in seconds, 30,300,3600 by default.")
+    print("             the first pass uses at most the first one, learned from the run times of each phase and query,")
+    print("             the cases out of time are run again with the next ones at the end.")
+    print("--ladder <step,step,...> : the variants of the model a case is run with, from the cheapest, none,full by default.")
+    print("             none removes all the \"!\", full keeps them, and a list of processes joined by + keeps theirs,")
+    print("             e.g. none,system,full. A case stops at the first step finding an attack, the last one must be full.")
+    print("--batch    : verify the secrecy queries of a case together in one run of ProVerif, and the correspondence")
+    print("             queries together, the log and the results are still written for each query.")
+    print("--no-trace : do not print the attack traces, the verdicts are the same and long traces are not written to Output/.")
+    print("--backend proverif|replay:<dir>|simulate:<rules.json> : the verifier of the cases, proverif by default.")
+    print("             replay: the outputs of ProVerif recorded in <dir> are used again, the others are run and recorded.")
+    print("             simulate: the verdicts and times are given by the rules in <rules.json>, ProVerif is not run,")
+    print("             the numbers of cases run and skipped and the time of ProVerif are printed at the end.")
+    print("--keep <n> : each run writes LOG/, Result/, Output/ and TEMP/ in Runs/<date-time>/, Runs/latest is the last one,")
+    print("             the <n> last runs are kept (5 by default, 0 to keep all), the older ones are removed in the background.")
+    print("--resume   : continue the last sweep stopped before the end, from the cases in LOG/xxx.journal,")
+    print("             use the same options, the phases whose model files or -s are changed are verified again.")
+    print("--order sweep|cheapest|informative : the order of the cases, sweep by default: for each type, ctap and query,")
+    print("             from the full set of compromised fields and entities down to the empty set.")
+    print("             cheapest: the queries learned to be the fastest first. informative: in each type, ctap and query,")
+    print("             the cases in the middle first, which decide the most other cases, only if it runs fewer cases")
+    print("             than the default order with the verdicts of the last run.")
+    print("--shard <i/n> : only verify the i-th of n parts of the types, ctaps and queries of each phase, to split a sweep")
+    print("             between machines or CI jobs, each part has its own LOG/ and Result/.")
+    print("--schedule lpt|fifo : the order the ready cases are run at the end of the sweep and for the retries, lpt by default:")
+    print("             the longest predicted from the last runs first (Cache/costs.json), fifo: as they are ready.")
+    print("--plan     : print the number of cases, the cases ProVerif is expected to run, the CPU time and the time with")
+    print("             -j jobs predicted for the sweep of -t and -s, nothing is run.")
+    print("--listen <host:port> : run the cases on the workers connecting to this address instead of the local processes,")
+    print("             -j is the number of cases handed out before the workers are connected.")
+    print("worker     : run the cases of FIDO2Verif.py --listen <host:port>, <n> at the same time (all the cores by default),")
+    print("             the model files are received from it and written in <path> (~/.FIDO2Verif-worker by default).")
+    print("export     : write the analysis files of the cases which are not false from Result/results.db,")
+    print("             as Result/<phase>/<ctap>/<type>/<query>/<log message>, or under <path>.")
+    print("assumptions: the minimal assumptions of each type, ctap and query from Result/results.db: the most fields and")
+    print("             entities compromised with which the query is true, and the least with which it is false.")
+    print("--render   : write the .pv files of all the cases to TEMP/<phase>/ without running ProVerif.")
+    print("profile    : summarize the time and memory of the cases of the last run, kept in LOG/xxx.jsonl,")
+    print("             the <n> hottest cases (20 by default), the time of each dimension and the skipped cases.")
+    print("--run <run>: read the run Runs/<run>/ instead of the last one, for profile, export and assumptions.")
+    print("--progress : print the cases done, skipped and left of each phase, the cases running and to retry, the cases")
+    print("             per second and the time left on stderr, in place on a terminal, every minute in a file.")
+    print("--metrics <host:port> : serve the same progress in the text format of Prometheus on http://host:port/metrics.")
+    print("clean      : remove the runs in Runs/ but the <n> last ones (1 by default), and the ones still running.")
+    print("-t/-target  : verify a specific phase, -t can be given several times. If don't specify, then verify all phases but")
+    print("              reg_unlink, auth_unlink and auth_a3_a4.")
     print("    The candidates arguments are:")
     print("       reg_client      : to analyze registration process with client-side storage authenticators.")
     print("       reg_server      : to analyze registration process with server-side storage authenticators.")
@@ -865,28 +3752,413 @@ def print_help():
     print("       auth_server_em  : to analyze authentication process with server-side storage authenticators.")
     print("       auth_server_sim : to analyze simple transaction authorization process with server-side storage authenticators.")
     print("       auth_server_gen : to analyze generic transaction authorization process with server-side storage authenticators.")
+    print("       reg_unlink      : to verify the unlinkability of Reg_unlink.pv for each ctap_type and au_type.")
+    print("       auth_unlink     : to verify the unlinkability of Auth_unlink.pv for each ctap_type, au_type and tr_type.")
+    print("       auth_a3_a4      : to verify A3 and A4 in Auth_A3_A4.pv for each ctap_type, au_type and tr_type.")
 
-if __name__ == "__main__":
+def sweep(phase_list):
+    # verify the cases of the phases in phase_list, only their log files are written in the directory of the run
+    # with --resume, the phases with a journal of the same sweep continue, see Journal
+    logs = {}
+    telemetries = {}  # LOG/xxx.jsonl, the time and memory of each case
+    journals = {}     # LOG/xxx.journal, the cases logged
+    for phase, path in phase_logs():
+        if phase not in phase_list:
+            continue
+        mode = 'a'
+        journals[phase] = Journal(journal_path(path), phase)
+        if journals[phase].open(Setting.resume, [path, telemetry_path(path)]):
+            ResultStore.get().truncate(phase, len(journals[phase].entries))
+        else:
+            mode = 'w+'
+            ResultStore.get().start(phase)
+        logs[phase] = open(path, mode=mode, encoding='utf-8')
+        telemetries[phase] = open(telemetry_path(path), mode=mode, encoding='utf-8')
+    scheduler = Scheduler([(phase, logs[phase], telemetries[phase], journals[phase]) for phase in phase_list],
+                          Setting.jobs)
+    try:
+        scheduler.run()
+    finally:
+        Setting.remove_workspace()
+        for journal in journals.values():
+            journal.close()
+        ResultStore.close()
+    for log in list(logs.values()) + list(telemetries.values()):
+        log.close()
+    if Setting.use_cache:
+        VerdictCache.evict()
+    print(str(scheduler.verified) + " cases verified by ProVerif, " + str(scheduler.cached) + " cases served from the cache, " +
+          str(scheduler.shared) + " runs saved by the cases with the same input as another case.")
+    if Setting.backend == "simulate":
+        total = sum(run.count for run in scheduler.runs) - scheduler.retried
+        print("simulated: " + str(total) + " cases, " + str(total - scheduler.skipped) + " decided by ProVerif and " +
+              str(scheduler.skipped) + " by the secure/insecure sets, " + "%.0f" % scheduler.seconds + "s of ProVerif with the retries, about " +
+              "%.0f" % (scheduler.seconds / Setting.jobs) + "s with " + str(Setting.jobs) + " jobs.")
+
+
+def phase_logs():
+    # the phases and their log files, in the directory of the run
+    return [("reg_client", Setting.LogPath1),
+            ("reg_server", Setting.LogPath2),
+            ("auth_client_em", Setting.LogPath3),
+            ("auth_client_sim", Setting.LogPath4),
+            ("auth_client_gen", Setting.LogPath5),
+            ("auth_server_em", Setting.LogPath6),
+            ("auth_server_sim", Setting.LogPath7),
+            ("auth_server_gen", Setting.LogPath8),
+            ("reg_unlink", Setting.LogPath9),
+            ("auth_unlink", Setting.LogPath10),
+            ("auth_a3_a4", Setting.LogPath11)]
+
+
+def grid_phases():
+    # the phases of the models swept as they are over ctap_type, au_type and tr_type, and their files, see GridTemplate
+    return {"reg_unlink": Setting.RegUnlinkPath,
+            "auth_unlink": Setting.AuthUnlinkPath,
+            "auth_a3_a4": Setting.AuthA3A4Path}
+
+
+def open_run(name=None):
+    """
+    read the outputs of the run name in Runs/, or of the last run
+    without any run, the LOG/ and Result/ of the versions before Runs/ are read
+    return False if the run does not exist
+    """
+    name = name or Setting.last_run()
+    if name is None:
+        return True
+    if name not in Setting.runs():
+        print("no run " + name + " in " + Setting.RunsPath)
+        return False
+    Setting.use_run(Setting.RunsPath + name + "/")
+    return True
+
+
+def clean_runs(keep, wait=False):
+    """
+    remove the runs in Runs/ but the last keep ones and the ones still running
+    the directories are moved into Runs/.trash/ at once, then removed by a thread,
+    so a run starts at once however large the outputs of the old runs are,
+    and what is left when the program stops is removed the next time
+    with wait, return when they are removed
+    return the number of runs removed
+    """
+    trash = Setting.RunsPath + ".trash/"
+    runs = Setting.runs()
+    removed = 0
+    for name in runs[:max(len(runs) - keep, 0)]:
+        if Setting.RunsPath + name + "/" == Setting.RunPath or run_is_alive(Setting.RunsPath + name + "/"):
+            continue
+        try:
+            os.makedirs(trash, exist_ok=True)
+            os.replace(Setting.RunsPath + name, trash + name)
+        except OSError:  # removed by another run
+            continue
+        removed += 1
+    if os.path.isdir(trash):
+        thread = Thread(target=shutil.rmtree, args=(trash, True), daemon=True)
+        thread.start()
+        if wait:
+            thread.join()
+    return removed
+
+
+def run_is_alive(path):
+    # the process which wrote its pid in the directory of a run is still running
+    try:
+        f = open(path + "pid")
+        pid = int(f.read())
+        f.close()
+        os.kill(pid, 0)
+    except (OSError, ValueError):
+        return False
+    return True
+
+
+def parse_address(text):
+    # "host:port" -> (host, port), None if it's not an address
+    host, _, port = text.rpartition(":")
+    if not port.isdigit():
+        return None
+    return host, int(port)
+
+
+def telemetry_path(log_path):
+    return log_path[:-len(".log")] + ".jsonl"
+
+
+def journal_path(log_path):
+    return log_path[:-len(".log")] + ".journal"
+
+
+def write_dependencies(phase_list):
+    # the declarations of the lib file used by each case
     Setting.initiate()
-    log1 = open(Setting.LogPath1, mode='w+', encoding='utf-8')
-    log2 = open(Setting.LogPath2, mode='w+', encoding='utf-8')
-    log3 = open(Setting.LogPath3, mode='w+', encoding='utf-8')
-    log4 = open(Setting.LogPath4, mode='w+', encoding='utf-8')
-    log5 = open(Setting.LogPath5, mode='w+', encoding='utf-8')
-    log6 = open(Setting.LogPath6, mode='w+', encoding='utf-8')
-    log7 = open(Setting.LogPath7, mode='w+', encoding='utf-8')
-    log8 = open(Setting.LogPath8, mode='w+', encoding='utf-8')
-    t1 = threading.Thread(target=analysis, args=("reg_client", log1))
-    t2 = threading.Thread(target=analysis, args=("reg_server", log2))
-    t3 = threading.Thread(target=analysis, args=("auth_client_em", log3))
-    t4 = threading.Thread(target=analysis, args=("auth_client_sim", log4))
-    t5 = threading.Thread(target=analysis, args=("auth_client_gen", log5))
-    t6 = threading.Thread(target=analysis, args=("auth_server_em", log6))
-    t7 = threading.Thread(target=analysis, args=("auth_server_sim", log7))
-    t8 = threading.Thread(target=analysis, args=("auth_server_gen", log8))
-    thread_list = [t1, t2, t3, t4, t5, t6, t7, t8]  # run all the phases
+    index = ModelIndex.load()
+    f = open(os.path.dirname(Setting.LogPath1) + "/deps.log", "w")
+    for phase in phase_list:
+        gen = Generator(phase)
+        while True:
+            r, case = gen.generator_case()
+            if r is False:
+                break
+            text = case.render("full")
+            print(phase, case.ctap.name, case.type.name, case.query.name, case.fields.name, case.entities.name,
+                  ":", " ".join(index.used_names(text)), file=f)
+    f.close()
+
+
+def render_cases(phase_list):
+    # write the .pv files of all the cases in TEMP/<phase>/ without running ProVerif
+    Setting.initiate()
+    count = 0
+    for phase in phase_list:
+        path = Setting.ScriptPath + phase + "/"
+        os.makedirs(path)
+        gen = Generator(phase)
+        while True:
+            r, case = gen.generator_case()
+            if r is False:
+                break
+            f = open(path + case.query_name, "w")
+            f.write(case.render("full"))
+            f.close()
+            count += 1
+    print(str(count) + " cases written in " + Setting.ScriptPath)
+
+
+def plan(phase_list):
+    """
+    predict the cost of a sweep of the phases in phase_list with the settings given, nothing is run or removed
+    the cases run by ProVerif are the cases of each phase and query times the part of them run in the last sweeps,
+    the others are skipped by the secure/insecure sets, see CostModel
+    the wall time is the CPU time shared by the jobs, at least the time of the longest case
+    """
+    Setting.prepare()
+    model = CostModel()
+    if not model.stats:
+        print("no runs of ProVerif in " + model.path + " yet, each case is counted " + str(model.default) + "s.")
+    cases = runs = wall = cpu = longest = 0.0
+    for phase in phase_list:
+        gen = Generator(phase)
+        phase_cases = phase_runs = phase_wall = phase_cpu = 0.0
+        while True:
+            r, case = gen.generator_case()
+            if r is False:
+                break
+            share = model.run_share(case)
+            case_wall, case_cpu = model.predict(case)
+            phase_cases += 1
+            phase_runs += share
+            phase_wall += share * case_wall
+            phase_cpu += share * case_cpu
+            longest = max(longest, case_wall)
+        print(phase.ljust(16) + str(int(phase_cases)).rjust(7) + " cases, about " + str(int(round(phase_runs))).rjust(6) +
+              " run by ProVerif, CPU " + format_seconds(phase_cpu) + ", wall " + format_seconds(phase_wall))
+        cases, runs, wall, cpu = cases + phase_cases, runs + phase_runs, wall + phase_wall, cpu + phase_cpu
+    first = model.first_share()
+    print("total: " + str(int(cases)) + " cases, about " + str(int(round(runs))) + " run by ProVerif" +
+          ("" if first is None else " (" + str(round(100 * first)) + "% resolved without the replications)") +
+          ", CPU " + format_seconds(cpu) + ", about " + format_seconds(max(wall / Setting.jobs, longest)) +
+          " with " + str(Setting.jobs) + " jobs.")
+
+
+def format_seconds(seconds):
+    # 42s, 12.5m or 3.2h
+    if seconds < 60:
+        return str(int(round(seconds))) + "s"
+    if seconds < 3600:
+        return str(round(seconds / 60, 1)) + "m"
+    return str(round(seconds / 3600, 1)) + "h"
+
+
+def profile(paths, top):
+    """
+    summarize the json lines of the last run, see write_telemetry()
+    the hottest cases, the time spent by each phase, ctap, type, query and numbers of fields and entities,
+    how many cases are skipped by the secure/insecure sets or served from the cache,
+    and how many cases each step of the ladder decides
+    the time of a run of ProVerif with several queries (--batch) is shared by its cases
+    """
+    records = []
+    for path in paths:
+        if not os.path.exists(path):
+            continue
+        f = open(path, encoding="utf-8")
+        records += [json.loads(line) for line in f if line.strip()]
+        f.close()
+    if not records:
+        print("no telemetry found, run the analysis first.")
+        return
+    for record in records:
+        record["cpu"] = record["user"] + record["sys"]
+        record["share"] = record["wall"] / record["batch"] if record["batch"] else 0.0
+    total_cpu = sum(record["cpu"] for record in records) or 1.0
+    run = [record for record in records if not record["pruned"] and not record["cached"]]
+    pruned = [record for record in records if record["pruned"]]
+    cached = [record for record in records if record["cached"]]
+    print(str(len(records)) + " cases, " + str(len(run)) + " run by ProVerif, " + str(len(cached)) +
+          " served from the cache, " + str(len(pruned)) + " skipped by the secure/insecure sets (" +
+          str(round(100.0 * len(pruned) / len(records), 1)) + "%), " +
+          str(sum(1 for record in records if record["timed_out"])) + " out of time.")
+    print("CPU " + str(round(total_cpu, 1)) + "s, wall " + str(round(sum(record["share"] for record in records), 1)) + "s")
+    print("")
+    print("the hottest cases:")
+    for record in sorted(run, key=lambda record: record["cpu"], reverse=True)[:top]:
+        print(("cpu " + str(round(record["cpu"], 2)) + "s").ljust(14) +
+              ("wall " + str(round(record["share"], 2)) + "s").ljust(15) +
+              ("rss " + str(record["maxrss"] // 1024) + "MB").ljust(11) +
+              record["phase"] + " " + str(record["count"]) + " " + record["verdict"] + " type " + record["type"] +
+              " query " + record["query"] + " ctap " + record["ctap"] + " fields-" + str(record["fields"]) +
+              " mali-" + str(record["entities"]))
+    for dimension in ("phase", "ctap", "type", "query", "fields", "entities"):
+        print("")
+        print(dimension.ljust(18) + "cases".rjust(8) + "run".rjust(8) + "cpu(s)".rjust(10) + "cpu%".rjust(7) +
+              "wall(s)".rjust(10) + "skipped%".rjust(10) + "cached%".rjust(9))
+        groups = {}
+        for record in records:
+            groups.setdefault(record[dimension], []).append(record)
+        for name, group in sorted(groups.items(), key=lambda item: -sum(record["cpu"] for record in item[1])):
+            cpu = sum(record["cpu"] for record in group)
+            print(str(name).ljust(18) + str(len(group)).rjust(8) +
+                  str(sum(1 for record in group if not record["pruned"] and not record["cached"])).rjust(8) +
+                  str(round(cpu, 1)).rjust(10) + str(round(100.0 * cpu / total_cpu, 1)).rjust(7) +
+                  str(round(sum(record["share"] for record in group), 1)).rjust(10) +
+                  str(round(100.0 * sum(1 for record in group if record["pruned"]) / len(group), 1)).rjust(10) +
+                  str(round(100.0 * sum(1 for record in group if record["cached"]) / len(group), 1)).rjust(9))
+    steps = {}
+    for record in records:
+        count_steps(steps, record.get("steps", []))
+    if steps:
+        print("")
+        print("step".ljust(18) + "runs".rjust(8) + "decided".rjust(9) + "decided%".rjust(10) + "tout".rjust(7) +
+              "cached%".rjust(9))
+        for step in step_order(steps):
+            runs, decided, timeouts, cached = steps[step]
+            print(step.ljust(18) + str(runs).rjust(8) + str(decided).rjust(9) +
+                  str(round(100.0 * decided / runs, 1)).rjust(10) + str(timeouts).rjust(7) +
+                  str(round(100.0 * cached / runs, 1)).rjust(9))
+
+
+def wait_for_change(files):
+    # wait until a model file is saved, return the new modification times
+    while True:
+        time.sleep(1)
+        try:
+            current = Setting.model_files()
+        except OSError:  # the file is being saved
+            continue
+        if current != files:
+            return current
+
+
+def main(argv):
+    """
+    the command line: argv is sys.argv, the options are in print_help()
+    """
+    # run all the phases of Reg.pv and Auth.pv, the phases of grid_phases() are chosen by -t
+    phase_list = [phase for phase, path in phase_logs() if phase not in grid_phases()]
+    targeted = False  # -t is given, the phases are added to phase_list
+    if argv[1:2] == ["clean"]:  # remove the old runs
+        keep = 1
+        try:
+            options, args = getopt.getopt(argv[2:], "", ["keep="])
+        except getopt.GetoptError:
+            print("wrong option!")
+            print_help()
+            sys.exit()
+        for option, value in options:
+            if not str(value).isdigit() or int(value) < 1:
+                print("wrong argument!")
+                print_help()
+                sys.exit()
+            keep = int(value)
+        print(str(clean_runs(keep, True)) + " runs removed from " + Setting.RunsPath)
+        sys.exit()
+    if argv[1:2] == ["profile"]:  # summarize the telemetry of the last run
+        top = 20
+        try:
+            options, args = getopt.getopt(argv[2:], "", ["top=", "run="])
+        except getopt.GetoptError:
+            print("wrong option!")
+            print_help()
+            sys.exit()
+        run = None
+        for option, value in options:
+            if option == "--run":
+                run = str(value)
+            elif not str(value).isdigit():
+                print("wrong argument!")
+                print_help()
+                sys.exit()
+            else:
+                top = int(value)
+        if not open_run(run):
+            sys.exit()
+        profile([telemetry_path(path) for phase, path in phase_logs()], top)
+        sys.exit()
+    if argv[1:2] in (["export"], ["assumptions"]):  # read Result/results.db
+        command = argv[1]
+        selected = {}
+        try:
+            options, args = getopt.gnu_getopt(argv[2:], "t:", ["target=", "dir=", "query=", "ctap=", "type=", "run="])
+        except getopt.GetoptError:
+            print("wrong option!")
+            print_help()
+            sys.exit()
+        for option, value in options:
+            selected[option.lstrip("-")] = str(value)
+        if not open_run(selected.get("run")):
+            sys.exit()
+        phases = [phase for phase, path in phase_logs() if selected.get("t", selected.get("target", phase)) == phase]
+        if not phases or not os.path.exists(Setting.ResultPath + "results.db"):
+            print("wrong argument!" if not phases else "no results in " + Setting.ResultPath + "results.db")
+            sys.exit()
+        Setting.prepare()
+        store = ResultStore.get()
+        if command == "export":
+            path = os.path.abspath(selected.get("dir", Setting.ResultPath)) + "/"
+            print(str(store.export(path, phases)) + " analysis files written in " + path)
+        for phase in phases if command == "assumptions" else []:
+            for block, secure, insecure in store.assumptions(phase, selected.get("query"), selected.get("ctap"),
+                                                             selected.get("type")):
+                print(phase + " type " + block[0] + " ctap " + block[1] + " query " + block[2])
+                for name in secure:
+                    print("    true  with at most: " + name)
+                for name in insecure:
+                    print("    false with at least: " + name)
+        sys.exit()
+    if argv[1:2] == ["worker"]:  # run the cases of a coordinator started with --listen
+        slots = os.cpu_count() or 1
+        root = os.path.join(os.path.expanduser("~"), ".FIDO2Verif-worker")
+        try:
+            options, args = getopt.gnu_getopt(argv[2:], "j:", ["jobs=", "dir="])
+        except getopt.GetoptError:
+            print("wrong option!")
+            print_help()
+            sys.exit()
+        address = parse_address(args[0]) if len(args) == 1 else None
+        for option, value in options:
+            if option in ("-j", "--jobs") and str(value).isdigit() and int(value) > 0:
+                slots = int(value)
+            elif option == "--dir":
+                root = str(value)
+            else:
+                address = None
+        if address is None:
+            print("wrong argument!")
+            print_help()
+            sys.exit()
+        RemoteWorker(address, slots, root).run()
+        sys.exit()
+    deps_only = False  # only write the declarations used by each case
+    render_only = False  # only write the .pv files of the cases
+    plan_only = False    # only predict the cost of the sweep
     try:
-        options, args = getopt.getopt(sys.argv[1:], "-h-help-t:-target:-s-simple", ["help", "target="])
+        options, args = getopt.getopt(argv[1:], "-h-help-t:-target:-s-simple-j:",
+                                       ["help", "target=", "jobs=", "no-cache", "cache-size=", "watch", "deps", "frontier",
+                                        "timeouts=", "ladder=", "render", "batch", "no-trace", "backend=", "resume",
+                                        "listen=", "order=", "shard=", "schedule=", "plan", "keep=", "progress", "metrics="])
     except getopt.GetoptError:
         print("wrong option!")
         print_help()
@@ -895,39 +4167,144 @@ if __name__ == "__main__":
         if option in ("-h", "-help", "--help"):
             print_help()
             sys.exit()
-        elif option in ("-t","--t","--target","-target"): # if specific which phase to analyze, then clean the tlist
-            thread_list = []
-            if str(value) == "reg_client":
-                thread_list.append(t1)
-            elif str(value) == "reg_server":
-                thread_list.append(t2)
-            elif str(value) == "auth_client_em":
-                thread_list.append(t3)
-            elif str(value) == "auth_client_sim":
-                thread_list.append(t4)
-            elif str(value) == "auth_client_gen":
-                thread_list.append(t5)
-            elif str(value) == "auth_server_em":
-                thread_list.append(t6)
-            elif str(value) == "auth_server_sim":
-                thread_list.append(t7)
-            elif str(value) == "auth_server_gen":
-                thread_list.append(t8)
+        elif option in ("-t","--t","--target","-target"): # if specific which phase to analyze, then clean the phase list
+            if not targeted:
+                phase_list = []
+                targeted = True
+            if str(value) in [phase for phase, path in phase_logs()]:
+                if str(value) not in phase_list:
+                    phase_list.append(str(value))
             else:
                 print("wrong argument!")
         elif option in ("-simple", "-s"):
             Setting.analyze_flag = "simple"
+        elif option in ("-j", "--jobs"):
+            if not str(value).isdigit() or int(value) < 1:
+                print("wrong argument!")
+                print_help()
+                sys.exit()
+            Setting.jobs = int(value)
+        elif option == "--no-cache":
+            Setting.use_cache = False
+        elif option == "--cache-size":
+            if not str(value).isdigit():
+                print("wrong argument!")
+                print_help()
+                sys.exit()
+            Setting.cache_size = int(value)
+        elif option == "--watch":
+            Setting.watch = True
+        elif option == "--deps":
+            deps_only = True
+        elif option == "--render":
+            render_only = True
+        elif option == "--batch":
+            Setting.batch = True
+        elif option == "--no-trace":
+            Setting.trace = False
+        elif option == "--order":
+            if str(value) not in ("sweep", "cheapest", "informative"):
+                print("wrong argument!")
+                print_help()
+                sys.exit()
+            Setting.order = str(value)
+        elif option == "--schedule":
+            if str(value) not in ("lpt", "fifo"):
+                print("wrong argument!")
+                print_help()
+                sys.exit()
+            Setting.schedule = str(value)
+        elif option == "--plan":
+            plan_only = True
+        elif option == "--keep":
+            if not str(value).isdigit():
+                print("wrong argument!")
+                print_help()
+                sys.exit()
+            Setting.keep_runs = int(value)
+        elif option == "--shard":
+            index, _, count = str(value).partition("/")
+            if not index.isdigit() or not count.isdigit() or not 1 <= int(index) <= int(count):
+                print("wrong argument!")
+                print_help()
+                sys.exit()
+            Setting.shard = [int(index), int(count)]
+        elif option == "--listen":
+            Setting.listen = parse_address(str(value))
+            if Setting.listen is None:
+                print("wrong argument!")
+                print_help()
+                sys.exit()
+        elif option == "--resume":
+            Setting.resume = True
+        elif option == "--progress":
+            Setting.progress = True
+        elif option == "--metrics":
+            Setting.metrics = parse_address(str(value))
+            if Setting.metrics is None:
+                print("wrong argument!")
+                print_help()
+                sys.exit()
+        elif option == "--backend":
+            name, _, path = str(value).partition(":")
+            if name not in ("proverif", "replay", "simulate") or (name != "proverif") != (path != "") or \
+                    (name == "simulate" and not os.path.isfile(path)):
+                print("wrong argument!")
+                print_help()
+                sys.exit()
+            Setting.backend = name
+            Setting.backend_path = os.path.abspath(path) if path else ""
+            if name == "simulate":  # the simulated verdicts are not kept in the cache
+                Setting.use_cache = False
+        elif option == "--frontier":
+            Setting.search = "frontier"
+        elif option == "--timeouts":
+            timeouts = str(value).split(",")
+            if not all(timeout.isdigit() and int(timeout) > 0 for timeout in timeouts):
+                print("wrong argument!")
+                print_help()
+                sys.exit()
+            Setting.timeouts = sorted(int(timeout) for timeout in timeouts)
+        elif option == "--ladder":
+            ladder = str(value).split(",")
+            if not all(re.match(r"\w+(\+\w+)*$", step) for step in ladder) or ladder[-1] != "full" or \
+                    len(set(ladder)) != len(ladder):
+                print("wrong argument!")
+                print_help()
+                sys.exit()
+            Setting.ladder = ladder
         else:
             print("wrong option!")
-    for t in thread_list:
-        t.start()
-    for t in thread_list:
-        t.join()
-    log1.close()
-    log2.close()
-    log3.close()
-    log4.close()
-    log5.close()
-    log6.close()
-    log7.close()
-    log8.close()
+    if not Setting.use_cache and Setting.backend != "simulate" and not (deps_only or render_only or plan_only):
+        # the cases whose declarations did not change are only skipped by the verdicts of the cache
+        print("--no-cache: every case is verified by ProVerif again, even if the declarations it uses did not change.")
+    if Setting.batch and Setting.search == "frontier":
+        print("--batch and --frontier can not be used together!")
+        print_help()
+        sys.exit()
+    if deps_only:
+        write_dependencies(phase_list)
+        sys.exit()
+    if render_only:
+        render_cases(phase_list)
+        sys.exit()
+    if plan_only:
+        plan(phase_list)
+        sys.exit()
+    Setting.initiate()
+    files = Setting.model_files()
+    index = ModelIndex.load()
+    sweep(phase_list)
+    Setting.resume = False
+    while Setting.watch:
+        print("watching the model files, press Ctrl+C to stop.")
+        files = wait_for_change(files)
+        Setting.initiate()
+        changed = ModelIndex.load().changed_names(index)
+        index = ModelIndex.current
+        print("model changed: " + (", ".join(changed) if changed else "no declarations in the lib file"))
+        sweep(phase_list)
+
+
+if __name__ == "__main__":
+    main(sys.argv)